@@ -1,9 +1,9 @@
 import logging
 import requests
 from datetime import datetime, timedelta
-import xmltodict
+import xml.etree.ElementTree as ET
 from services.entsoe_aux import *
-import json
+from services.entsoe_parser import parse_market_document, latest_generation
 
 def load_co2_by_type(file_path='entsoe_tables/CO2.csv'):
     CO2_by_gentype = {}
@@ -42,51 +42,18 @@ def get_actual_generation_by_type(ENTSO_E_API_KEY, country_name):
     # Make the query
     response = requests.get(endpoint, params=params)
 
-    # Transform the query response to JSON dictionary
-    data_xml = response.text
-    data_dict = xmltodict.parse(data_xml)
-    #logging.info(json.dumps(data_dict, indent=4))
-    data_json = json.loads(json.dumps(data_dict))
-
     # Handle the response
     if response.status_code == 200:
-        #logging.info("Data has been received correctly")
-        gens = {}
-        time_series_list = data_json['GL_MarketDocument'].get('TimeSeries', [])
-        last_up_time = yesterday_datetime
-        date_format = "%Y-%m-%dT%H:%MZ"
-        if isinstance(time_series_list, list) and len(time_series_list) > 0:
-            #logging.info(f"Data is list")
-            #get last hour
-            for time_series in time_series_list:
-                update_time_str = time_series['Period']['timeInterval']['end']
-                update_time = datetime.strptime(update_time_str, date_format)
-                if update_time > last_up_time:
-                    last_up_time = update_time
-            
-            #logging.info(f"Last update: {last_up_time} UTC")
-            last_up_time_str = last_up_time.strftime(date_format)
-            #get generation by type in the last hour
-            entsoe_gentype_names = load_entsoe_gentype_names()
-            for time_series in time_series_list:
-                if last_up_time_str == time_series['Period']['timeInterval']['end']:
-                    if 'inBiddingZone_Domain.mRID' in time_series:
-                        gens[entsoe_gentype_names[time_series['MktPSRType']['psrType']]] = int(time_series['Period']['Point'][-1]['quantity'])
-                    else:
-                        if entsoe_gentype_names[time_series['MktPSRType']['psrType']] in gens:
-                            gens[entsoe_gentype_names[time_series['MktPSRType']['psrType']]] -= 0
-                        else:
-                            gens[entsoe_gentype_names[time_series['MktPSRType']['psrType']]] = 0
-            #logging.info(gens)
-            gens = {key: value for key, value in gens.items() if value != 0}
-        else:
-            logging.info("Data is NOT list!")
-
-        #logging.info(gens)
-        return gens
+        try:
+            document = parse_market_document(response.content)
+        except ET.ParseError as e:
+            logging.error(f"Failed to parse the generation by type: {e}")
+            return {"error": "Failed to parse the ENTSO-E response"}
+        #get generation by type in the last hour
+        return latest_generation(document, load_entsoe_gentype_names())
     else:
         logging.error(f"Failed to retrieve data. Status code: {response.status_code}")
-        logging.error(f"Error response: {data_json}")
+        logging.error(f"Error response: {response.text}")
         return {"error": f"Failed to retrieve data. Status code: {response.status_code}"}
     
 def get_CO2_from_dict(power_dict, co2_dict):
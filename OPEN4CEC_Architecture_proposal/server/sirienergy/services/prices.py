@@ -1,9 +1,9 @@
 import logging
 import requests
 from datetime import datetime, timedelta
-import xmltodict
+import xml.etree.ElementTree as ET
 from services.entsoe_aux import load_entsoe_country_keys
-import json
+from services.entsoe_parser import parse_market_document, build_series
 
 def get_day_ahead_prices(ENTSO_E_API_KEY, country_name):
     # Get the endpoint
@@ -34,34 +34,26 @@ def get_day_ahead_prices(ENTSO_E_API_KEY, country_name):
     # Make the query
     response = requests.get(endpoint, params=params)
 
-    # Transform the query response to JSON dictionary
-    data_xml = response.text
-    data_dict = xmltodict.parse(data_xml)
-    data_json = json.loads(json.dumps(data_dict))
-
     # Handle the response
     if response.status_code == 200:
-
-        time_series_list = data_json['Publication_MarketDocument'].get('TimeSeries', [])
-
-        # Case 1: Data is in different formats, and we need to get only PT60
-        if isinstance(time_series_list, list) and len(time_series_list) > 0:
-            for time_series in time_series_list:
-                if time_series['Period']['resolution'] == 'PT60M':
-                    points = time_series['Period']['Point']
-                    break  
-            else:
-                points = []
-        # Case 2: Data is only in the format we want
-        elif time_series_list['Period']['resolution'] == 'PT60M':
-            points = time_series_list['Period']['Point']
-        # Case 3: Any other format
-        else:
-            logging.info(f"Case 3: Incorrect format: {time_series_list}")
-            points = []
-        
-        return points
+        # Parse the XML straight into arrays, every resolution published
+        try:
+            document = parse_market_document(response.content)
+        except ET.ParseError as e:
+            logging.error(f"Failed to parse the day-ahead prices: {e}")
+            return {"error": "Failed to parse the ENTSO-E response"}
+        if document["reason"]:
+            logging.info(f"No day-ahead prices: {document['reason']}")
+        # The window may touch the previous delivery day, keep the last one
+        periods = document["timeseries"]
+        if periods:
+            last_start = max(period["start"] for period in periods)
+            periods = [period for period in periods if period["start"] == last_start]
+        # Hourly points, averaged from finer products when only those are published
+        _, values = build_series(periods, 'PT60M')
+        return [{"position": str(position), "price.amount": str(round(value, 5))}
+                for position, value in enumerate(values.tolist(), start=1) if value == value]
     else:
         logging.error(f"Failed to retrieve data. Status code: {response.status_code}")
-        logging.error(f"Error response: {data_json}")
+        logging.error(f"Error response: {response.text}")
         return {"error": f"Failed to retrieve data. Status code: {response.status_code}"}
\ No newline at end of file
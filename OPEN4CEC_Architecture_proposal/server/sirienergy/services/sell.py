@@ -1,34 +1,16 @@
 import logging
+import numpy as np
 from services.prices import get_day_ahead_prices
+from services.entsoe_parser import forward_fill
 
 def entsoe_to_array(data):
-    max_position = max(int(item['position']) for item in data)
-    
-    # Initialize the result array with None values
-    result = [None] * max_position
-
-    # Fill the result array with prices, filling missing values with the previous one
-    previous_value = None
-    for item in data:
-        position = int(item['position']) - 1  # Convert to 0-based index
-        price = float(item['price.amount'])
-        
-        # Fill any missing positions with the previous value
-        if previous_value is not None and position > 0:
-            for i in range(position):
-                if result[i] is None:
-                    result[i] = previous_value
-        
-        # Set the current price and update the previous value
-        result[position] = price
-        previous_value = price
-
-    # Fill any remaining None values with the previous value
-    for i in range(len(result)):
-        if result[i] is None:
-            result[i] = previous_value
-
-    return result
+    positions = np.array([int(item['position']) for item in data])
+    result = np.full(positions.max(), np.nan)
+    result[positions - 1] = [float(item['price.amount']) for item in data]
+    # Missing positions repeat the previous price, the leading ones the first price
+    result = forward_fill(result)
+    result[np.isnan(result)] = result[~np.isnan(result)][0]
+    return result.tolist()
 
 def get_price_array(ENTSO_E_API_KEY, country_name, type, fixed_value = 0):
     # validation
@@ -68,4 +50,4 @@ def sell_by_hours(price_array, gen_array):
     if len(price_array)!= len(gen_array):
         logging.error("Both arrays must have the same length")
         return None 
-    return [a*b for a,b in zip(price_array, gen_array)]
+    return np.multiply(price_array, gen_array).tolist()
@@ -0,0 +1,28 @@
+"""
+Checks that the files copied between the two servers are still identical. Each server is
+built from its own folder (Docker build context), so shared code is kept as copies.
+
+Run from the repository root:
+    python check_shared_files.py
+"""
+import filecmp
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# (file, copy) pairs, paths from the repository root
+SHARED_FILES = [
+    ("sirienergy/app/models/entsoe_parser.py",
+     "OPEN4CEC_Architecture_proposal/server/sirienergy/services/entsoe_parser.py"),
+]
+
+def main():
+    different = [(source, copy) for source, copy in SHARED_FILES
+                 if not filecmp.cmp(os.path.join(ROOT, source), os.path.join(ROOT, copy), shallow=False)]
+    for source, copy in different:
+        print(f"{copy} differs from {source}")
+    return 1 if different else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,5 @@
 from flask import Flask
+from app.config import Config
 
 def create_app():
     app = Flask(__name__, static_folder='static', static_url_path='/static_files')
@@ -16,5 +17,24 @@ def create_app():
     app.register_blueprint(pvlib_bp, url_prefix='/')
     from app.controllers.mix_controller import mix_bp
     app.register_blueprint(mix_bp, url_prefix='/')
+    from app.controllers.metrics_controller import metrics_bp
+    app.register_blueprint(metrics_bp, url_prefix='/')
+
+    # Métricas de cada ruta (peticiones, duración y en curso), servidas en /metrics
+    from app.metrics import instrument_app
+    instrument_app(app)
+
+    # Registrar comandos (flask --app run <command>)
+    from app.commands import migrate_readings, compute_sharing, backfill_archive, precompute_irradiance
+    app.cli.add_command(migrate_readings)
+    app.cli.add_command(compute_sharing)
+    app.cli.add_command(backfill_archive)
+    app.cli.add_command(precompute_irradiance)
+
+    # Precalcular datos de ENTSO-E en segundo plano (un solo worker elegido en Redis), desde la
+    # primera petición servida para que los comandos de la CLI no lo arranquen
+    if Config.PREFETCH_ENABLED and Config.ENTSO_E_API_KEY:
+        from app.scheduler import start_scheduler_when_serving
+        start_scheduler_when_serving(app)
 
     return app
@@ -0,0 +1,99 @@
+import click
+import numpy as np
+from app.config import Config
+from app.models.CEC_model import RedisModel
+from app.models.CEC_community import CommunityEngine
+from app.models.CEC_sharing import SHARING_METHODS, SharingEngine
+from app.models.ENTSOE_models import load_entsoe_country_keys
+from app.models.archive_model import ARCHIVE_DATASETS, EntsoeArchive
+from app.models.irradiance_grid import build_irradiance_grid
+
+@click.command('migrate-readings')
+@click.option('--user', 'user_email', default=None, help='Migrate only this user e-mail.')
+@click.option('--batch-size', default=100, show_default=True, help='SCAN count hint.')
+def migrate_readings(user_email, batch_size):
+    """
+    Moves readings from the old one-document-per-user layout to per-day keys.
+    Safe to run while the app is serving requests.
+    """
+    redis_model = RedisModel()
+    if user_email:
+        days = redis_model.migrate_user(user_email)
+        click.echo(f"User {user_email}: {days} day documents migrated.")
+    else:
+        summary = redis_model.migrate_all_users(batch_size)
+        click.echo(f"{summary['users']} users visited, {summary['days']} day documents migrated.")
+        click.echo("Migration marked as complete, reads no longer look into user documents.")
+
+@click.command('compute-sharing')
+@click.argument('community')
+@click.argument('month')
+@click.option('--method', type=click.Choice(SHARING_METHODS), default='dynamic', show_default=True)
+def compute_sharing(community, month, method):
+    """
+    Computes and stores the energy sharing of a community for a month (YYYY-MM).
+    """
+    redis_model = RedisModel()
+    try:
+        summary = SharingEngine(redis_model, CommunityEngine(redis_model)).compute_month(community, month, method)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"{summary['members']} members, {summary['production']:.3f} produced, "
+               f"{summary['self_consumed']:.3f} self-consumed, {summary['leftover']:.3f} left over.")
+
+@click.command('backfill-archive')
+@click.argument('dataset', type=click.Choice(ARCHIVE_DATASETS))
+@click.argument('start_month')
+@click.argument('end_month')
+@click.option('--country', 'countries', multiple=True, help='Only this country (repeatable). Defaults to every zone.')
+def backfill_archive(dataset, start_month, end_month, countries):
+    """
+    Downloads ENTSO-E prices or generation by type between two months (YYYY-MM, both
+    included) into the local archive. Months already complete are skipped.
+    """
+    entsoe_country_keys = load_entsoe_country_keys()
+    unknown = [country for country in countries if country not in entsoe_country_keys]
+    if unknown:
+        raise click.BadParameter(f"Unknown countries: {', '.join(unknown)}")
+    zone_keys = sorted({entsoe_country_keys[country] for country in countries or entsoe_country_keys})
+
+    def progress(zone_key, month, result):
+        click.echo(f"{zone_key} {month}: {result if isinstance(result, str) else f'{result} values added'}")
+
+    try:
+        summary = EntsoeArchive().backfill(dataset, zone_keys, start_month, end_month, progress)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"{summary['fetched']} months fetched, {summary['skipped']} skipped, "
+               f"{summary['failed']} failed, {summary['values']} values added.")
+
+def grid_axis(bounds, step):
+    # Nodes from min to max (both included) every step
+    low, high = bounds
+    return np.round(low + np.arange(int(round((high - low) / step)) + 1) * step, 6)
+
+@click.command('precompute-irradiance')
+@click.option('--latitude', 'latitudes', type=float, nargs=2, required=True, help='Minimum and maximum latitude.')
+@click.option('--longitude', 'longitudes', type=float, nargs=2, required=True, help='Minimum and maximum longitude.')
+@click.option('--step', type=float, default=0.05, show_default=True, help='Degrees between nodes.')
+@click.option('--altitude', 'altitudes', type=float, multiple=True, help='Altitude node in meters (repeatable). Defaults to 0, 250, 500, 1000 and 2000.')
+@click.option('--path', default=None, help='Grid file. Defaults to PV_GRID_PATH.')
+def precompute_irradiance(latitudes, longitudes, step, altitudes, path):
+    """
+    Precomputes the clear-sky irradiance (GHI, DNI, DHI) of every hour of the year on a
+    latitude x longitude x altitude grid, used by get_PV_gen instead of pvlib on the grid.
+    Running workers switch to the new file on their next PV request, no restart is needed.
+    """
+    if latitudes[0] > latitudes[1] or longitudes[0] > longitudes[1] or step <= 0:
+        raise click.BadParameter("Bounds must be given as minimum and maximum, with a positive step")
+    altitudes = sorted(set(altitudes or (0, 250, 500, 1000, 2000)))
+
+    def progress(done, total):
+        if done % 50 == 0 or done == total:
+            click.echo(f"{done}/{total} nodes computed")
+
+    try:
+        max_error = build_irradiance_grid(grid_axis(latitudes, step), grid_axis(longitudes, step), altitudes, path, progress)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Largest GHI interpolation error: {max_error:.2f} W/m2 (tolerance {Config.PV_GRID_TOLERANCE} W/m2).")
@@ -5,3 +5,79 @@ class Config:
     REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
     WEATHER_API_API_KEY = os.getenv('WEATHER_API_API_KEY')
     ENTSO_E_API_KEY = os.getenv('ENTSO_E_API_KEY')
+    # Upstream APIs (pointed at a local stub server by the benchmarks)
+    ENTSOE_API_URL = os.getenv('ENTSOE_API_URL', 'https://web-api.tp.entsoe.eu/api')
+    OPEN_METEO_URL = os.getenv('OPEN_METEO_URL', 'https://api.open-meteo.com/v1/forecast')
+    # Also read hours from user documents not yet moved to per-day keys, until a full
+    # `flask migrate-readings` run marks the migration as done
+    LEGACY_READINGS_FALLBACK = os.getenv('LEGACY_READINGS_FALLBACK', '1') == '1'
+    # Readings storage backend: 'json' (object keyed "HH:MM" per user-day), 'packed' (float32 array
+    # per user-day) or 'timeseries' (RedisTimeSeries series per user, needs Redis Stack)
+    READINGS_BACKEND = os.getenv('READINGS_BACKEND', 'json')
+    # Slots per day of the readings series: 24 (hourly) or 96 (15 minutes)
+    READINGS_SLOTS_PER_DAY = int(os.getenv('READINGS_SLOTS_PER_DAY', 24))
+    # Longest date range served by the range queries
+    MAX_RANGE_DAYS = int(os.getenv('MAX_RANGE_DAYS', 1096))
+    # Keys read per MGET when loading many users at once
+    REDIS_BATCH_SIZE = int(os.getenv('REDIS_BATCH_SIZE', 1000))
+    # Shared cache (in-process LRU in front of Redis)
+    CACHE_LOCAL_SIZE = int(os.getenv('CACHE_LOCAL_SIZE', 1024))
+    CACHE_STALE_SECONDS = int(os.getenv('CACHE_STALE_SECONDS', 3600))
+    CACHE_WAIT_SECONDS = float(os.getenv('CACHE_WAIT_SECONDS', 5))
+    # Day-ahead auction results publication (local time of the timezone below)
+    DAY_AHEAD_PUBLICATION_TIME = os.getenv('DAY_AHEAD_PUBLICATION_TIME', '13:00')
+    DAY_AHEAD_PUBLICATION_TZ = os.getenv('DAY_AHEAD_PUBLICATION_TZ', 'Europe/Brussels')
+    DAY_AHEAD_EMPTY_TTL = int(os.getenv('DAY_AHEAD_EMPTY_TTL', 300))
+    # Timeout of the ENTSO-E requests (seconds)
+    ENTSOE_TIMEOUT = float(os.getenv('ENTSOE_TIMEOUT', 30))
+    # Concurrent upstream requests of the multi-country endpoints, and countries per request
+    BATCH_WORKERS = int(os.getenv('BATCH_WORKERS', 8))
+    BATCH_MAX_COUNTRIES = int(os.getenv('BATCH_MAX_COUNTRIES', 50))
+    # Threads running the price and PV stages of /sell side by side (two per request)
+    SELL_WORKERS = int(os.getenv('SELL_WORKERS', 8))
+    # Generation by type refresh interval (ENTSO-E publishes every 15 minutes)
+    GENERATION_REFRESH_SECONDS = int(os.getenv('GENERATION_REFRESH_SECONDS', 900))
+    # Background prefetch of ENTSO-E data (app/scheduler.py), run by one elected worker and
+    # started with the first request served (never by the flask CLI commands)
+    PREFETCH_ENABLED = os.getenv('PREFETCH_ENABLED', '1') == '1'
+    PREFETCH_WORKERS = int(os.getenv('PREFETCH_WORKERS', 4))
+    PREFETCH_JITTER_SECONDS = int(os.getenv('PREFETCH_JITTER_SECONDS', 60))
+    PREFETCH_PUBLICATION_DELAY = int(os.getenv('PREFETCH_PUBLICATION_DELAY', 300))
+    PREFETCH_MAX_RETRIES = int(os.getenv('PREFETCH_MAX_RETRIES', 12))
+    PREFETCH_LEASE_SECONDS = int(os.getenv('PREFETCH_LEASE_SECONDS', 30))
+    # Local archive of ENTSO-E data (flask backfill-archive): folder and slot length in minutes
+    ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'archive')
+    ARCHIVE_SLOT_MINUTES = int(os.getenv('ARCHIVE_SLOT_MINUTES', 15))
+    # Clear-sky PV cache: location quantization (degrees, meters), in-process entries and lifetime (seconds)
+    PV_COORD_STEP = float(os.getenv('PV_COORD_STEP', 0.01))
+    PV_ALTITUDE_STEP = float(os.getenv('PV_ALTITUDE_STEP', 10))
+    CLEAR_SKY_CACHE_SIZE = int(os.getenv('CLEAR_SKY_CACHE_SIZE', 4096))
+    CLEAR_SKY_TTL = int(os.getenv('CLEAR_SKY_TTL', 30 * 24 * 3600))
+    # Sites per request of the multi-site PV endpoint
+    PV_BATCH_MAX_SITES = int(os.getenv('PV_BATCH_MAX_SITES', 5000))
+    # PV simulation over date ranges: longest range (days) and days computed per chunk
+    PV_MAX_RANGE_DAYS = int(os.getenv('PV_MAX_RANGE_DAYS', 5 * 366))
+    PV_CHUNK_DAYS = int(os.getenv('PV_CHUNK_DAYS', 31))
+    # Precomputed clear-sky grid (flask precompute-irradiance) and largest interpolation error accepted (W/m2)
+    PV_GRID_PATH = os.getenv('PV_GRID_PATH', 'irradiance_grid.npy')
+    PV_GRID_TOLERANCE = float(os.getenv('PV_GRID_TOLERANCE', 10))
+    # Open-Meteo client: HTTP cache backend ('sqlite', 'redis' or 'memory'), SQLite file and lifetime (seconds)
+    WEATHER_CACHE_BACKEND = os.getenv('WEATHER_CACHE_BACKEND', 'sqlite')
+    WEATHER_CACHE_PATH = os.getenv('WEATHER_CACHE_PATH', '.cache')
+    WEATHER_CACHE_SECONDS = int(os.getenv('WEATHER_CACHE_SECONDS', 3600))
+    # Coordinates are rounded to this step (degrees) so nearby users share cached forecasts
+    WEATHER_COORD_STEP = float(os.getenv('WEATHER_COORD_STEP', 0.05))
+    # Kept-alive connections to Open-Meteo per process (also the concurrent requests), retries and timeout
+    WEATHER_POOL_SIZE = int(os.getenv('WEATHER_POOL_SIZE', 10))
+    WEATHER_RETRIES = int(os.getenv('WEATHER_RETRIES', 5))
+    WEATHER_TIMEOUT = int(os.getenv('WEATHER_TIMEOUT', 10))
+    # Recorded Open-Meteo responses, replayed instead of the API when set ('replay' or 'record')
+    WEATHER_RECORDINGS_DIR = os.getenv('WEATHER_RECORDINGS_DIR', '')
+    WEATHER_RECORDINGS_MODE = os.getenv('WEATHER_RECORDINGS_MODE', 'replay')
+    # Power change of the PV panels per degree of cell temperature above 25 C (fraction, forecast mode)
+    PV_TEMPERATURE_COEFFICIENT = float(os.getenv('PV_TEMPERATURE_COEFFICIENT', -0.004))
+    # Metrics of several worker processes (gunicorn): folder where every worker writes its own
+    # (unset for a single process; the files of exited workers are folded into one) and how often
+    # it is written (seconds)
+    METRICS_DIR = os.getenv('METRICS_DIR', '')
+    METRICS_FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', 5))
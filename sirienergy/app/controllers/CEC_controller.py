@@ -1,26 +1,19 @@
 from flask import Blueprint, request, jsonify
-from app.models.CEC_model import RedisModel
+from app.models.CEC_model import RedisModel, RANGE_RESOLUTIONS, aggregate_days, slot_labels
+from app.models.CEC_community import CommunityEngine
+from app.models.CEC_sharing import SharingEngine
 import re
 from datetime import datetime
-import sys
-import os
 
 
 redis_bp = Blueprint('redis', __name__)
 redis_model = RedisModel()
+community_engine = CommunityEngine(redis_model)
+sharing_engine = SharingEngine(redis_model, community_engine)
 
-def complete_and_order_hours(data, default_value=0):
-        
-    # Generate all 24 hours in "HH:00" format
-    all_hours = [(datetime(2000, 1, 1, h)).strftime("%H:00") for h in range(24)]
-
-    # Fill missing hours with the default value
-    completed_data = {hour: data.get(hour, default_value) for hour in all_hours}
-
-    # Order the dictionary by hour
-    ordered_data = dict(sorted(completed_data.items()))
-
-    return ordered_data
+def series_to_hourly(series):
+    # Day series are already ordered and zero filled, only the "HH:MM" labels are added
+    return dict(zip(slot_labels(len(series)), series.tolist()))
 
 def is_valid_email(email):
     # Define a regular expression for validating an email
@@ -35,6 +28,7 @@ def create_user():
         user_email = data.get('user_email')
         user_name = data.get('user_name')
         user_password = data.get('user_password')
+        community = data.get('community')
     except Exception as e:
         return jsonify({"error": f"Invalid input: {str(e)}"}), 400
 
@@ -48,8 +42,10 @@ def create_user():
     
     # Create user using the model's create_user method
     try:
-        response = redis_model.create_user(user_name, user_email, user_password)
+        response = redis_model.create_user(user_name, user_email, user_password, community)
         return jsonify(response), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -86,6 +82,22 @@ def add_production():
         return jsonify(response), 200
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
+
+@redis_bp.route('/add_readings_batch', methods=['POST'])
+def add_readings_batch():
+    try:
+        data = request.json
+        records = data['readings']
+    except KeyError as e:
+        return jsonify({"error": f"Missing key: {str(e)}"}), 400
+    if not isinstance(records, list):
+        return jsonify({"error": "'readings' must be a list"}), 400
+
+    try:
+        response = redis_model.add_readings_batch(records)
+        return jsonify(response), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
     
 @redis_bp.route('/get_production_day', methods=['POST'])
 def get_production():
@@ -96,18 +108,12 @@ def get_production():
         return jsonify({"error": f"Missing key: {str(e)}"}), 400
     
     try:
-        existing_data = redis_model.get_user(user_email)
-        print(f"(Production) User data: {existing_data}", file=sys.stderr)
-        if existing_data is None:
+        if not redis_model.user_exists(user_email):
             return jsonify({"error" : "user not registered"}), 400
         else:
             current_date = datetime.now().strftime("%Y-%m-%d")
-            response = redis_model.get_production_day(user_email, current_date)
-            print(f"""|{os.getpid()}| [Controller] (get_production)
-                  Non completed dict: {response}""", file=sys.stderr)
-            response = response[0]
-            response = complete_and_order_hours(response)
-            print(f"(Production) Completed dict: {response}", file=sys.stderr)
+            series = redis_model.get_day_series(user_email, "production", current_date)
+            response = series_to_hourly(series)
             return jsonify({"hourly" : response}), 200
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
@@ -121,18 +127,12 @@ def get_consumption():
         return jsonify({"error": f"Missing key: {str(e)}"}), 400
     
     try:
-        existing_data = redis_model.get_user(user_email)
-        print(f"(Consumption) User data: {existing_data}", file=sys.stderr)
-        if existing_data is None:
+        if not redis_model.user_exists(user_email):
             return jsonify({"error" : "user not registered"}), 400
         else:
             current_date = datetime.now().strftime("%Y-%m-%d")
-            response = redis_model.get_consumption_day(user_email, current_date)
-            print(f"""|{os.getpid()}| [Controller] (get_consumption)
-                  Non completed dict: {response}""", file=sys.stderr)
-            response = response[0]
-            response = complete_and_order_hours(response)
-            print(f"(Consumption) Completed dict: {response}", file=sys.stderr)
+            series = redis_model.get_day_series(user_email, "consumption", current_date)
+            response = series_to_hourly(series)
             return jsonify({"hourly" : response}), 200
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
@@ -146,28 +146,163 @@ def get_surplus_hourly():
         return jsonify({"error": f"Missing key: {str(e)}"}), 400
     
     try:
-        existing_data = redis_model.get_user(user_email)
-        print(f"(Surplus) User data: {existing_data}", file=sys.stderr)
-        if existing_data is None:
+        if not redis_model.user_exists(user_email):
             return jsonify({"error" : "user not registered"}), 400
         else:
             current_date = datetime.now().strftime("%Y-%m-%d")
 
-            consumption = redis_model.get_consumption_day(user_email, current_date)
-            production = redis_model.get_production_day(user_email, current_date)
+            consumption = redis_model.get_day_series(user_email, "consumption", current_date)
+            production = redis_model.get_day_series(user_email, "production", current_date)
 
-            consumption = consumption[0]
-            production = production[0]
+            response = series_to_hourly(production - consumption)
 
-            consumption = complete_and_order_hours(consumption)
-            production = complete_and_order_hours(production)
+            return jsonify({"hourly" : response}), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-            print(f"(Surplus) cons: {consumption}, prod: {production}", file=sys.stderr)
+def get_range(kind):
+    try:
+        data = request.json
+        user_email = data['email']
+        start_date = data['start_date']
+        end_date = data['end_date']
+        resolution = data.get('resolution', 'day')
+    except KeyError as e:
+        return jsonify({"error": f"Missing key: {str(e)}"}), 400
+    if resolution not in RANGE_RESOLUTIONS:
+        return jsonify({"error": f"Not a valid resolution: {resolution}"}), 400
 
-            response = {hour: production.get(hour, 0) - consumption.get(hour, 0) for hour in set(consumption) | set(production)}
+    try:
+        if not redis_model.user_exists(user_email):
+            return jsonify({"error" : "user not registered"}), 400
+        if kind == "surplus":
+            dates, production = redis_model.get_range_matrix(user_email, "production", start_date, end_date, resolution)
+            dates, consumption = redis_model.get_range_matrix(user_email, "consumption", start_date, end_date, resolution)
+            labels, values = aggregate_days(production - consumption, dates, resolution)
+        else:
+            labels, values = redis_model.get_range_series(user_email, kind, start_date, end_date, resolution)
+        return jsonify({"resolution": resolution, "labels": labels, "values": values.tolist()}), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-            print(f"Surplus: {response}", file=sys.stderr)
+@redis_bp.route('/get_production_range', methods=['POST'])
+def get_production_range():
+    return get_range("production")
 
-            return jsonify({"hourly" : response}), 200
+@redis_bp.route('/get_consumption_range', methods=['POST'])
+def get_consumption_range():
+    return get_range("consumption")
+
+@redis_bp.route('/get_surplus_range', methods=['POST'])
+def get_surplus_range():
+    return get_range("surplus")
+
+@redis_bp.route('/create_community', methods=['POST'])
+def create_community():
+    try:
+        data = request.json
+        community = data['community']
+    except KeyError as e:
+        return jsonify({"error": f"Missing key: {str(e)}"}), 400
+
+    try:
+        response = redis_model.create_community(community)
+        return jsonify(response), 200
     except ValueError as e:
-        return jsonify({"error": str(e)}), 400
\ No newline at end of file
+        return jsonify({"error": str(e)}), 400
+
+@redis_bp.route('/set_user_community', methods=['POST'])
+def set_user_community():
+    try:
+        data = request.json
+        user_email = data['email']
+        community = data['community']
+    except KeyError as e:
+        return jsonify({"error": f"Missing key: {str(e)}"}), 400
+
+    try:
+        response = redis_model.set_user_community(user_email, community)
+        return jsonify(response), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@redis_bp.route('/get_community_day', methods=['POST'])
+def get_community_day():
+    try:
+        data = request.json
+        community = data['community']
+        date = data.get('date', datetime.now().strftime("%Y-%m-%d"))
+    except KeyError as e:
+        return jsonify({"error": f"Missing key: {str(e)}"}), 400
+
+    try:
+        response = community_engine.get_day(community, date)
+        return jsonify(response), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@redis_bp.route('/get_community_range', methods=['POST'])
+def get_community_range():
+    try:
+        data = request.json
+        community = data['community']
+        start_date = data['start_date']
+        end_date = data['end_date']
+        resolution = data.get('resolution', 'day')
+    except KeyError as e:
+        return jsonify({"error": f"Missing key: {str(e)}"}), 400
+
+    try:
+        response = community_engine.get_range(community, start_date, end_date, resolution)
+        return jsonify(response), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@redis_bp.route('/set_sharing_coefficients', methods=['POST'])
+def set_sharing_coefficients():
+    try:
+        data = request.json
+        community = data['community']
+        coefficients = data['coefficients']
+    except KeyError as e:
+        return jsonify({"error": f"Missing key: {str(e)}"}), 400
+    if not isinstance(coefficients, dict):
+        return jsonify({"error": "'coefficients' must be an object"}), 400
+
+    try:
+        response = sharing_engine.set_coefficients(community, coefficients)
+        return jsonify(response), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@redis_bp.route('/compute_sharing', methods=['POST'])
+def compute_sharing():
+    try:
+        data = request.json
+        community = data['community']
+        month = data['month']
+        method = data.get('method', 'dynamic')
+    except KeyError as e:
+        return jsonify({"error": f"Missing key: {str(e)}"}), 400
+
+    try:
+        response = sharing_engine.compute_month(community, month, method)
+        return jsonify(response), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@redis_bp.route('/get_sharing', methods=['POST'])
+def get_sharing():
+    try:
+        data = request.json
+        community = data['community']
+        month = data['month']
+        user_email = data['email']
+    except KeyError as e:
+        return jsonify({"error": f"Missing key: {str(e)}"}), 400
+
+    try:
+        response = sharing_engine.get_member_month(community, month, user_email)
+        return jsonify(response), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
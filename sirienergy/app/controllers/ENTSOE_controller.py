@@ -1,8 +1,12 @@
 from flask import Blueprint, request, jsonify
 from app.models.ENTSOE_models import *
+from app.models.archive_model import ARCHIVE_DATASETS, ARCHIVE_RESOLUTIONS, EntsoeArchive
+import numpy as np
 
 entsoe_bp = Blueprint('entsoe', __name__)
 
+archive = EntsoeArchive()
+
 @entsoe_bp.route('/day_ahead_prices', methods=['POST'])
 def day_ahead_prices():
     data = request.json
@@ -42,4 +46,81 @@ def actual_generation_by_type():
     return jsonify({
         'data': generation,
         'co2': co2
-    })
\ No newline at end of file
+    })
+
+def get_countries(data):
+    # The list of countries of a batch request, or None if it is not valid
+    countries = data.get('countries') if isinstance(data, dict) else None
+    if not isinstance(countries, list) or not countries or len(countries) > Config.BATCH_MAX_COUNTRIES:
+        return None
+    if not all(isinstance(country, str) for country in countries):
+        return None
+    return list(dict.fromkeys(countries))
+
+def batch_response(results):
+    # 500 only when no country could be served
+    status = 200 if any(result['status'] == 'ok' for result in results.values()) else 500
+    return jsonify({'data': results}), status
+
+@entsoe_bp.route('/day_ahead_prices_batch', methods=['POST'])
+def day_ahead_prices_batch():
+    countries = get_countries(request.json)
+    if countries is None:
+        return jsonify({"error": f"Invalid input. Please provide a list of 1 to {Config.BATCH_MAX_COUNTRIES} countries."}), 400
+
+    return batch_response(get_for_countries(get_day_ahead_prices, countries))
+
+@entsoe_bp.route('/actual_gen_type_batch', methods=['POST'])
+def actual_generation_by_type_batch():
+    countries = get_countries(request.json)
+    if countries is None:
+        return jsonify({"error": f"Invalid input. Please provide a list of 1 to {Config.BATCH_MAX_COUNTRIES} countries."}), 400
+
+    results = get_for_countries(get_actual_generation_by_type, countries)
+    co2_dict = load_co2_by_type()
+    for result in results.values():
+        if result['status'] == 'ok':
+            result['co2'] = get_CO2_from_dict(result['data'], co2_dict)
+
+    return batch_response(results)
+
+@entsoe_bp.route('/get_archive_range', methods=['POST'])
+def get_archive_range():
+    data = request.json
+    if not data or 'country' not in data or 'start_date' not in data or 'end_date' not in data:
+        return jsonify({"error": "Invalid input. Please provide country, start_date and end_date."}), 400
+    dataset = data.get('dataset', 'prices')
+    resolution = data.get('resolution', 'hour')
+    # Checked as strings first, lists or objects cannot be looked up in the dicts
+    if not isinstance(dataset, str) or dataset not in ARCHIVE_DATASETS:
+        return jsonify({"error": f"Invalid dataset. Use one of: {', '.join(ARCHIVE_DATASETS)}."}), 400
+    if not isinstance(resolution, str) or resolution not in ARCHIVE_RESOLUTIONS:
+        return jsonify({"error": f"Invalid resolution. Use one of: {', '.join(ARCHIVE_RESOLUTIONS)}."}), 400
+    if not isinstance(data['country'], str):
+        return jsonify({"error": "Invalid input. 'country' must be a string."}), 400
+    entsoe_country_keys = load_entsoe_country_keys()
+    if data['country'] not in entsoe_country_keys:
+        return jsonify({"error": f"Key for country {data['country']} not found"}), 404
+
+    try:
+        # Whole days in UTC, end date included
+        start = np.datetime64(data['start_date'], 'D')
+        end = np.datetime64(data['end_date'], 'D') + 1
+        times, values = archive.read(dataset, entsoe_country_keys[data['country']], start, end)
+        times, values = archive.aggregate(times, values, resolution)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    columns = archive.columns(dataset)
+    if dataset == "generation":
+        gentype_names = load_entsoe_gentype_names()
+        columns = [gentype_names[column] for column in columns]
+    return jsonify({
+        "dataset": dataset,
+        "resolution": resolution,
+        "labels": np.datetime_as_string(times, unit='m', timezone='UTC').tolist(),
+        "values": {
+            column: [None if np.isnan(value) else value for value in series]
+            for column, series in zip(columns, np.asarray(values, dtype=float).T.tolist())
+        }
+    })
@@ -0,0 +1,9 @@
+from flask import Blueprint, Response
+from app.metrics import metrics_text
+
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def metrics():
+    # Prometheus text exposition format, summed over the workers sharing METRICS_DIR
+    return Response(metrics_text(), mimetype='text/plain; version=0.0.4; charset=utf-8')
@@ -1,14 +1,30 @@
 from flask import Blueprint, request, jsonify
 from app.models.ENTSOE_models import *
 from app.models.pvlib_model import *
-import logging
+from app.metrics import histogram
+from concurrent.futures import ThreadPoolExecutor
+import time
+import numpy as np
+import pandas as pd
 
 mix_bp = Blueprint('mix', __name__)
 
+# Price and PV stages of /sell, bounded for the whole process
+stage_executor = ThreadPoolExecutor(max_workers=Config.SELL_WORKERS, thread_name_prefix="sell-stage")
+
+sell_stage_seconds = histogram("sell_stage_seconds", "Duration of each stage of /sell", ("stage",))
+
+def timed(timings, stage, function, *args):
+    # Runs a stage and records how long it took
+    start = time.perf_counter()
+    try:
+        return function(*args)
+    finally:
+        timings[stage] = time.perf_counter() - start
+        sell_stage_seconds.observe(timings[stage], stage=stage)
+
 @mix_bp.route('/sell', methods=['POST'])
 def sell():
-    logging.info("Tamos en sell")
-    print("print")
     data = request.json
     if 'latitude' not in data or 'longitude' not in data or 'altitude' not in data or 'timezone' not in data:
         return jsonify({"error": "Invalid input. Please provide latitude, longitude, altitude, and timezone."}), 400
@@ -23,17 +39,50 @@ def sell():
         country = data['country']
         fee = data['fee'] 
         fixed_value = data['fixed_price']
+        resolution = data.get('resolution', 'PT60M')
+        mode = data.get('mode', 'clear_sky')
+        if mode not in PV_MODES:
+            return jsonify({"error": f"Invalid input. 'mode' must be one of {', '.join(PV_MODES)}."}), 400
+
+        timings = {}
+        # Stage 1: prices (ENTSO-E) and PV generation (pvlib) are independent, run side by side
+        prices = stage_executor.submit(timed, timings, "prices", get_price_slots, country, fee, fixed_value, resolution)
+        if mode == 'forecast':
+            power = stage_executor.submit(timed, timings, "pv", get_PV_forecast, latitude, longitude, surface, efficiency, tz)
+        else:
+            power = stage_executor.submit(timed, timings, "pv", get_PV_gen, latitude, longitude, altitude, surface, efficiency, tz)
+        price_slots, power_array = prices.result(), power.result()
+        if price_slots is None:
+            return jsonify({"error": "Prices not available. Check the fee, country and resolution."}), 500
+        price_times, price_array = price_slots
 
-        price_array = get_price_array(country, fee, fixed_value)
-        logging.info(f"Price array{price_array}")
-        power_array = get_PV_gen(latitude, longitude, altitude, surface, efficiency, tz)
-        logging.info(f"Power array{power_array}")
-        print("Ahora si q quiere ir con prints xdn't")
-        power_array = [round(value/1000, 5) for value in power_array]
+        # Stage 2: hourly power (kW) to the energy (kWh) of each price slot
+        def energy_by_slot():
+            power = np.asarray(power_array) / 1000
+            slot_hours = resolution_minutes(resolution) / 60
+            if price_times is None:
+                # Fixed prices: the slots are the hours of the local day
+                local_hours = np.arange(len(price_array)) * slot_hours
+            else:
+                # Market slots are matched to the local hour of the site, so days with 23 or 25
+                # hours (clock changes) skip or repeat an hour
+                local_hours = pd.DatetimeIndex(price_times, tz='UTC').tz_convert(tz).hour.to_numpy()
+            return np.round(power[local_hours.astype(int) % len(power)] * slot_hours, 5)
+        energy_array = timed(timings, "math", energy_by_slot)
 
-        euros_by_hours = sell_by_hours(price_array, power_array)
+        # Stage 3: revenue of each slot and of the day
+        def revenue():
+            euros = sell_by_hours(price_array, energy_array)
+            return euros, None if euros is None else round(float(np.sum(euros)), 5)
+        euros_by_hours, total = timed(timings, "revenue", revenue)
+        if euros_by_hours is None:
+            return jsonify({"error": "Prices and PV generation could not be matched."}), 500
 
-        return jsonify({"sell": euros_by_hours})
+        response = jsonify({"sell": euros_by_hours, "total": total})
+        # Stage durations on request, in the standard Server-Timing format (milliseconds)
+        if request.headers.get('X-Debug-Timing'):
+            response.headers['Server-Timing'] = ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
+        return response
     
     except ValueError:
         return jsonify({"error": "Something went wrong. Try again later."}), 500
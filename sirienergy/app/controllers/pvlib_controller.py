@@ -1,4 +1,4 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from app.models.pvlib_model import *
 
 pvlib_bp = Blueprint('pvlib', __name__)
@@ -17,8 +17,16 @@ def PVgen():
         surface = float(data['surface'])
         efficiency = float(data['efficiency'])
         tz = data['timezone']  # Timezone as a string
+        if not is_valid_timezone(tz):
+            return jsonify({"error": f"Invalid input. Unknown timezone: {tz}."}), 400
+        mode = data.get('mode', 'clear_sky')
+        if mode not in PV_MODES:
+            return jsonify({"error": f"Invalid input. 'mode' must be one of {', '.join(PV_MODES)}."}), 400
 
-        power_array = get_PV_gen(latitude, longitude, altitude, surface, efficiency, tz)
+        if mode == 'forecast':
+            power_array = get_PV_forecast(latitude, longitude, surface, efficiency, tz)
+        else:
+            power_array = get_PV_gen(latitude, longitude, altitude, surface, efficiency, tz)
 
         #logging.info(power_array)
 
@@ -27,3 +35,80 @@ def PVgen():
     
     except ValueError:
         return jsonify({"error": "Something went wrong. Try again later."}), 500
+
+@pvlib_bp.route('/PVgen_batch', methods=['POST'])
+def PVgen_batch():
+    data = request.json
+    sites = data.get('sites') if isinstance(data, dict) else None
+    if not isinstance(sites, list) or not sites or len(sites) > Config.PV_BATCH_MAX_SITES:
+        return jsonify({"error": f"Invalid input. Please provide a list of 1 to {Config.PV_BATCH_MAX_SITES} sites."}), 400
+
+    try:
+        # One column per field, in the order of the sites
+        latitudes = [float(site['latitude']) for site in sites]
+        longitudes = [float(site['longitude']) for site in sites]
+        altitudes = [float(site['altitude']) for site in sites]
+        surfaces = [float(site['surface']) for site in sites]
+        efficiencies = [float(site['efficiency']) for site in sites]
+        tzs = [str(site['timezone']) for site in sites]
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "Invalid input. Every site needs latitude, longitude, altitude, surface, efficiency and timezone."}), 400
+    unknown = sorted(tz for tz in set(tzs) if not is_valid_timezone(tz))
+    if unknown:
+        return jsonify({"error": f"Invalid input. Unknown timezones: {', '.join(unknown)}."}), 400
+    mode = data.get('mode', 'clear_sky')
+    if mode not in PV_MODES:
+        return jsonify({"error": f"Invalid input. 'mode' must be one of {', '.join(PV_MODES)}."}), 400
+
+    try:
+        if mode == 'forecast':
+            power_rows = get_PV_forecast_batch(latitudes, longitudes, surfaces, efficiencies, tzs).tolist()
+        else:
+            power_rows = get_PV_gen_batch(latitudes, longitudes, altitudes, surfaces, efficiencies, tzs)
+    except (KeyError, ValueError):
+        return jsonify({"error": "Something went wrong. Try again later."}), 500
+
+    # One row of hourly values per site
+    return jsonify({"power": power_rows})
+
+def iso_labels(times):
+    # ISO 8601 local times with their UTC offset, formatted as arrays instead of one call per time
+    wall = times.tz_localize(None).as_unit('s')
+    offsets = (wall - times.tz_convert('UTC').tz_localize(None).as_unit('s')).total_seconds().astype(int) // 60
+    suffixes = {offset: f"{'+' if offset >= 0 else '-'}{abs(offset) // 60:02d}:{abs(offset) % 60:02d}" for offset in set(offsets)}
+    return np.char.add(np.datetime_as_string(wall.to_numpy(), unit='s'), [suffixes[offset] for offset in offsets]).tolist()
+
+def stream_PV_gen(chunks, output_format):
+    # Written chunk by chunk, the full series never exists in memory
+    if output_format == 'csv':
+        yield "time,power\n"
+    for times, power in chunks:
+        labels = iso_labels(times)
+        values = np.round(power, 3).tolist()
+        if output_format == 'csv':
+            yield "".join(f"{label},{value}\n" for label, value in zip(labels, values))
+        else:
+            yield "".join(f'{{"time": "{label}", "power": {value}}}\n' for label, value in zip(labels, values))
+
+@pvlib_bp.route('/PVgen_range', methods=['POST'])
+def PVgen_range():
+    data = request.json
+    required = ['latitude', 'longitude', 'altitude', 'surface', 'efficiency', 'timezone', 'start_date', 'end_date']
+    if not isinstance(data, dict) or any(field not in data for field in required):
+        return jsonify({"error": "Invalid input. Please provide latitude, longitude, altitude, surface, efficiency, timezone, start_date and end_date."}), 400
+    output_format = data.get('format', 'ndjson')
+    if output_format not in ('ndjson', 'csv'):
+        return jsonify({"error": "Invalid input. 'format' must be 'ndjson' or 'csv'."}), 400
+
+    try:
+        chunks = iter_PV_gen(float(data['latitude']), float(data['longitude']), float(data['altitude']),
+                             float(data['surface']), float(data['efficiency']), data['timezone'],
+                             data['start_date'], data['end_date'], data.get('resolution', 'PT60M'))
+        # Summaries are small: energy per day or month instead of the series
+        if 'summary' in data:
+            return jsonify({"summary": summarize_PV_gen(chunks, data['summary'])})
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid input. {e}"}), 400
+
+    mimetype = 'text/csv' if output_format == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(stream_PV_gen(chunks, output_format)), mimetype=mimetype)
@@ -1,22 +1,71 @@
-from flask import Blueprint, request, jsonify, render_template
-from app.models.weather_model import get_weather, get_sunrise_sunset, image_array
+from flask import Blueprint, request, jsonify, render_template, current_app, make_response
+from app.models.cache_model import SharedCache
+from app.models.weather_model import get_weather, day_night_flags, image_array, get_weather_stats, round_coordinate
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+import hashlib
 
 weather_bp = Blueprint('weather', __name__)
 
-@weather_bp.route('/weather', methods=['POST'])
+# Rendered forecast of each rounded location and hour, shared by every worker
+fragment_cache = SharedCache("weather_fragment")
+
+def get_weather_fragment(latitude, longitude, timezone):
+    """
+    Returns the weather images of a location, rendered once per rounded location and forecast hour.
+
+    Input:
+        latitude (float): The latitude of the location.
+        longitude (float): The longitude of the location.
+        timezone (str): The timezone of the location (e.g., 'Europe/Berlin').
+
+    Output:
+        dict: The image names, the rendered fragment and its ETag.
+    """
+    latitude, longitude = round_coordinate(latitude), round_coordinate(longitude)
+    hour = datetime.now(ZoneInfo(timezone)).replace(minute=0, second=0, microsecond=0)
+    # Rendered with the app of the request, also when the cache refreshes it in the background
+    app = current_app._get_current_object()
+
+    def compute():
+        codes = get_weather(latitude, longitude, timezone)
+        # Day or night of each hour from the solar position, no external call
+        day_flags = day_night_flags(latitude, longitude, timezone, codes['date'])
+        images = image_array(codes, day_flags)
+        with app.app_context():
+            html = render_template('weather_images.html', images=images)
+        return {"images": images, "html": html, "etag": hashlib.sha1(html.encode()).hexdigest()}
+
+    key = f"{latitude}:{longitude}:{timezone}:{hour.strftime('%Y-%m-%dT%H')}"
+    return fragment_cache.get(key, compute, lambda fragment: (hour + timedelta(hours=1)).timestamp())
+
+@weather_bp.route('/weather', methods=['GET', 'POST'])
 def weather():
-    data = request.json
+    # GET (query string) lets browsers revalidate with If-None-Match, POST (JSON) is kept for existing clients
+    data = request.args if request.method == 'GET' else request.json
     if 'latitude' not in data or 'longitude' not in data or 'timezone' not in data:
         return jsonify({"error": "Invalid input. Please provide latitude, longitude, and timezone."}), 400
 
     latitude = float(data['latitude'])
     longitude = float(data['longitude'])
     timezone = data['timezone']
+    as_json = data.get('format') == 'json'
 
     try:
-        codes = get_weather(latitude, longitude, timezone)
-        sunrise, sunset = get_sunrise_sunset(latitude, longitude)
-        images = image_array(codes, sunrise, sunset)
-        return render_template('weather_images.html', images=images)
+        fragment = get_weather_fragment(latitude, longitude, timezone)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+
+    etag = f"{fragment['etag']}-json" if as_json else fragment['etag']
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        response = make_response(jsonify({"images": fragment['images']}) if as_json else fragment['html'])
+    response.set_etag(etag)
+    # Always revalidated: an unchanged forecast costs a 304
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@weather_bp.route('/weather_stats', methods=['GET'])
+def weather_stats():
+    return jsonify(get_weather_stats())
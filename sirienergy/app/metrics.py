@@ -0,0 +1,508 @@
+import bisect
+import glob
+import json
+import logging
+import math
+import os
+import threading
+import time
+import uuid
+import requests
+from flask import g, request
+from app.config import Config
+
+# Upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Redis commands take well under a millisecond
+REDIS_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5)
+
+# File of METRICS_DIR holding the totals of the workers that exited
+RETIRED_SNAPSHOT = "retired.json"
+
+class Metric:
+    """
+    Base of the metrics: a name, a description and one series per combination of label values.
+    """
+    kind = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        return tuple(str(labels[label]) for label in self.labels)
+
+class Counter(Metric):
+    """
+    Thread-safe counter, summed across the workers.
+    """
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        """
+        Adds an amount to the series of some label values.
+
+        Input:
+            amount (float, optional): The amount added. Defaults to 1.
+            **labels: The value of each label of the metric.
+
+        Output: None
+        """
+        key = self.key(labels)
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.series)
+
+class Gauge(Counter):
+    """
+    Thread-safe value that goes up and down (e.g. requests in progress), summed across
+    the live workers only.
+    """
+    kind = "gauge"
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(Metric):
+    """
+    Thread-safe histogram of durations, with one series per combination of label values
+    (cumulative buckets, count and sum, as Prometheus histograms).
+    """
+    kind = "histogram"
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        """
+        Adds a value to the series of some label values.
+
+        Input:
+            value (float): The observed value (e.g. seconds).
+            **labels: The value of each label of the histogram.
+
+        Output: None
+        """
+        key = self.key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = {"buckets": [0] * (len(self.buckets) + 1), "count": 0, "sum": 0.0}
+            series["buckets"][index] += 1
+            series["count"] += 1
+            series["sum"] += value
+
+    def snapshot(self):
+        """
+        Returns a copy of every series.
+
+        Input: None
+        Output:
+            dict: The label values of each series and its bucket counts (not cumulative,
+                  the last one above every bound), count and sum.
+        """
+        with self.lock:
+            return {key: {"buckets": list(series["buckets"]), "count": series["count"], "sum": series["sum"]}
+                    for key, series in self.series.items()}
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+def register(metric_class, name, *args):
+    # The metric of a name, created on first use
+    with _registry_lock:
+        if name not in _registry:
+            _registry[name] = metric_class(name, *args)
+        return _registry[name]
+
+def histogram(name, description, labels=(), buckets=DEFAULT_BUCKETS):
+    """
+    Returns the histogram of a name, created on first use.
+
+    Input:
+        name (str): The metric name (e.g. 'sell_stage_seconds').
+        description (str): What it measures.
+        labels (tuple, optional): The label names.
+        buckets (tuple, optional): The bucket upper bounds.
+
+    Output:
+        Histogram: The histogram of the process.
+    """
+    return register(Histogram, name, description, labels, buckets)
+
+def counter(name, description, labels=()):
+    """
+    Returns the counter of a name, created on first use.
+
+    Input:
+        name (str): The metric name (e.g. 'http_requests_total').
+        description (str): What it counts.
+        labels (tuple, optional): The label names.
+
+    Output:
+        Counter: The counter of the process.
+    """
+    return register(Counter, name, description, labels)
+
+def gauge(name, description, labels=()):
+    """
+    Returns the gauge of a name, created on first use.
+
+    Input:
+        name (str): The metric name (e.g. 'http_requests_in_progress').
+        description (str): What it measures.
+        labels (tuple, optional): The label names.
+
+    Output:
+        Gauge: The gauge of the process.
+    """
+    return register(Gauge, name, description, labels)
+
+http_requests = counter("http_requests_total", "HTTP requests served", ("route", "method", "status"))
+http_request_seconds = histogram("http_request_duration_seconds", "Duration of the HTTP requests", ("route", "method"))
+http_in_progress = gauge("http_requests_in_progress", "HTTP requests being served", ("route", "method"))
+upstream_requests = counter("upstream_requests_total", "Requests to the external APIs", ("api", "status"))
+upstream_seconds = histogram("upstream_request_duration_seconds", "Duration of the requests to the external APIs", ("api",))
+upstream_bytes = counter("upstream_response_bytes_total", "Bytes received from the external APIs", ("api",))
+redis_commands = counter("redis_commands_total", "Redis commands and pipelines sent", ("command", "status"))
+redis_seconds = histogram("redis_command_duration_seconds", "Duration of the Redis commands and pipelines",
+                          ("command",), REDIS_BUCKETS)
+
+def record_upstream(api, seconds, status, size):
+    """
+    Records a request to an external API.
+
+    Input:
+        api (str): The API name (e.g. 'entsoe').
+        seconds (float): The duration of the request, or None if it was not sent (e.g. cached).
+        status: The HTTP status, or the reason it has none (e.g. 'Timeout', 'cached').
+        size (int): The bytes of the response body.
+
+    Output: None
+    """
+    upstream_requests.inc(api=api, status=status)
+    if seconds is not None:
+        upstream_seconds.observe(seconds, api=api)
+    if size:
+        upstream_bytes.inc(size, api=api)
+
+def upstream_get(api, url, **kwargs):
+    """
+    Sends a GET request (as requests.get) and records it under an external API name.
+
+    Input:
+        api (str): The API name (e.g. 'entsoe').
+        url (str): The URL.
+        **kwargs: The arguments of requests.get (params, timeout...).
+
+    Output:
+        requests.Response: The response. Request errors are recorded and raised.
+    """
+    start = time.perf_counter()
+    try:
+        response = requests.get(url, **kwargs)
+    except requests.RequestException as e:
+        record_upstream(api, time.perf_counter() - start, type(e).__name__, 0)
+        raise
+    record_upstream(api, time.perf_counter() - start, response.status_code, len(response.content))
+    return response
+
+def timed_redis(command, function, *args, **kwargs):
+    # Runs a Redis call recording its duration and whether it failed
+    start = time.perf_counter()
+    status = "error"
+    try:
+        result = function(*args, **kwargs)
+        status = "ok"
+        return result
+    finally:
+        redis_seconds.observe(time.perf_counter() - start, command=command)
+        redis_commands.inc(command=command, status=status)
+
+def instrument_redis(client):
+    """
+    Records the commands of a Redis connection (scripts as EVALSHA, pipelines as one
+    PIPELINE call).
+
+    Input:
+        client (redis.Redis): The connection.
+
+    Output:
+        redis.Redis: The same connection.
+    """
+    execute_command = client.execute_command
+    pipeline = client.pipeline
+
+    def instrumented_execute_command(*args, **options):
+        return timed_redis(str(args[0]).split(' ')[0].upper(), execute_command, *args, **options)
+
+    def instrumented_pipeline(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        execute = pipe.execute
+        pipe.execute = lambda *execute_args, **execute_kwargs: timed_redis("PIPELINE", execute, *execute_args, **execute_kwargs)
+        return pipe
+
+    client.execute_command = instrumented_execute_command
+    client.pipeline = instrumented_pipeline
+    return client
+
+def collect():
+    """
+    Returns every metric of this process in a JSON-serializable form.
+
+    Input: None
+    Output:
+        dict: The type, description, labels, buckets (histograms) and series of each metric name.
+    """
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return {metric.name: {"type": metric.kind, "description": metric.description, "labels": list(metric.labels),
+                          "buckets": list(getattr(metric, 'buckets', ())),
+                          "series": [[list(key), value] for key, value in metric.snapshot().items()]}
+            for metric in metrics}
+
+def merge(snapshots, live):
+    """
+    Adds up the metrics of several workers: counters and histograms of every worker (so
+    totals survive worker restarts), gauges of the live workers only.
+
+    Input:
+        snapshots (list): The collect() output of each worker.
+        live (list): Whether each worker is still running.
+
+    Output:
+        dict: The merged metrics, in the collect() form.
+    """
+    merged = {}
+    for snapshot, alive in zip(snapshots, live):
+        for name, metric in snapshot.items():
+            if metric["type"] == "gauge" and not alive:
+                continue
+            target = merged.setdefault(name, {**metric, "series": {}})
+            if target["type"] != metric["type"] or target["buckets"] != metric["buckets"]:
+                # Written by another version of the code, not comparable
+                continue
+            for key, value in metric["series"]:
+                key = tuple(key)
+                current = target["series"].get(key)
+                if metric["type"] != "histogram":
+                    target["series"][key] = (current or 0) + value
+                elif current is None:
+                    target["series"][key] = {"buckets": list(value["buckets"]), "count": value["count"], "sum": value["sum"]}
+                else:
+                    current["buckets"] = [a + b for a, b in zip(current["buckets"], value["buckets"])]
+                    current["count"] += value["count"]
+                    current["sum"] += value["sum"]
+    for metric in merged.values():
+        metric["series"] = [[list(key), value] for key, value in metric["series"].items()]
+    return merged
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render(metrics):
+    """
+    Formats metrics in the Prometheus text exposition format (version 0.0.4).
+
+    Input:
+        metrics (dict): The metrics, in the collect() form.
+
+    Output:
+        str: The exposition text.
+    """
+    lines = []
+    for name, metric in sorted(metrics.items()):
+        lines.append(f"# HELP {name} {metric['description']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for key, value in sorted(metric["series"]):
+            if metric["type"] != "histogram":
+                lines.append(f"{name}{format_labels(metric['labels'], key)} {format_value(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(list(metric["buckets"]) + [math.inf], value["buckets"]):
+                cumulative += count
+                le = format_value(bound if bound == math.inf else float(bound))
+                lines.append(f"{name}_bucket{format_labels(metric['labels'], key, [('le', le)])} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(metric['labels'], key)} {format_value(float(value['sum']))}")
+            lines.append(f"{name}_count{format_labels(metric['labels'], key)} {value['count']}")
+    return "\n".join(lines) + "\n"
+
+def write_snapshot():
+    """
+    Writes the metrics of this process to its file of METRICS_DIR (replaced atomically,
+    so readers never see a partial file).
+
+    Input: None
+    Output: None
+    """
+    os.makedirs(Config.METRICS_DIR, exist_ok=True)
+    write_json(os.path.join(Config.METRICS_DIR, snapshot_name()), collect())
+
+def write_json(path, data):
+    with open(f"{path}.tmp", 'w') as file:
+        json.dump(data, file)
+    os.replace(f"{path}.tmp", path)
+
+_snapshot_name = (None, None)
+
+def snapshot_name():
+    # The pid plus a random token: a new worker that reuses the pid of an exited one gets its own file
+    global _snapshot_name
+    if _snapshot_name[0] != os.getpid():
+        _snapshot_name = (os.getpid(), f"{os.getpid()}-{uuid.uuid4().hex[:12]}.json")
+    return _snapshot_name[1]
+
+def process_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def fold_retired(paths):
+    """
+    Adds the counters and histograms of exited workers to RETIRED_SNAPSHOT and deletes their
+    files, so METRICS_DIR keeps one file per running worker plus one for all the others.
+
+    Input:
+        paths (list): The snapshot files of the exited workers.
+    Output: None
+    """
+    import fcntl
+    archive = os.path.join(Config.METRICS_DIR, RETIRED_SNAPSHOT)
+    # Workers scraping at the same time must not fold (and count) a file twice
+    with open(os.path.join(Config.METRICS_DIR, ".lock"), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        snapshots, folded = [], []
+        for path in [archive] + paths:
+            try:
+                with open(path) as file:
+                    snapshots.append(json.load(file))
+                folded.append(path)
+            except FileNotFoundError:
+                continue
+            except (OSError, ValueError) as e:
+                logging.warning(f"[METRICS] Skipping {path}: {e}")
+        if len(folded) <= int(archive in folded):
+            return
+        write_json(archive, merge(snapshots, [False] * len(snapshots)))
+        for path in folded:
+            if path != archive:
+                os.remove(path)
+
+def write_snapshots():
+    while True:
+        time.sleep(Config.METRICS_FLUSH_SECONDS)
+        try:
+            write_snapshot()
+        except OSError as e:
+            logging.warning(f"[METRICS] Could not write the metrics of the worker: {e}")
+
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+def ensure_writer():
+    # One writer thread per worker, started in the worker itself (threads do not survive a preload fork)
+    global _writer_pid
+    if not Config.METRICS_DIR or _writer_pid == os.getpid():
+        return
+    with _writer_lock:
+        if _writer_pid != os.getpid():
+            _writer_pid = os.getpid()
+            threading.Thread(target=write_snapshots, name="metrics-writer", daemon=True).start()
+
+def metrics_text():
+    """
+    Returns the metrics of every worker sharing METRICS_DIR (or of this process if it is
+    not set) in the Prometheus text format. Other workers are up to METRICS_FLUSH_SECONDS old.
+
+    Input: None
+    Output:
+        str: The exposition text.
+    """
+    if not Config.METRICS_DIR:
+        return render(collect())
+    write_snapshot()
+    # Workers that stopped writing are gone: their gauges are dropped, their totals kept
+    stale_before = time.time() - 3 * Config.METRICS_FLUSH_SECONDS
+    paths, retired = {}, []
+    for path in glob.glob(os.path.join(Config.METRICS_DIR, "*.json")):
+        try:
+            paths[path] = os.path.getmtime(path) >= stale_before
+        except OSError:
+            continue
+        pid = os.path.basename(path).split('-')[0].split('.')[0]
+        if not paths[path] and pid.isdigit() and not process_running(int(pid)):
+            retired.append(path)
+    if retired:
+        try:
+            fold_retired(retired)
+            paths = {path: alive for path, alive in paths.items() if path not in retired}
+            archive = os.path.join(Config.METRICS_DIR, RETIRED_SNAPSHOT)
+            if os.path.exists(archive):
+                paths[archive] = False
+        except OSError as e:
+            logging.warning(f"[METRICS] Could not fold the metrics of the exited workers: {e}")
+    snapshots, live = [], []
+    for path, alive in paths.items():
+        try:
+            with open(path) as file:
+                snapshots.append(json.load(file))
+            live.append(alive)
+        except (OSError, ValueError) as e:
+            logging.warning(f"[METRICS] Skipping {path}: {e}")
+    return render(merge(snapshots, live))
+
+def route_label():
+    # The route template, so every user or date shares one series (unknown paths share one too)
+    return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+def instrument_app(app):
+    """
+    Records the count, duration and requests in progress of every route of an app.
+
+    Input:
+        app (Flask): The app.
+
+    Output: None
+    """
+    @app.before_request
+    def start_request_metrics():
+        ensure_writer()
+        g.metrics = (time.perf_counter(), route_label(), request.method)
+        http_in_progress.inc(route=g.metrics[1], method=request.method)
+
+    @app.after_request
+    def record_response_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(exception):
+        # Runs after streamed responses are sent, and also when the view raised
+        if 'metrics' not in g:
+            return
+        start, route, method = g.pop('metrics')
+        http_in_progress.dec(route=route, method=method)
+        http_request_seconds.observe(time.perf_counter() - start, route=route, method=method)
+        http_requests.inc(route=route, method=method, status=g.pop('metrics_status', 500))
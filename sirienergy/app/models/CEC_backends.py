@@ -0,0 +1,492 @@
+import redis
+import json
+import numpy as np
+from app.config import Config
+from datetime import datetime, timezone
+from functools import lru_cache
+
+# JSON path of the readings object in the old one-document-per-user layout
+LEGACY_READING_PATHS = {
+    "consumption": "$.user_consumption",
+    "production": "$.user_production"
+}
+
+# Set by a complete `flask migrate-readings` run: no user document holds readings any more
+READINGS_MIGRATED_KEY = "migration:readings"
+
+# Creates the missing day document/hour of a reading and increments it in one atomic call
+#   KEYS[1]: user key, KEYS[2]: readings key of the day
+#   ARGV: hour, value
+UPSERT_READING_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return redis.error_reply('user not registered')
+end
+local hour_path = '$["' .. ARGV[1] .. '"]'
+redis.call('JSON.SET', KEYS[2], '$', '{}', 'NX')
+redis.call('JSON.SET', KEYS[2], hour_path, '0', 'NX')
+return redis.call('JSON.NUMINCRBY', KEYS[2], hour_path, ARGV[2])
+"""
+
+# Same as UPSERT_READING_LUA for the packed format: the day is a string of little-endian
+# float32 slots, created zero filled with its full width and updated in place
+#   KEYS[1]: user key, KEYS[2]: packed readings key of the day
+#   ARGV: slot index, value, slots per day
+UPSERT_PACKED_READING_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return redis.error_reply('user not registered')
+end
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    redis.call('SETRANGE', KEYS[2], (tonumber(ARGV[3]) - 1) * 4, struct.pack('<f', 0))
+end
+local offset = tonumber(ARGV[1]) * 4
+local value = struct.unpack('<f', redis.call('GETRANGE', KEYS[2], offset, offset + 3)) + tonumber(ARGV[2])
+redis.call('SETRANGE', KEYS[2], offset, struct.pack('<f', value))
+return tostring(value)
+"""
+
+# Same as UPSERT_READING_LUA for RedisTimeSeries: the first write of a user/kind creates the
+# raw series and its hourly and daily compactions, labelled with the user community
+#   KEYS[1]: user key, KEYS[2]: raw series, KEYS[3]: hourly series, KEYS[4]: daily series
+#   ARGV: timestamp (ms), value, user email, kind, label of users without community
+UPSERT_TIMESERIES_READING_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return redis.error_reply('user not registered')
+end
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    local community = ARGV[5]
+    local reply = redis.call('JSON.GET', KEYS[1], '$.community')
+    if reply then
+        local values = cjson.decode(reply)
+        if values[1] and values[1] ~= cjson.null then
+            community = values[1]
+        end
+    end
+    local resolutions = {'raw', 'hourly', 'daily'}
+    for i = 2, 4 do
+        redis.call('TS.CREATE', KEYS[i], 'DUPLICATE_POLICY', 'SUM', 'LABELS',
+            'user', ARGV[3], 'community', community, 'kind', ARGV[4], 'resolution', resolutions[i - 1])
+    end
+    redis.call('TS.CREATERULE', KEYS[2], KEYS[3], 'AGGREGATION', 'sum', 3600000)
+    redis.call('TS.CREATERULE', KEYS[2], KEYS[4], 'AGGREGATION', 'sum', 86400000)
+end
+return redis.call('TS.ADD', KEYS[2], ARGV[1], ARGV[2], 'ON_DUPLICATE', 'SUM')
+"""
+
+# Community label of the time series of users without community
+NO_COMMUNITY_LABEL = "none"
+
+# Characters with a meaning in TS.MRANGE filters (label=value, label!=value, label=(a,b))
+FILTER_CHARACTERS = ",()=!"
+
+def user_key(user_email):
+    return f"user:{user_email}"
+
+def community_members_key(community):
+    return f"community:{community}:members"
+
+def readings_key(user_email, kind, date):
+    return f"readings:{user_email}:{kind}:{date}"
+
+def packed_readings_key(user_email, kind, date):
+    return f"packed:{user_email}:{kind}:{date}"
+
+def timeseries_key(user_email, kind, resolution="raw"):
+    if resolution == "raw":
+        return f"ts:{user_email}:{kind}"
+    return f"ts:{user_email}:{kind}:{resolution}"
+
+# Compaction series read by the range queries of each resolution: key suffix, bucket (ms)
+# and buckets per day. Months have no fixed length, they are summed from the daily buckets
+COMPACTIONS = {
+    "hour": ("hourly", 3600000, 24),
+    "day": ("daily", 86400000, 1),
+    "month": ("daily", 86400000, 1),
+}
+
+@lru_cache(maxsize=None)
+def slot_labels(slots):
+    """
+    Returns the "HH:MM" label of every slot of a day.
+
+    Input:
+        slots (int): Slots per day (24 for hourly, 96 for 15 minutes).
+
+    Output:
+        tuple: The labels in day order.
+    """
+    step = 1440 // slots
+    return tuple(f"{minute // 60:02d}:{minute % 60:02d}" for minute in range(0, 1440, step))
+
+def hour_to_slot(hour, slots):
+    """
+    Converts an "HH:MM" (or "HH") hour to the index of its slot in the day.
+
+    Input:
+        hour (str or int): The hour of the record.
+        slots (int): Slots per day.
+
+    Output:
+        int: The slot index, raises ValueError if the hour is not valid.
+    """
+    try:
+        parts = str(hour).split(':')
+        minutes = int(parts[0]) * 60 + (int(parts[1]) if len(parts) > 1 else 0)
+    except (ValueError, IndexError):
+        raise ValueError(f"Not a valid hour: {hour}")
+    if not 0 <= minutes < 1440 or len(parts) > 2:
+        raise ValueError(f"Not a valid hour: {hour}")
+    return minutes * slots // 1440
+
+def date_to_timestamp(date):
+    """
+    Converts a "YYYY-MM-DD" date to the epoch milliseconds of its start. Dates are taken
+    as UTC days, so they line up with the daily compaction buckets.
+
+    Input:
+        date (str): The date.
+
+    Output:
+        int: Milliseconds since epoch, raises ValueError if the date is not valid.
+    """
+    try:
+        day = datetime.strptime(date, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    except (TypeError, ValueError):
+        raise ValueError(f"Not a valid date: {date}")
+    return int(day.timestamp()) * 1000
+
+def date_range(start_date, days):
+    """
+    Returns the consecutive dates of a range.
+
+    Input:
+        start_date (str): The first date ("YYYY-MM-DD").
+        days (int): The number of days.
+
+    Output:
+        np.ndarray: The dates as datetime64[D].
+    """
+    date_to_timestamp(start_date)
+    return np.arange(np.datetime64(start_date, 'D'), np.datetime64(start_date, 'D') + days)
+
+class JSONReadingsBackend:
+    """
+    Stores each user-day as a RedisJSON object keyed by "HH:MM".
+    """
+    def __init__(self, client, slots):
+        self.client = client
+        self.slots = slots
+        self.migrated = False
+        self._upsert_script = client.register_script(UPSERT_READING_LUA)
+
+    def legacy_fallback(self):
+        # Checked until the migration marker is found, it is never removed afterwards
+        if not Config.LEGACY_READINGS_FALLBACK or self.migrated:
+            return False
+        self.migrated = self.client.exists(READINGS_MIGRATED_KEY) == 1
+        return not self.migrated
+
+    def upsert(self, client, user_email, kind, date, slot, value):
+        """
+        Increments one slot of a user-day in a single atomic script call.
+
+        Input:
+            client (redis.Redis or redis.client.Pipeline): Where to run the script.
+            user_email (str): The email of the user.
+            kind (str): "consumption" or "production".
+            date (str): The date of the record.
+            slot (int): The slot index in the day.
+            value (float): The value to be added.
+
+        Output:
+            The script reply (or the pipeline when queued).
+        """
+        keys = [user_key(user_email), readings_key(user_email, kind, date)]
+        return self._upsert_script(keys=keys, args=[slot_labels(self.slots)[slot], value], client=client)
+
+    def get_day_series(self, user_email, kind, date):
+        """
+        Reads the readings of a user-day.
+
+        Input:
+            user_email (str): The email of the user.
+            kind (str): "consumption" or "production".
+            date (str): The date of the records.
+
+        Output:
+            np.ndarray: One value per slot, ordered and zero filled.
+        """
+        return self.get_days_matrix(user_email, kind, date, 1)[0]
+
+    def get_days_matrix(self, user_email, kind, start_date, days):
+        """
+        Reads the readings of consecutive user-days in one round trip.
+
+        Input:
+            user_email (str): The email of the user.
+            kind (str): "consumption" or "production".
+            start_date (str): The first date ("YYYY-MM-DD").
+            days (int): The number of days.
+
+        Output:
+            np.ndarray: A days x slots matrix, zero filled.
+        """
+        return self.get_members_days_matrix([user_email], kind, start_date, days)[0]
+
+    def get_resolution_matrix(self, user_email, kind, start_date, days, resolution):
+        # No stored aggregates, the range query sums the slots
+        return self.get_days_matrix(user_email, kind, start_date, days)
+
+    def get_members_days_matrix(self, user_emails, kind, start_date, days, community=None):
+        """
+        Reads the readings of consecutive days of many users with one pipeline.
+
+        Input:
+            user_emails (list): The emails of the users.
+            kind (str): "consumption" or "production".
+            start_date (str): The first date ("YYYY-MM-DD").
+            days (int): The number of days.
+            community (str, optional): The community of the users, unused by this backend.
+
+        Output:
+            np.ndarray: A users x days x slots matrix, zero filled.
+        """
+        dates = [str(date) for date in date_range(start_date, days)]
+        keys = [readings_key(user_email, kind, date) for user_email in user_emails for date in dates]
+        pipe = self.client.pipeline(transaction=False)
+        for chunk in range(0, len(keys), Config.REDIS_BATCH_SIZE):
+            pipe.execute_command('JSON.MGET', *keys[chunk:chunk + Config.REDIS_BATCH_SIZE], '$')
+        fallback = self.legacy_fallback()
+        if fallback:
+            # Hours still waiting in not migrated user documents
+            paths = [f'{LEGACY_READING_PATHS[kind]}["{date}"]' for date in dates]
+            for user_email in user_emails:
+                pipe.execute_command('JSON.GET', user_key(user_email), *paths)
+        replies = pipe.execute()
+
+        chunks = -(-len(keys) // Config.REDIS_BATCH_SIZE)
+        matrix = np.zeros((len(user_emails) * days, self.slots))
+        day_replies = [reply for mget in replies[:chunks] for reply in mget]
+        for row, reply in enumerate(day_replies):
+            if reply:
+                day_data = json.loads(reply)
+                # JSONPath replies wrap the match in a list
+                day_data = day_data[0] if isinstance(day_data, list) and day_data else day_data
+                if day_data:
+                    self.add_hours(matrix[row], day_data)
+        for member, reply in enumerate(replies[chunks:]):
+            if reply is None:
+                continue
+            legacy = json.loads(reply)
+            # A single path is answered with its values, several paths with a dict of them
+            legacy = [legacy] if len(paths) == 1 else [legacy[path] for path in paths]
+            for day, values in enumerate(legacy):
+                if values:
+                    self.add_hours(matrix[member * days + day], values[0])
+        return matrix.reshape(len(user_emails), days, self.slots)
+
+    def add_hours(self, row, hours):
+        # Adds an object keyed by "HH:MM" to a row of slots
+        for hour, value in hours.items():
+            row[hour_to_slot(hour, self.slots)] += value
+
+    def set_community(self, user_email, community):
+        # Readings are found through the community member set, nothing to update
+        pass
+
+class PackedReadingsBackend:
+    """
+    Stores each user-day as a string of little-endian float32 slots.
+    """
+    def __init__(self, client, binary_client, slots):
+        self.client = client
+        self.binary_client = binary_client
+        self.slots = slots
+        self._upsert_script = client.register_script(UPSERT_PACKED_READING_LUA)
+
+    def upsert(self, client, user_email, kind, date, slot, value):
+        keys = [user_key(user_email), packed_readings_key(user_email, kind, date)]
+        return self._upsert_script(keys=keys, args=[slot, value, self.slots], client=client)
+
+    def get_day_series(self, user_email, kind, date):
+        return self.get_days_matrix(user_email, kind, date, 1)[0]
+
+    def get_days_matrix(self, user_email, kind, start_date, days):
+        return self.get_members_days_matrix([user_email], kind, start_date, days)[0]
+
+    def get_resolution_matrix(self, user_email, kind, start_date, days, resolution):
+        # No stored aggregates, the range query sums the slots
+        return self.get_days_matrix(user_email, kind, start_date, days)
+
+    def get_members_days_matrix(self, user_emails, kind, start_date, days, community=None):
+        dates = [str(date) for date in date_range(start_date, days)]
+        keys = [packed_readings_key(user_email, kind, date) for user_email in user_emails for date in dates]
+        pipe = self.binary_client.pipeline(transaction=False)
+        for chunk in range(0, len(keys), Config.REDIS_BATCH_SIZE):
+            pipe.mget(keys[chunk:chunk + Config.REDIS_BATCH_SIZE])
+        raws = [raw for mget in pipe.execute() for raw in mget]
+
+        # Full width days are decoded with a single frombuffer, the rest one by one
+        matrix = np.zeros((len(keys), self.slots), dtype=np.float32)
+        width = self.slots * 4
+        full = [row for row, raw in enumerate(raws) if raw and len(raw) == width]
+        if full:
+            matrix[full] = np.frombuffer(b"".join(raws[row] for row in full), dtype='<f4').reshape(-1, self.slots)
+        for row, raw in enumerate(raws):
+            if raw and len(raw) != width:
+                values = np.frombuffer(raw[:len(raw) - len(raw) % 4], dtype='<f4')[:self.slots]
+                matrix[row, :len(values)] = values
+        return matrix.reshape(len(user_emails), days, self.slots)
+
+    def set_community(self, user_email, community):
+        # Readings are found through the community member set, nothing to update
+        pass
+
+class TimeSeriesReadingsBackend:
+    """
+    Stores one RedisTimeSeries series per user and kind, with hourly and daily
+    compactions, labelled by user, community, kind and resolution.
+    """
+    def __init__(self, client, slots):
+        self.client = client
+        self.slots = slots
+        self.slot_ms = 86400000 // slots
+        self._upsert_script = client.register_script(UPSERT_TIMESERIES_READING_LUA)
+
+    def upsert(self, client, user_email, kind, date, slot, value):
+        keys = [user_key(user_email)] + [timeseries_key(user_email, kind, resolution) for resolution in ("raw", "hourly", "daily")]
+        timestamp = date_to_timestamp(date) + slot * self.slot_ms
+        return self._upsert_script(keys=keys, args=[timestamp, value, user_email, kind, NO_COMMUNITY_LABEL], client=client)
+
+    def samples_to_series(self, samples, start, size, bucket_ms):
+        """
+        Places [timestamp, value] samples in a zero filled array of buckets.
+
+        Input:
+            samples (list): The samples returned by TS.RANGE / TS.MRANGE.
+            start (int): The timestamp of the first bucket.
+            size (int): The number of buckets.
+            bucket_ms (int): The bucket width in milliseconds.
+
+        Output:
+            np.ndarray: One value per bucket.
+        """
+        series = np.zeros(size)
+        if samples:
+            samples = np.array(samples, dtype=float)
+            series[((samples[:, 0] - start) // bucket_ms).astype(int)] = samples[:, 1]
+        return series
+
+    def get_day_series(self, user_email, kind, date):
+        return self.get_days_matrix(user_email, kind, date, 1)[0]
+
+    def get_days_matrix(self, user_email, kind, start_date, days):
+        # Aggregated to slots server side, a single TS.RANGE whatever the number of days
+        start = date_to_timestamp(start_date)
+        try:
+            samples = self.client.execute_command('TS.RANGE', timeseries_key(user_email, kind), start, start + days * 86400000 - 1,
+                                                  'AGGREGATION', 'sum', self.slot_ms)
+        except redis.ResponseError:
+            # The series is created on the first write
+            samples = []
+        return self.samples_to_series(samples, start, days * self.slots, self.slot_ms).reshape(days, self.slots)
+
+    def get_resolution_matrix(self, user_email, kind, start_date, days, resolution):
+        """
+        Reads the compaction series of a range query resolution, already summed by
+        Redis on every write.
+
+        Input:
+            user_email (str): The email of the user.
+            kind (str): "consumption" or "production".
+            start_date (str): The first date ("YYYY-MM-DD").
+            days (int): The number of days.
+            resolution (str): "hour", "day" or "month".
+
+        Output:
+            np.ndarray: A days x 24 (hour) or days x 1 (day and month) matrix, zero filled.
+        """
+        suffix, bucket_ms, buckets = COMPACTIONS[resolution]
+        start = date_to_timestamp(start_date)
+        try:
+            # LATEST adds the bucket still open (today, this hour), not yet compacted
+            samples = self.client.execute_command('TS.RANGE', timeseries_key(user_email, kind, suffix),
+                                                  start, start + days * 86400000 - 1, 'LATEST')
+        except redis.ResponseError:
+            # The series is created on the first write
+            samples = []
+        return self.samples_to_series(samples, start, days * buckets, bucket_ms).reshape(days, buckets)
+
+    def get_members_days_matrix(self, user_emails, kind, start_date, days, community=None):
+        """
+        Reads the series of many users with one TS.MRANGE, filtered by the community
+        label when given and by the user label otherwise.
+
+        Input:
+            user_emails (list): The emails of the users.
+            kind (str): "consumption" or "production".
+            start_date (str): The first date ("YYYY-MM-DD").
+            days (int): The number of days.
+            community (str, optional): The community label shared by the users.
+
+        Output:
+            np.ndarray: A users x days x slots matrix, zero filled.
+        """
+        start = date_to_timestamp(start_date)
+        matrix = np.zeros((len(user_emails), days, self.slots))
+        if not user_emails:
+            return matrix
+        if community is not None:
+            filters = [f'community={community}']
+        else:
+            filters = [f'user=({",".join(user_emails)})']
+        replies = self.client.execute_command('TS.MRANGE', start, start + days * 86400000 - 1, 'WITHLABELS',
+                                              'AGGREGATION', 'sum', self.slot_ms,
+                                              'FILTER', *filters, f'kind={kind}', 'resolution=raw')
+        rows = {user_email: row for row, user_email in enumerate(user_emails)}
+        for _, labels, samples in replies:
+            row = rows.get(dict(labels)['user'])
+            if row is not None:
+                matrix[row] = self.samples_to_series(samples, start, days * self.slots, self.slot_ms).reshape(days, self.slots)
+        return matrix
+
+    def set_community(self, user_email, community):
+        """
+        Relabels the series of a user after a community change. TS.ALTER replaces all
+        the labels, so every one of them is sent again.
+
+        Input:
+            user_email (str): The email of the user.
+            community (str): The new community, or None.
+
+        Output:
+            None
+        """
+        pipe = self.client.pipeline(transaction=False)
+        for kind in ("consumption", "production"):
+            for resolution in ("raw", "hourly", "daily"):
+                pipe.execute_command('TS.ALTER', timeseries_key(user_email, kind, resolution), 'LABELS',
+                                     'user', user_email, 'community', community or NO_COMMUNITY_LABEL,
+                                     'kind', kind, 'resolution', resolution)
+        # Series not written yet do not exist, they get the label when created
+        pipe.execute(raise_on_error=False)
+
+def create_backend(name, client, binary_client, slots):
+    """
+    Creates the readings storage backend selected in the configuration.
+
+    Input:
+        name (str): 'json', 'packed' or 'timeseries'.
+        client (redis.Redis): Connection decoding responses.
+        binary_client (redis.Redis): Connection returning raw bytes.
+        slots (int): Slots per day.
+
+    Output:
+        object: The backend, raises ValueError for an unknown name.
+    """
+    if name == 'json':
+        return JSONReadingsBackend(client, slots)
+    if name == 'packed':
+        return PackedReadingsBackend(client, binary_client, slots)
+    if name == 'timeseries':
+        return TimeSeriesReadingsBackend(client, slots)
+    raise ValueError(f"Not a valid readings backend: {name}")
@@ -0,0 +1,120 @@
+import numpy as np
+from app.models.CEC_model import RANGE_RESOLUTIONS, aggregate_days, slot_labels
+
+def shares(member_totals):
+    """
+    Computes the share of each member in a community total.
+
+    Input:
+        member_totals (np.ndarray): The total of each member.
+
+    Output:
+        np.ndarray: The share of each member (0 when the community total is 0).
+    """
+    total = member_totals.sum()
+    if total == 0:
+        return np.zeros_like(member_totals, dtype=float)
+    return member_totals / total
+
+class CommunityEngine:
+    """
+    Aggregates the readings of every member of a community. Members are read in bulk
+    into members x days x slots matrices and reduced with NumPy.
+    """
+    def __init__(self, redis_model):
+        self.redis_model = redis_model
+
+    def get_matrices(self, community, start_date, end_date):
+        """
+        Reads the consumption and production of every member of a community.
+
+        Input:
+            community (str): The name of the community.
+            start_date (str): The first date ("YYYY-MM-DD").
+            end_date (str): The last date ("YYYY-MM-DD").
+
+        Output:
+            tuple: The member emails, the datetime64[D] dates, and the consumption and
+                   production members x days x slots matrices.
+        """
+        members = self.redis_model.get_community_members(community)
+        dates, consumption = self.redis_model.get_members_range_matrix(members, "consumption", start_date, end_date, community)
+        dates, production = self.redis_model.get_members_range_matrix(members, "production", start_date, end_date, community)
+        return members, dates, consumption, production
+
+    def member_shares(self, members, consumption, production):
+        """
+        Computes the share of every member in the community consumption and production.
+
+        Input:
+            members (list): The member emails.
+            consumption (np.ndarray): The members x days x slots consumption.
+            production (np.ndarray): The members x days x slots production.
+
+        Output:
+            dict: The consumption and production shares, keyed by member email.
+        """
+        consumption_shares = shares(consumption.sum(axis=(1, 2))).tolist()
+        production_shares = shares(production.sum(axis=(1, 2))).tolist()
+        return {
+            member: {"consumption": consumption_share, "production": production_share}
+            for member, consumption_share, production_share in zip(members, consumption_shares, production_shares)
+        }
+
+    def get_day(self, community, date):
+        """
+        Computes the community totals, surplus and member shares of one day.
+
+        Input:
+            community (str): The name of the community.
+            date (str): The date ("YYYY-MM-DD").
+
+        Output:
+            dict: The per-slot community consumption, production and surplus, and the member shares.
+        """
+        members, _, consumption, production = self.get_matrices(community, date, date)
+        total_consumption = consumption[:, 0].sum(axis=0)
+        total_production = production[:, 0].sum(axis=0)
+        labels = slot_labels(len(total_consumption))
+        return {
+            "community": community,
+            "date": date,
+            "members": len(members),
+            "hourly": {
+                "consumption": dict(zip(labels, total_consumption.tolist())),
+                "production": dict(zip(labels, total_production.tolist())),
+                "surplus": dict(zip(labels, (total_production - total_consumption).tolist()))
+            },
+            "shares": self.member_shares(members, consumption, production)
+        }
+
+    def get_range(self, community, start_date, end_date, resolution="day"):
+        """
+        Computes the community totals, surplus and member shares between two dates.
+
+        Input:
+            community (str): The name of the community.
+            start_date (str): The first date ("YYYY-MM-DD").
+            end_date (str): The last date ("YYYY-MM-DD").
+            resolution (str, optional): "hour", "day" or "month". Defaults to "day".
+
+        Output:
+            dict: The labels, the community consumption, production and surplus, and the member shares.
+        """
+        if resolution not in RANGE_RESOLUTIONS:
+            raise ValueError(f"Not a valid resolution: {resolution}")
+        members, dates, consumption, production = self.get_matrices(community, start_date, end_date)
+        total_consumption = consumption.sum(axis=0)
+        total_production = production.sum(axis=0)
+        labels, consumption_values = aggregate_days(total_consumption, dates, resolution)
+        _, production_values = aggregate_days(total_production, dates, resolution)
+        return {
+            "community": community,
+            "resolution": resolution,
+            "members": len(members),
+            "labels": labels,
+            "consumption": consumption_values.tolist(),
+            "production": production_values.tolist(),
+            "surplus": (production_values - consumption_values).tolist(),
+            "shares": self.member_shares(members, consumption, production)
+        }
@@ -1,12 +1,79 @@
 import redis
 import json
+import numpy as np
 from app.config import Config
+from app.metrics import instrument_redis
+from app.models.CEC_backends import (FILTER_CHARACTERS, LEGACY_READING_PATHS, NO_COMMUNITY_LABEL, READINGS_MIGRATED_KEY,
+                                     community_members_key, create_backend, date_range, date_to_timestamp,
+                                     hour_to_slot, slot_labels, user_key)
 import hashlib
-import sys
+
+# Kinds of readings a user can store
+READING_KINDS = ("consumption", "production")
+
+# Resolutions of the range queries
+RANGE_RESOLUTIONS = ("hour", "day", "month")
 
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
+# Set with the name of every community
+COMMUNITIES_KEY = "communities"
+
+def check_community_name(community):
+    # Community names are time series label values: they must not be the label of users
+    # without community nor break the TS.MRANGE filter syntax
+    if not isinstance(community, str) or not community.strip():
+        raise ValueError("Not a valid community name")
+    if community == NO_COMMUNITY_LABEL or any(character in community for character in FILTER_CHARACTERS):
+        raise ValueError(f"Not a valid community name: '{community}' (reserved name or one of {FILTER_CHARACTERS})")
+
+def range_days(start_date, end_date):
+    """
+    Returns the number of days between two dates (both included), checking the range is valid.
+    
+    Input:
+        start_date (str): The first date ("YYYY-MM-DD").
+        end_date (str): The last date ("YYYY-MM-DD").
+    
+    Output:
+        int: The number of days, raises ValueError if the range is not valid.
+    """
+    try:
+        days = int((np.datetime64(end_date, 'D') - np.datetime64(start_date, 'D')).astype(int)) + 1
+    except ValueError:
+        raise ValueError(f"Not a valid date range: {start_date} - {end_date}")
+    if days < 1:
+        raise ValueError("'end_date' must not be before 'start_date'")
+    if days > Config.MAX_RANGE_DAYS:
+        raise ValueError(f"Date ranges are limited to {Config.MAX_RANGE_DAYS} days")
+    return days
+
+def aggregate_days(matrix, dates, resolution):
+    """
+    Aggregates a days x slots matrix of readings to the requested resolution.
+    
+    Input:
+        matrix (np.ndarray): One row per day, one column per slot.
+        dates (np.ndarray): The datetime64[D] date of each row.
+        resolution (str): "hour", "day" or "month".
+    
+    Output:
+        tuple: The labels ("YYYY-MM-DD HH:00", "YYYY-MM-DD" or "YYYY-MM") and an array of values.
+    """
+    if resolution == "hour":
+        hourly = matrix.reshape(len(dates), 24, -1).sum(axis=2)
+        labels = [f"{date} {hour}" for date in dates.astype(str) for hour in slot_labels(24)]
+        return labels, hourly.ravel()
+    daily = matrix.sum(axis=1)
+    if resolution == "day":
+        return dates.astype(str).tolist(), daily
+    if resolution == "month":
+        months = dates.astype('datetime64[M]')
+        starts = np.flatnonzero(np.r_[True, months[1:] != months[:-1]])
+        return months[starts].astype(str).tolist(), np.add.reduceat(daily, starts)
+    raise ValueError(f"Not a valid resolution: {resolution}")
+
 class RedisModel:
     def __init__(self):
         """
@@ -15,40 +82,142 @@ class RedisModel:
         Input: None
         Output: None
         """
-        self.client = redis.StrictRedis(
+        self.client = instrument_redis(redis.StrictRedis(
             host=Config.REDIS_HOST,
             port=Config.REDIS_PORT,
             decode_responses=True
-        )
+        ))
+        # Packed day arrays are read as raw bytes
+        self.binary_client = instrument_redis(redis.StrictRedis(
+            host=Config.REDIS_HOST,
+            port=Config.REDIS_PORT
+        ))
+        self.slots = Config.READINGS_SLOTS_PER_DAY
+        # Where readings are stored (see CEC_backends), its scripts are loaded on first use
+        self.backend = create_backend(Config.READINGS_BACKEND, self.client, self.binary_client, self.slots)
         
-    def create_user(self, user_name, user_email, user_password):
+    def create_user(self, user_name, user_email, user_password, community=None):
         """
         Creates a new user in the Redis database with the provided user details.
+        Only the user metadata is stored in the user key, readings go to the storage backend.
         
         Input:
             user_name (str): The name of the user.
             user_email (str): The email of the user (used as a unique key).
             user_password (str): The password of the user (will be hashed).
+            community (str, optional): The energy community the user belongs to.
         
         Output:
             dict: A message confirming the user creation.
         """
-        key = f"user:{user_email}"
+        key = user_key(user_email)
+        if community:
+            check_community_name(community)
 
         # Define user data
         user_document = {
             "user_name": user_name,
             "user_email": user_email,
             "user_password": hash_password(user_password),  # Use the stable hash function
-            "user_consumption": {},  # Initialize as an object
-            "user_production": {}    # Initialize as an object
+            "community": community
         }
 
-        # Save to Redis
-        self.client.execute_command('JSON.SET', key, '.', json.dumps(user_document))
+        # Save to Redis, with the community membership in the same transaction
+        pipe = self.client.pipeline(transaction=True)
+        pipe.execute_command('JSON.SET', key, '.', json.dumps(user_document))
+        if community:
+            pipe.sadd(COMMUNITIES_KEY, community)
+            pipe.sadd(community_members_key(community), user_email)
+        pipe.execute()
 
         return {"message": f"User '{user_name}' with e-mail {user_email} has been successfully created."}
 
+    def create_community(self, community):
+        """
+        Registers an energy community.
+        
+        Input:
+            community (str): The name of the community.
+        
+        Output:
+            dict: A message confirming the community creation, raises ValueError if the name
+                  is not valid or already exists.
+        """
+        check_community_name(community)
+        if self.client.sadd(COMMUNITIES_KEY, community) == 0:
+            raise ValueError(f"Community '{community}' already exists")
+        return {"message": f"Community '{community}' has been successfully created."}
+
+    def community_exists(self, community):
+        return self.client.sismember(COMMUNITIES_KEY, community) == 1
+
+    def set_user_community(self, user_email, community):
+        """
+        Moves a user to a community (or out of any community when None), keeping the
+        member sets and the user document in step.
+        
+        Input:
+            user_email (str): The email of the user.
+            community (str): The name of the community, or None.
+        
+        Output:
+            dict: A message confirming the change.
+        """
+        if community is not None and not self.community_exists(community):
+            raise ValueError(f"Community '{community}' does not exist")
+        user = self.get_user(user_email)
+        if user is None:
+            raise ValueError("user not registered")
+
+        pipe = self.client.pipeline(transaction=True)
+        if user['community']:
+            pipe.srem(community_members_key(user['community']), user_email)
+        if community is not None:
+            pipe.sadd(community_members_key(community), user_email)
+        pipe.execute_command('JSON.SET', user_key(user_email), '$.community', json.dumps(community))
+        pipe.execute()
+        self.backend.set_community(user_email, community)
+
+        if community is None:
+            return {"message": f"User {user_email} has left community '{user['community']}'."}
+        return {"message": f"User {user_email} has joined community '{community}'."}
+
+    def get_community_members(self, community):
+        """
+        Retrieves the members of a community.
+        
+        Input:
+            community (str): The name of the community.
+        
+        Output:
+            list: The sorted member emails, raises ValueError if the community does not exist.
+        """
+        if not self.community_exists(community):
+            raise ValueError(f"Community '{community}' does not exist")
+        return sorted(self.client.smembers(community_members_key(community)))
+
+    def get_members_range_matrix(self, user_emails, kind, start_date, end_date, community=None):
+        """
+        Retrieves the readings of one kind for many users between two dates with one
+        pipelined read.
+        
+        Input:
+            user_emails (list): The emails of the users.
+            kind (str): "consumption" or "production".
+            start_date (str): The first date ("YYYY-MM-DD").
+            end_date (str): The last date ("YYYY-MM-DD").
+            community (str, optional): The community all the users belong to.
+        
+        Output:
+            tuple: The datetime64[D] dates and the users x days x slots matrix of readings.
+        """
+        days = range_days(start_date, end_date)
+        try:
+            matrix = self.backend.get_members_days_matrix(user_emails, kind, start_date, days, community)
+        except redis.RedisError as e:
+            raise ValueError(f"Failed to read {kind}: {e}")
+        return date_range(start_date, days), matrix
+
     def add_consumption(self, user_email, date, hour, value):
         """
         Adds a consumption record for a user on a specific date and hour.
@@ -62,33 +231,9 @@ class RedisModel:
         Output:
             dict: A message confirming the consumption record addition.
         """
-        key = f"user:{user_email}"
-        base_path = "$.user_consumption"
-
-        # Initialize user_consumption if it doesn't exist
-        try:
-            existing_data = self.client.execute_command('JSON.GET', key, base_path)
-            if existing_data is None or existing_data == "[]":
-                self.client.execute_command('JSON.SET', key, base_path, "{}")
-        except Exception as e:
-            raise ValueError(f"Failed to initialize consumption: {e}")
-
-        # Initialize date if it doesn't exist
         try:
-            date_path = f"{base_path}.{date}"
-            existing_date = self.client.execute_command('JSON.GET', key, date_path)
-            if existing_date is None or existing_date == "[]":
-                self.client.execute_command('JSON.SET', key, date_path, "{}")
-        except Exception as e:
-            raise ValueError(f"Failed to initialize date: {e}")
-
-        # Increment or set the specific hour value
-        try:
-            hour_path = f"{base_path}.{date}.{hour}"
-            increment = self.client.execute_command('JSON.NUMINCRBY', key, hour_path, value)
-            if increment is None or increment == "[]":
-                self.client.execute_command('JSON.SET', key, hour_path, value)
-        except Exception as e:
+            self.upsert_reading(self.client, user_email, "consumption", date, hour, value)
+        except redis.RedisError as e:
             raise ValueError(f"Failed to update consumption value: {e}")
 
         return {"message": f"Consumption of {value} added for {date} at {hour}."}
@@ -106,55 +251,139 @@ class RedisModel:
         Output:
             dict: A message confirming the production record addition.
         """
-        key = f"user:{user_email}"
-        base_path = "$.user_production"
-
-        # Initialize user_production if it doesn't exist
-        try:
-            existing_data = self.client.execute_command('JSON.GET', key, base_path)
-            if existing_data is None or existing_data == "[]":
-                self.client.execute_command('JSON.SET', key, base_path, "{}")
-        except Exception as e:
-            raise ValueError(f"Failed to initialize production: {e}")
-
-        # Initialize date if it doesn't exist
         try:
-            date_path = f"{base_path}.{date}"
-            existing_date = self.client.execute_command('JSON.GET', key, date_path)
-            if existing_date is None or existing_date == "[]":
-                self.client.execute_command('JSON.SET', key, date_path, "{}")
-        except Exception as e:
-            raise ValueError(f"Failed to initialize date: {e}")
-
-        # Increment or set the specific hour value
-        try:
-            hour_path = f"{base_path}.{date}.{hour}"
-            increment = self.client.execute_command('JSON.NUMINCRBY', key, hour_path, value)
-            if increment is None or increment == "[]":
-                self.client.execute_command('JSON.SET', key, hour_path, value)
-        except Exception as e:
+            self.upsert_reading(self.client, user_email, "production", date, hour, value)
+        except redis.RedisError as e:
             raise ValueError(f"Failed to update production value: {e}")
 
         return {"message": f"Production of {value} added for {date} at {hour}."}
+
+    def upsert_reading(self, client, user_email, kind, date, hour, value):
+        """
+        Increments the value of one hour through the storage backend, creating the
+        missing day data on the way in the same atomic call.
+        
+        Input:
+            client (redis.Redis or redis.client.Pipeline): Where to run the write.
+            user_email (str): The email of the user.
+            kind (str): "consumption" or "production".
+            date (str): The date of the record ("YYYY-MM-DD"), raises ValueError if it is not valid.
+            hour (str): The hour of the record, raises ValueError if it is not valid.
+            value (float): The value to be added.
+        
+        Output:
+            The backend reply (or the pipeline when queued).
+        """
+        # Checked here for every backend: the JSON and packed ones put the date in the key name
+        date_to_timestamp(date)
+        return self.backend.upsert(client, user_email, kind, date, hour_to_slot(hour, self.slots), value)
+
+    def user_exists(self, user_email):
+        """
+        Checks whether a user is registered without reading its document.
+        
+        Input:
+            user_email (str): The email of the user (used as a unique key).
+        
+        Output:
+            bool: True if the user exists.
+        """
+        return self.client.exists(user_key(user_email)) == 1
     
     def get_user(self, user_email):
         """
-        Retrieves the user data from the Redis database based on the user's email.
+        Retrieves the user metadata from the Redis database based on the user's email.
+        Only the metadata fields are read, so not yet migrated documents are not pulled whole.
         
         Input:
             user_email (str): The email of the user (used as a unique key).
         
         Output:
-            dict: The user data in JSON format, or None if the user does not exist.
+            dict: The user name, email and community, or None if the user does not exist.
         """
-        key = f"user:{user_email}"
-        json_data = self.client.execute_command('JSON.GET', key)
-        print(f"""[CEC Model] (get_user)
-                  Key: {key}, Query result: {json_data}""", file=sys.stderr)
+        json_data = self.client.execute_command('JSON.GET', user_key(user_email), '$.user_name', '$.user_email', '$.community')
         if json_data is None:
             return None
-        else:
-            return json.loads(json_data)
+        projection = json.loads(json_data)
+        return {field: (projection.get(f"$.{field}") or [None])[0] for field in ("user_name", "user_email", "community")}
+
+    def get_day_series(self, user_email, kind, date):
+        """
+        Retrieves the readings of one kind for a user-day as an ordered, zero filled series.
+        
+        Input:
+            user_email (str): The email of the user.
+            kind (str): "consumption" or "production".
+            date (str): The date of the records.
+        
+        Output:
+            np.ndarray: One value per slot of the day.
+        """
+        try:
+            return self.backend.get_day_series(user_email, kind, date)
+        except redis.RedisError as e:
+            raise ValueError(f"Failed to read {kind}: {e}")
+
+    def get_day(self, user_email, kind, date):
+        """
+        Retrieves the readings of one kind for a user on a specific date.
+        
+        Input:
+            user_email (str): The email of the user (used as a unique key).
+            kind (str): "consumption" or "production".
+            date (str): The date of the records.
+        
+        Output:
+            list: A one element list with the data of the date keyed by "HH:MM".
+        """
+        series = self.get_day_series(user_email, kind, date)
+        return [dict(zip(slot_labels(self.slots), series.tolist()))]
+
+    def get_range_matrix(self, user_email, kind, start_date, end_date, resolution=None):
+        """
+        Retrieves the readings of one kind for a user between two dates (both included)
+        with a single batched read.
+        
+        Input:
+            user_email (str): The email of the user.
+            kind (str): "consumption" or "production".
+            start_date (str): The first date ("YYYY-MM-DD").
+            end_date (str): The last date ("YYYY-MM-DD").
+            resolution (str, optional): "hour", "day" or "month" to let the backend read its
+                                        aggregates (fewer columns, same aggregate_days result).
+        
+        Output:
+            tuple: The datetime64[D] dates and the days x slots matrix of readings.
+        """
+        days = range_days(start_date, end_date)
+        try:
+            if resolution is None:
+                matrix = self.backend.get_days_matrix(user_email, kind, start_date, days)
+            else:
+                matrix = self.backend.get_resolution_matrix(user_email, kind, start_date, days, resolution)
+        except redis.RedisError as e:
+            raise ValueError(f"Failed to read {kind}: {e}")
+        return date_range(start_date, days), matrix
+
+    def get_range_series(self, user_email, kind, start_date, end_date, resolution="day"):
+        """
+        Retrieves the readings of one kind for a user between two dates, aggregated by
+        hour, day or month.
+        
+        Input:
+            user_email (str): The email of the user.
+            kind (str): "consumption" or "production".
+            start_date (str): The first date ("YYYY-MM-DD").
+            end_date (str): The last date ("YYYY-MM-DD").
+            resolution (str, optional): "hour", "day" or "month". Defaults to "day".
+        
+        Output:
+            tuple: The labels and an array of values.
+        """
+        if resolution not in RANGE_RESOLUTIONS:
+            raise ValueError(f"Not a valid resolution: {resolution}")
+        dates, matrix = self.get_range_matrix(user_email, kind, start_date, end_date, resolution)
+        return aggregate_days(matrix, dates, resolution)
 
     def get_production_day(self, user_email, date):
         """
@@ -165,24 +394,9 @@ class RedisModel:
             date (str): The date of the production record.
         
         Output:
-            dict: The production data for the specified date, or a default empty structure if no data exists.
+            list: The production data for the specified date, or a default empty structure if no data exists.
         """
-        key = f"user:{user_email}"
-        base_path = "$.user_production"
-        date_path = f"{base_path}.{date}"
-        try:
-            date_path = f"{base_path}.{date}"
-            existing_date = self.client.execute_command('JSON.GET', key, date_path)
-            print(f"""[CEC Model] (get_production_day)
-                  Key: {key}, Path: {date_path}, Query result: {existing_date}""", file=sys.stderr)
-            if existing_date is None or existing_date == "[]":
-                default_struct = [{}]
-                return default_struct
-            else:
-                production = self.client.execute_command('JSON.GET', key, date_path)
-                return json.loads(production)
-        except Exception as e:
-            raise ValueError(f"Failed to initialize date: {e}")
+        return self.get_day(user_email, "production", date)
         
     def get_consumption_day(self, user_email, date):
         """
@@ -193,23 +407,161 @@ class RedisModel:
             date (str): The date of the consumption record.
         
         Output:
-            dict: The consumption data for the specified date, or a default empty structure if no data exists.
+            list: The consumption data for the specified date, or a default empty structure if no data exists.
         """
-        key = f"user:{user_email}"
-        base_path = "$.user_consumption"
-        date_path = f"{base_path}.{date}"
-        try:
-            date_path = f"{base_path}.{date}"
-            existing_date = self.client.execute_command('JSON.GET', key, date_path)
-            print(f"""[CEC Model] (get_consumption_day)
-                  Key: {key}, Path: {date_path}, Query result: {existing_date}""", file=sys.stderr)
-            if existing_date is None or existing_date == "[]":
-                default_struct = [{}]
-                return default_struct
-            else:
-                consumption = self.client.execute_command('JSON.GET', key, date_path)
-                return json.loads(consumption)
-        except Exception as e:
-            raise ValueError(f"Failed to initialize date: {e}") 
+        return self.get_day(user_email, "consumption", date)
 
-    
+    def add_readings_batch(self, records):
+        """
+        Adds many consumption/production records at once, grouping them by user and
+        writing each user's records in a single transactional pipeline of upsert script calls.
+        
+        Input:
+            records (list): A list of dicts with the keys 'user_email', 'date', 'hour',
+                            'kind' ("consumption" or "production") and 'value'.
+        
+        Output:
+            dict: A summary with the number of succeeded and failed records and a
+                  per-record result list, in the same order as the input.
+        """
+        results = [None] * len(records)
+        records_by_user = {}
+
+        # Validate every record before touching Redis
+        for index, record in enumerate(records):
+            if not isinstance(record, dict):
+                results[index] = {"index": index, "error": "Record must be an object"}
+                continue
+            missing = [field for field in ("user_email", "date", "hour", "kind", "value") if field not in record]
+            if missing:
+                results[index] = {"index": index, "error": f"Missing key: {', '.join(missing)}"}
+                continue
+            if not isinstance(record['user_email'], str):
+                results[index] = {"index": index, "error": f"Not a valid user_email: {record['user_email']}"}
+                continue
+            if not isinstance(record['date'], str):
+                results[index] = {"index": index, "error": f"Not a valid date: {record['date']}"}
+                continue
+            if isinstance(record['hour'], bool) or not isinstance(record['hour'], (str, int)):
+                results[index] = {"index": index, "error": f"Not a valid hour: {record['hour']}"}
+                continue
+            if record['kind'] not in READING_KINDS:
+                results[index] = {"index": index, "error": f"Not a valid kind: {record['kind']}"}
+                continue
+            if isinstance(record['value'], bool) or not isinstance(record['value'], (int, float)):
+                results[index] = {"index": index, "error": f"Not a valid value: {record['value']}"}
+                continue
+            try:
+                date_to_timestamp(record['date'])
+            except ValueError as e:
+                results[index] = {"index": index, "error": str(e)}
+                continue
+            records_by_user.setdefault(record['user_email'], []).append(index)
+
+        # Check all users exist in one round trip
+        user_emails = list(records_by_user)
+        pipe = self.client.pipeline(transaction=False)
+        for user_email in user_emails:
+            pipe.exists(user_key(user_email))
+        exists = pipe.execute()
+
+        for user_email, user_exists in zip(user_emails, exists):
+            indexes = records_by_user[user_email]
+            if not user_exists:
+                for index in indexes:
+                    results[index] = {"index": index, "error": "user not registered"}
+                continue
+
+            # Queue every write of this user and send them as one MULTI/EXEC block
+            pipe = self.client.pipeline(transaction=True)
+            queued = []
+            for index in indexes:
+                record = records[index]
+                try:
+                    self.upsert_reading(pipe, user_email, record['kind'], record['date'], record['hour'], record['value'])
+                    queued.append(index)
+                except ValueError as e:
+                    results[index] = {"index": index, "error": str(e)}
+            if not queued:
+                continue
+            try:
+                replies = pipe.execute(raise_on_error=False)
+            except redis.RedisError as e:
+                for index in queued:
+                    results[index] = {"index": index, "error": f"Failed to update value: {e}"}
+                continue
+
+            for index, reply in zip(queued, replies):
+                if isinstance(reply, Exception):
+                    results[index] = {"index": index, "error": f"Failed to update value: {reply}"}
+                else:
+                    results[index] = {"index": index, "status": "ok"}
+
+        failed = sum(1 for result in results if "error" in result)
+        return {
+            "message": f"{len(records) - failed} of {len(records)} readings added.",
+            "succeeded": len(records) - failed,
+            "failed": failed,
+            "results": results
+        }
+
+    def migrate_user(self, user_email):
+        """
+        Moves the readings of a user stored in the old one-document layout to the storage backend.
+        The move is done in a WATCH/MULTI transaction, so writers still using the old
+        layout during a rolling deploy just make it retry, and readers see the hours
+        either in the old document or in the day keys, never in both.
+        
+        Input:
+            user_email (str): The email of the user (used as a unique key).
+        
+        Output:
+            int: The number of day documents merged into per-day keys.
+        """
+        key = user_key(user_email)
+        with self.client.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    legacy = {}
+                    for kind, path in LEGACY_READING_PATHS.items():
+                        reply = pipe.execute_command('JSON.GET', key, path)
+                        if reply is not None and reply != "[]":
+                            legacy[kind] = json.loads(reply)[0]
+                    if not legacy:
+                        pipe.unwatch()
+                        return 0
+
+                    # Added to what the storage backend may already hold for the same hours
+                    pipe.multi()
+                    days = 0
+                    for kind, dates in legacy.items():
+                        for date, hours in dates.items():
+                            for hour, value in hours.items():
+                                self.upsert_reading(pipe, user_email, kind, date, hour, value)
+                            days += 1
+                        pipe.execute_command('JSON.DEL', key, LEGACY_READING_PATHS[kind])
+                    pipe.execute()
+                    return days
+                except redis.WatchError:
+                    continue
+
+    def migrate_all_users(self, batch_size=100):
+        """
+        Migrates every user stored in the old layout, walking the keyspace with SCAN
+        so the server keeps serving requests while it runs. When done, marks the
+        migration as complete so reads stop looking into the user documents.
+        
+        Input:
+            batch_size (int, optional): The SCAN count hint. Defaults to 100.
+        
+        Output:
+            dict: The number of users visited and day documents migrated.
+        """
+        users = 0
+        days = 0
+        for key in self.client.scan_iter(match="user:*", count=batch_size, _type="ReJSON-RL"):
+            days += self.migrate_user(key[len("user:"):])
+            users += 1
+        self.client.set(READINGS_MIGRATED_KEY, 1)
+        return {"users": users, "days": days}
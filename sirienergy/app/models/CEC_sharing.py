@@ -0,0 +1,275 @@
+import json
+import math
+import numpy as np
+from datetime import datetime
+from app.models.CEC_model import range_days
+
+# Allocation methods of the community production
+SHARING_METHODS = ("static", "dynamic", "capped")
+
+def sharing_key(community, month):
+    return f"sharing:{community}:{month}"
+
+def coefficients_key(community):
+    return f"community:{community}:coefficients"
+
+def allocate_static(production, coefficients):
+    """
+    Shares the production with fixed coefficients.
+
+    Input:
+        production (np.ndarray): The community production of each slot.
+        coefficients (np.ndarray): The coefficient of each member (adding up to 1 at most).
+
+    Output:
+        np.ndarray: The members x slots allocated energy.
+    """
+    return coefficients[:, None] * production[None, :]
+
+def allocate_dynamic(production, consumption):
+    """
+    Shares the production of each slot in proportion to the consumption of that slot.
+
+    Input:
+        production (np.ndarray): The community production of each slot.
+        consumption (np.ndarray): The members x slots consumption.
+
+    Output:
+        np.ndarray: The members x slots allocated energy (nothing in slots without consumption).
+    """
+    total = consumption.sum(axis=0)
+    coefficients = np.divide(consumption, total, out=np.zeros_like(consumption, dtype=float), where=total > 0)
+    return coefficients * production[None, :]
+
+def allocate_capped(production, consumption, coefficients):
+    """
+    Shares the production with coefficients, but caps every allocation at the member
+    consumption and shares what is left again among the members still below their cap,
+    until the production or the demand runs out. Solved exactly for every slot at once:
+    each member gets min(coefficient * level, consumption), and the level of each slot
+    is found from the members sorted by consumption / coefficient.
+
+    Input:
+        production (np.ndarray): The community production of each slot.
+        consumption (np.ndarray): The members x slots consumption.
+        coefficients (np.ndarray): The coefficient of each member.
+
+    Output:
+        np.ndarray: The members x slots allocated energy.
+    """
+    weights = np.broadcast_to(coefficients[:, None].astype(float), consumption.shape)
+    caps = np.where(weights > 0, consumption, 0.0)
+    ratios = np.divide(caps, weights, out=np.zeros_like(caps), where=weights > 0)
+
+    order = np.argsort(ratios, axis=0)
+    sorted_ratios = np.take_along_axis(ratios, order, axis=0)
+    sorted_caps = np.take_along_axis(caps, order, axis=0)
+    sorted_weights = np.take_along_axis(weights, order, axis=0)
+
+    # Allocated total when the level reaches the k-th ratio: members before k are capped
+    capped_total = np.cumsum(sorted_caps, axis=0) - sorted_caps
+    open_weights = np.cumsum(sorted_weights[::-1], axis=0)[::-1]
+    totals = capped_total + sorted_ratios * open_weights
+
+    reached = totals >= production[None, :]
+    k = reached.argmax(axis=0)
+    slots = np.arange(consumption.shape[1])
+    levels = np.divide(production - capped_total[k, slots], open_weights[k, slots],
+                       out=np.zeros(len(slots)), where=open_weights[k, slots] > 0)
+    # Enough production for every capped member
+    levels = np.where(reached.any(axis=0), levels, np.inf)
+    # Members without coefficient are skipped (0 * inf would be nan)
+    shares = np.multiply(weights, levels[None, :], out=np.zeros_like(caps), where=weights > 0)
+    return np.where(weights > 0, np.minimum(shares, caps), 0.0)
+
+def settle(allocated, consumption):
+    """
+    Splits the allocated energy into what each member consumes and what is left.
+
+    Input:
+        allocated (np.ndarray): The members x slots allocated energy.
+        consumption (np.ndarray): The members x slots consumption.
+
+    Output:
+        tuple: The members x slots self-consumed energy and surplus.
+    """
+    self_consumed = np.minimum(allocated, consumption)
+    return self_consumed, allocated - self_consumed
+
+class SharingEngine:
+    """
+    Distributes the community production among its members (collective self-consumption)
+    and stores the results per community and month.
+    """
+    def __init__(self, redis_model, community_engine):
+        self.redis_model = redis_model
+        self.community_engine = community_engine
+
+    def set_coefficients(self, community, coefficients):
+        """
+        Stores the static sharing coefficients of a community.
+
+        Input:
+            community (str): The name of the community.
+            coefficients (dict): The coefficient of each member email.
+
+        Output:
+            dict: A message confirming the change.
+        """
+        members = set(self.redis_model.get_community_members(community))
+        unknown = [member for member in coefficients if member not in members]
+        if unknown:
+            raise ValueError(f"Not members of '{community}': {', '.join(unknown)}")
+        try:
+            values = {member: float(value) for member, value in coefficients.items()}
+        except (TypeError, ValueError):
+            raise ValueError("Coefficients must be numbers")
+        # NaN passes both comparisons below and would spread through every allocation
+        if not all(math.isfinite(value) for value in values.values()):
+            raise ValueError("Coefficients must be finite numbers")
+        if any(value < 0 for value in values.values()) or sum(values.values()) > 1 + 1e-9:
+            raise ValueError("Coefficients must be positive and add up to 1 at most")
+
+        pipe = self.redis_model.client.pipeline(transaction=True)
+        pipe.delete(coefficients_key(community))
+        if values:
+            pipe.hset(coefficients_key(community), mapping=values)
+        pipe.execute()
+        return {"message": f"Sharing coefficients of '{community}' updated."}
+
+    def get_coefficients(self, community, members):
+        """
+        Retrieves the static coefficients of the members, equal shares if none are stored.
+
+        Input:
+            community (str): The name of the community.
+            members (list): The member emails.
+
+        Output:
+            np.ndarray: The coefficient of each member.
+        """
+        stored = self.redis_model.client.hgetall(coefficients_key(community))
+        if not stored:
+            return np.full(len(members), 1 / len(members)) if members else np.zeros(0)
+        return np.array([float(stored.get(member, 0)) for member in members])
+
+    def allocate(self, method, production, consumption, coefficients):
+        """
+        Runs one of the allocation methods.
+
+        Input:
+            method (str): "static", "dynamic" or "capped".
+            production (np.ndarray): The community production of each slot.
+            consumption (np.ndarray): The members x slots consumption.
+            coefficients (np.ndarray): The static coefficient of each member.
+
+        Output:
+            np.ndarray: The members x slots allocated energy.
+        """
+        if method == "static":
+            return allocate_static(production, coefficients)
+        if method == "dynamic":
+            return allocate_dynamic(production, consumption)
+        if method == "capped":
+            return allocate_capped(production, consumption, coefficients)
+        raise ValueError(f"Not a valid sharing method: {method}")
+
+    def compute_month(self, community, month, method="dynamic"):
+        """
+        Computes the sharing of a whole month and stores it. Every member is read in bulk
+        and the month is allocated as one members x slots matrix.
+
+        Input:
+            community (str): The name of the community.
+            month (str): The month ("YYYY-MM").
+            method (str, optional): "static", "dynamic" or "capped". Defaults to "dynamic".
+
+        Output:
+            dict: The community totals of the month.
+        """
+        if method not in SHARING_METHODS:
+            raise ValueError(f"Not a valid sharing method: {method}")
+        try:
+            start = np.datetime64(month, 'M')
+        except ValueError:
+            raise ValueError(f"Not a valid month: {month}")
+        start_date = str(start.astype('datetime64[D]'))
+        end_date = str((start + 1).astype('datetime64[D]') - 1)
+        days = range_days(start_date, end_date)
+
+        members, _, consumption, production = self.community_engine.get_matrices(community, start_date, end_date)
+        if not members:
+            raise ValueError(f"Community '{community}' has no members")
+        consumption = consumption.reshape(len(members), -1)
+        community_production = production.reshape(len(members), -1).sum(axis=0)
+        coefficients = self.get_coefficients(community, members)
+
+        allocated = self.allocate(method, community_production, consumption, coefficients)
+        self_consumed, surplus = settle(allocated, consumption)
+        leftover = community_production - self_consumed.sum(axis=0)
+
+        summary = {
+            "community": community,
+            "month": month,
+            "method": method,
+            "members": len(members),
+            "days": days,
+            "slots": consumption.shape[1] // days,
+            "production": float(community_production.sum()),
+            "self_consumed": float(self_consumed.sum()),
+            "leftover": float(leftover.sum()),
+            "computed_at": datetime.now().isoformat(timespec='seconds')
+        }
+        self.store(community, month, members, allocated, self_consumed, surplus, leftover, summary)
+        return summary
+
+    def store(self, community, month, members, allocated, self_consumed, surplus, leftover, summary):
+        """
+        Stores the result of a month in one hash: a float32 block per member with its
+        allocated, self-consumed and surplus series, the community leftover and a summary.
+
+        Input:
+            community (str): The name of the community.
+            month (str): The month ("YYYY-MM").
+            members (list): The member emails.
+            allocated, self_consumed, surplus (np.ndarray): The members x slots results.
+            leftover (np.ndarray): The community leftover of each slot.
+            summary (dict): The month totals.
+
+        Output:
+            None
+        """
+        blocks = np.stack([allocated, self_consumed, surplus], axis=1).astype('<f4')
+        mapping = {member: blocks[row].tobytes() for row, member in enumerate(members)}
+        mapping["_leftover"] = leftover.astype('<f4').tobytes()
+        mapping["_summary"] = json.dumps(summary)
+        pipe = self.redis_model.binary_client.pipeline(transaction=True)
+        pipe.delete(sharing_key(community, month))
+        pipe.hset(sharing_key(community, month), mapping=mapping)
+        pipe.execute()
+
+    def get_member_month(self, community, month, user_email):
+        """
+        Looks up the stored sharing of one member in a month.
+
+        Input:
+            community (str): The name of the community.
+            month (str): The month ("YYYY-MM").
+            user_email (str): The email of the member.
+
+        Output:
+            dict: The month summary, the member totals and the member series per slot.
+        """
+        summary, block = self.redis_model.binary_client.hmget(sharing_key(community, month), "_summary", user_email)
+        if summary is None:
+            raise ValueError(f"No sharing computed for '{community}' in {month}")
+        if block is None:
+            raise ValueError(f"{user_email} has no sharing in '{community}' for {month}")
+        series = np.frombuffer(block, dtype='<f4').reshape(3, -1).astype(float)
+        return {
+            "summary": json.loads(summary),
+            "totals": dict(zip(("allocated", "self_consumed", "surplus"), series.sum(axis=1).tolist())),
+            "allocated": series[0].tolist(),
+            "self_consumed": series[1].tolist(),
+            "surplus": series[2].tolist()
+        }
@@ -2,10 +2,17 @@ import csv
 import logging
 import requests
 from datetime import datetime, timedelta
-import xmltodict
-import json
+import xml.etree.ElementTree as ET
 from app.config import Config
+from app.metrics import upstream_get
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from zoneinfo import ZoneInfo
+from app.models.cache_model import SharedCache
+from app.models.entsoe_parser import (parse_market_document, latest_generation, build_series, resample,
+                                      resolution_minutes, forward_fill)
+import numpy as np
 
 def load_entsoe_country_keys():
     """
@@ -51,6 +58,112 @@ def load_entsoe_gentype_names():
             entsoe_gentype_names[row['key']] = row['name']
     return entsoe_gentype_names
 
+# Day-ahead price series of each bidding zone and delivery day, shared by every worker
+price_cache = SharedCache("day_ahead_series")
+
+def next_publication_time(now=None):
+    """
+    Returns when the next day-ahead auction results are published.
+    
+    Input:
+        now (datetime, optional): The current time (timezone aware). Defaults to now.
+    
+    Output:
+        float: The next publication time in epoch seconds.
+    """
+    publication_tz = ZoneInfo(Config.DAY_AHEAD_PUBLICATION_TZ)
+    now = now.astimezone(publication_tz) if now else datetime.now(publication_tz)
+    hour, minute = (int(part) for part in Config.DAY_AHEAD_PUBLICATION_TIME.split(':'))
+    publication = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if publication <= now:
+        publication += timedelta(days=1)
+    return publication.timestamp()
+
+def prices_fresh_until(delivery_day, series):
+    """
+    Returns until when the cached prices of a delivery day are fresh.
+    
+    Input:
+        delivery_day (str): The delivery day (yyyymmdd).
+        series (dict): The cached price series.
+    
+    Output:
+        float: The end of the fresh period in epoch seconds.
+    """
+    # Empty answers are usually "not published yet", retry them soon
+    if not series['values']:
+        return time.time() + Config.DAY_AHEAD_EMPTY_TTL
+    # Published prices of a delivery day are final
+    return (datetime.strptime(delivery_day, '%Y%m%d') + timedelta(days=1)).timestamp()
+
+def get_day_ahead_series(country_name):
+    """
+    Retrieves the day-ahead price series of a specified country using the ENTSO-E API.
+    Results are cached per bidding zone and delivery day. When the prefetch scheduler
+    runs, the cached results are served and only a cold cache reaches ENTSO-E.
+    
+    Input:
+        country_name (str): The name of the country for which to retrieve prices.
+    
+    Output:
+        dict: The series ('start', 'resolution' and 'values', see fetch_day_ahead_prices),
+              None if the country is not found, or an error message if the request fails.
+    """
+    #Country key (According to the country)
+    entsoe_country_keys = load_entsoe_country_keys()
+    if country_name not in entsoe_country_keys:
+        logging.error(f"Key for country {country_name} not found")
+        return
+    country_key=entsoe_country_keys[country_name]
+    delivery_day = datetime.now().strftime('%Y%m%d')
+
+    if Config.PREFETCH_ENABLED:
+        series = price_cache.peek(f"{country_key}:{delivery_day}")
+        if series is not None:
+            return series
+    return price_cache.get(f"{country_key}:{delivery_day}",
+                           lambda: fetch_day_ahead_prices(country_key, delivery_day),
+                           lambda series: prices_fresh_until(delivery_day, series),
+                           cacheable=lambda series: 'error' not in series)
+
+def get_price_series(country_name, resolution='PT60M'):
+    """
+    Retrieves the day-ahead prices of a specified country at any resolution.
+    
+    Input:
+        country_name (str): The name of the country for which to retrieve prices.
+        resolution (str, optional): The ISO 8601 resolution (e.g. 'PT15M'). Defaults to 'PT60M'.
+    
+    Output:
+        tuple: The datetime64 (UTC) time and the price (EUR/MWh) of each slot.
+               Raises ValueError if the prices cannot be retrieved.
+    """
+    series = get_day_ahead_series(country_name)
+    if series is None:
+        raise ValueError(f"Key for country {country_name} not found")
+    if 'error' in series:
+        raise ValueError(series['error'])
+    return series_to_arrays(series, resolution)
+
+def series_to_arrays(series, resolution):
+    """
+    Converts a cached price series to NumPy arrays at a resolution.
+    
+    Input:
+        series (dict): A price series returned by fetch_day_ahead_prices.
+        resolution (str): The ISO 8601 resolution of the result.
+    
+    Output:
+        tuple: The datetime64 (UTC) time and the price of each slot.
+    """
+    target = resolution_minutes(resolution)
+    if target is None:
+        raise ValueError(f"Not a valid resolution: {resolution}")
+    if not series['values']:
+        return np.array([], dtype='datetime64[m]'), np.array([])
+    values = np.array(series['values'], dtype=float)
+    return resample(np.datetime64(series['start'], 'm'), resolution_minutes(series['resolution']), values, target)
+
 def get_day_ahead_prices(country_name):
     """
     Retrieves day-ahead electricity prices for a specified country using the ENTSO-E API.
@@ -59,23 +172,54 @@ def get_day_ahead_prices(country_name):
         country_name (str): The name of the country for which to retrieve prices.
     
     Output:
-        list: A list of price points for the day-ahead market, or an error message if the request fails.
+        list: A list of hourly price points for the day-ahead market, or an error message if the request fails.
+    """
+    series = get_day_ahead_series(country_name)
+    if series is None or 'error' in series:
+        return series
+    # Hourly points (averaged from finer products if needed) as served by ENTSO-E
+    _, values = series_to_arrays(series, 'PT60M')
+    return [{"position": str(position), "price.amount": str(round(value, 5))}
+            for position, value in enumerate(values.tolist(), start=1) if value == value]
+
+def refresh_day_ahead_prices(country_key, delivery_day):
+    """
+    Fetches the day-ahead prices of a bidding zone and delivery day into the cache.
+    
+    Input:
+        country_key (str): The ENTSO-E key of the bidding zone.
+        delivery_day (str): The delivery day (yyyymmdd).
+    
+    Output:
+        dict: The price series, or an error message if the request fails.
+    """
+    return price_cache.refresh(f"{country_key}:{delivery_day}",
+                               lambda: fetch_day_ahead_prices(country_key, delivery_day),
+                               lambda series: prices_fresh_until(delivery_day, series),
+                               lambda series: 'error' not in series)
+
+def fetch_day_ahead_prices(country_key, delivery_day):
+    """
+    Requests the day-ahead prices of a bidding zone to the ENTSO-E API.
+    
+    Input:
+        country_key (str): The ENTSO-E key of the bidding zone.
+        delivery_day (str): The delivery day (yyyymmdd).
+    
+    Output:
+        dict: The price series of the delivery day at the finest resolution published:
+              'start' (UTC, ISO 8601), 'resolution' and 'values' (EUR/MWh, NaN where missing),
+              or an error message if the request fails.
     """
     # Get the endpoint
-    endpoint = 'https://web-api.tp.entsoe.eu/api'
+    endpoint = Config.ENTSOE_API_URL
 
     # Get query parameters
-        #Time (Always today)
-    current_datetime = datetime.now()
+        #Time (Delivery day, from the previous day at 22:00)
+    current_datetime = datetime.strptime(delivery_day, '%Y%m%d')
     yesterday_datetime = current_datetime - timedelta(days=1)
     current_formatted = current_datetime.strftime('%Y%m%d') + '2200'
     yesterday_formatted = yesterday_datetime.strftime('%Y%m%d') + '2200'
-        #Country key (According to the country)
-    entsoe_country_keys = load_entsoe_country_keys()
-    if country_name not in entsoe_country_keys:
-        logging.error(f"Key for country {country_name} not found")
-        return
-    country_key=entsoe_country_keys[country_name]
 
     params = {
         'securityToken': Config.ENTSO_E_API_KEY,
@@ -87,39 +231,59 @@ def get_day_ahead_prices(country_name):
     }
     
     # Make the query
-    response = requests.get(endpoint, params=params)
-
-    # Transform the query response to JSON dictionary
-    data_xml = response.text
-    data_dict = xmltodict.parse(data_xml)
-    data_json = json.loads(json.dumps(data_dict))
+    response = upstream_get("entsoe", endpoint, params=params, timeout=Config.ENTSOE_TIMEOUT)
 
     # Handle the response
     if response.status_code == 200:
-        time_series_list = data_json['Publication_MarketDocument'].get('TimeSeries', [])
-
-        # Case 1: Data is in different formats, and we need to get only PT60
-        if isinstance(time_series_list, list) and len(time_series_list) > 0:
-            for time_series in time_series_list:
-                if time_series['Period']['resolution'] == 'PT60M':
-                    points = time_series['Period']['Point']
-                    break  
-            else:
-                points = []
-        # Case 2: Data is only in the format we want
-        elif time_series_list['Period']['resolution'] == 'PT60M':
-            points = time_series_list['Period']['Point']
-        # Case 3: Any other format
-        else:
-            logging.info(f"Case 3: Incorrect format: {time_series_list}")
-            points = []
-        
-        return points
+        # Parse the XML straight into arrays, every resolution published
+        try:
+            document = parse_market_document(response.content)
+        except ET.ParseError as e:
+            logging.error(f"Failed to parse the day-ahead prices: {e}")
+            return {"error": "Failed to parse the ENTSO-E response"}
+        if document["reason"]:
+            logging.info(f"No day-ahead prices: {document['reason']}")
+        # The window may touch the previous delivery day, keep the last one
+        periods = document["timeseries"]
+        if periods:
+            last_start = max(period["start"] for period in periods)
+            periods = [period for period in periods if period["start"] == last_start]
+        times, values = build_series(periods)
+        if not len(times):
+            return {"start": None, "resolution": None, "values": []}
+        return {
+            "start": str(times[0]),
+            "resolution": f"PT{min(resolution_minutes(period['resolution']) for period in periods)}M",
+            "values": values.tolist()
+        }
     else:
         logging.error(f"Failed to retrieve data. Status code: {response.status_code}")
-        logging.error(f"Error response: {data_json}")
+        logging.error(f"Error response: {response.text}")
         return {"error": f"Failed to retrieve data. Status code: {response.status_code}"}
 
+def fetch_market_document(params):
+    """
+    Requests any ENTSO-E document and parses it.
+    
+    Input:
+        params (dict): The query parameters, without the security token.
+    
+    Output:
+        dict: The parsed document (see entsoe_parser.parse_market_document). An acknowledgement
+              (e.g. no matching data) is returned as a document without time series.
+              Raises ValueError if the request fails.
+    """
+    try:
+        response = upstream_get("entsoe", Config.ENTSOE_API_URL,
+                                params={'securityToken': Config.ENTSO_E_API_KEY, **params},
+                                timeout=Config.ENTSOE_TIMEOUT)
+        document = parse_market_document(response.content)
+    except (requests.RequestException, ET.ParseError) as e:
+        raise ValueError(f"Failed to retrieve data: {e}")
+    if response.status_code != 200 and document["type"] != 'Acknowledgement_MarketDocument':
+        raise ValueError(f"Failed to retrieve data. Status code: {response.status_code}")
+    return document
+
 def load_co2_by_type(file_path='entsoe_tables/CO2.csv'):
     """
     Loads CO2 emission factors by generation type from a CSV file.
@@ -141,18 +305,68 @@ def load_co2_by_type(file_path='entsoe_tables/CO2.csv'):
             CO2_by_gentype[row['Energy Type']] = row['gCO2eq/Wh']
     return CO2_by_gentype
 
+# Latest generation by type of each bidding zone, shared by every worker
+generation_cache = SharedCache("generation_by_type")
+
+def generation_fresh_until(gens):
+    # ENTSO-E publishes generation every 15 minutes
+    return time.time() + Config.GENERATION_REFRESH_SECONDS
+
 def get_actual_generation_by_type(country_name):
     """
     Retrieves actual electricity generation data by type for a specified country using the ENTSO-E API.
+    Results are cached per bidding zone for a refresh interval. When the prefetch scheduler
+    runs, the cached results are served and only a cold cache reaches ENTSO-E.
     
     Input:
         country_name (str): The name of the country for which to retrieve generation data.
     
+    Output:
+        dict: A dictionary mapping generation types to their respective generation values, or an error message if the request fails.
+    """
+    #Country key (According to the country)
+    entsoe_country_keys = load_entsoe_country_keys()
+    if country_name not in entsoe_country_keys:
+        #logging.error(f"Key for country {country_name} not found")
+        return
+    country_key=entsoe_country_keys[country_name]
+
+    if Config.PREFETCH_ENABLED:
+        gens = generation_cache.peek(country_key)
+        if gens is not None:
+            return gens
+    return generation_cache.get(country_key,
+                                lambda: fetch_actual_generation_by_type(country_key),
+                                generation_fresh_until,
+                                cacheable=lambda gens: 'error' not in gens)
+
+def refresh_actual_generation_by_type(country_key):
+    """
+    Fetches the latest generation by type of a bidding zone into the cache.
+    
+    Input:
+        country_key (str): The ENTSO-E key of the bidding zone.
+    
+    Output:
+        dict: The generation of each type, or an error message if the request fails.
+    """
+    return generation_cache.refresh(country_key,
+                                    lambda: fetch_actual_generation_by_type(country_key),
+                                    generation_fresh_until,
+                                    lambda gens: 'error' not in gens)
+
+def fetch_actual_generation_by_type(country_key):
+    """
+    Requests the generation by type of a bidding zone to the ENTSO-E API.
+    
+    Input:
+        country_key (str): The ENTSO-E key of the bidding zone.
+    
     Output:
         dict: A dictionary mapping generation types to their respective generation values, or an error message if the request fails.
     """
     # Get the endpoint
-    endpoint = 'https://web-api.tp.entsoe.eu/api'
+    endpoint = Config.ENTSOE_API_URL
 
     # Get query parameters
         #Time (Always today)
@@ -160,12 +374,6 @@ def get_actual_generation_by_type(country_name):
     yesterday_datetime = current_datetime - timedelta(days=1)
     current_formatted = current_datetime.strftime('%Y%m%d') + '2200'
     yesterday_formatted = yesterday_datetime.strftime('%Y%m%d') + '2200'
-        #Country key (According to the country)
-    entsoe_country_keys = load_entsoe_country_keys()
-    if country_name not in entsoe_country_keys:
-        #logging.error(f"Key for country {country_name} not found")
-        return
-    country_key=entsoe_country_keys[country_name]
 
     params = {
         'securityToken': Config.ENTSO_E_API_KEY,
@@ -177,53 +385,20 @@ def get_actual_generation_by_type(country_name):
     }
     
     # Make the query
-    response = requests.get(endpoint, params=params)
-
-    # Transform the query response to JSON dictionary
-    data_xml = response.text
-    data_dict = xmltodict.parse(data_xml)
-    #logging.info(json.dumps(data_dict, indent=4))
-    data_json = json.loads(json.dumps(data_dict))
+    response = upstream_get("entsoe", endpoint, params=params, timeout=Config.ENTSOE_TIMEOUT)
 
     # Handle the response
     if response.status_code == 200:
-        #logging.info("Data has been received correctly")
-        gens = {}
-        time_series_list = data_json['GL_MarketDocument'].get('TimeSeries', [])
-        last_up_time = yesterday_datetime
-        date_format = "%Y-%m-%dT%H:%MZ"
-        if isinstance(time_series_list, list) and len(time_series_list) > 0:
-            #logging.info(f"Data is list")
-            #get last hour
-            for time_series in time_series_list:
-                update_time_str = time_series['Period']['timeInterval']['end']
-                update_time = datetime.strptime(update_time_str, date_format)
-                if update_time > last_up_time:
-                    last_up_time = update_time
-            
-            #logging.info(f"Last update: {last_up_time} UTC")
-            last_up_time_str = last_up_time.strftime(date_format)
-            #get generation by type in the last hour
-            entsoe_gentype_names = load_entsoe_gentype_names()
-            for time_series in time_series_list:
-                if last_up_time_str == time_series['Period']['timeInterval']['end']:
-                    if 'inBiddingZone_Domain.mRID' in time_series:
-                        gens[entsoe_gentype_names[time_series['MktPSRType']['psrType']]] = int(time_series['Period']['Point'][-1]['quantity'])
-                    else:
-                        if entsoe_gentype_names[time_series['MktPSRType']['psrType']] in gens:
-                            gens[entsoe_gentype_names[time_series['MktPSRType']['psrType']]] -= 0
-                        else:
-                            gens[entsoe_gentype_names[time_series['MktPSRType']['psrType']]] = 0
-            #logging.info(gens)
-            gens = {key: value for key, value in gens.items() if value != 0}
-        else:
-            logging.info("Data is NOT list!")
-
-        #logging.info(gens)
-        return gens
+        try:
+            document = parse_market_document(response.content)
+        except ET.ParseError as e:
+            logging.error(f"Failed to parse the generation by type: {e}")
+            return {"error": "Failed to parse the ENTSO-E response"}
+        #get generation by type in the last hour
+        return latest_generation(document, load_entsoe_gentype_names())
     else:
         logging.error(f"Failed to retrieve data. Status code: {response.status_code}")
-        logging.error(f"Error response: {data_json}")
+        logging.error(f"Error response: {response.text}")
         return {"error": f"Failed to retrieve data. Status code: {response.status_code}"}
     
 def get_CO2_from_dict(power_dict, co2_dict):
@@ -242,55 +417,51 @@ def get_CO2_from_dict(power_dict, co2_dict):
         co2 += value * float(co2_dict[key])
     return co2
 
-def entsoe_to_array(data):
+# Upstream requests of the batch endpoints, bounded for the whole process
+batch_executor = ThreadPoolExecutor(max_workers=Config.BATCH_WORKERS, thread_name_prefix="entsoe-batch")
+
+def get_for_countries(function, country_names):
     """
-    Converts ENTSO-E time series data into a structured array of prices.
+    Runs a per-country query for several countries concurrently, so the wall time is
+    close to the slowest country and not the sum of all of them.
     
     Input:
-        data (list): A list of dictionaries containing ENTSO-E time series data.
+        function (callable): Receives a country name (e.g. get_day_ahead_prices).
+        country_names (list): The names of the countries.
     
     Output:
-        list: A structured array of prices, with missing values filled using the previous value.
+        dict: The result of each country: {"status": "ok", "data": ...} or
+              {"status": "error", "error": ...}.
     """
-    max_position = max(int(item['position']) for item in data)
-    
-    # Initialize the result array with None values
-    result = [None] * max_position
-
-    # Fill the result array with prices, filling missing values with the previous one
-    previous_value = None
-    for item in data:
-        position = int(item['position']) - 1  # Convert to 0-based index
-        price = float(item['price.amount'])
-        
-        # Fill any missing positions with the previous value
-        if previous_value is not None and position > 0:
-            for i in range(position):
-                if result[i] is None:
-                    result[i] = previous_value
-        
-        # Set the current price and update the previous value
-        result[position] = price
-        previous_value = price
-
-    # Fill any remaining None values with the previous value
-    for i in range(len(result)):
-        if result[i] is None:
-            result[i] = previous_value
+    def run(country_name):
+        try:
+            result = function(country_name)
+        except Exception as e:
+            logging.error(f"Query for {country_name} failed: {e}")
+            return {"status": "error", "error": f"Failed to retrieve data: {e}"}
+        if result is None:
+            return {"status": "error", "error": f"Key for country {country_name} not found"}
+        if isinstance(result, dict) and 'error' in result:
+            return {"status": "error", "error": result['error']}
+        return {"status": "ok", "data": result}
 
-    return result
+    futures = {country_name: batch_executor.submit(run, country_name) for country_name in country_names}
+    return {country_name: future.result() for country_name, future in futures.items()}
 
-def get_price_array(country_name, type, fixed_value = 0):
+def get_price_slots(country_name, type, fixed_value = 0, resolution = 'PT60M'):
     """
-    Generates a price array based on the specified type (fixed or market prices).
+    Generates the prices of the slots of today, fixed or from the day-ahead market.
     
     Input:
         country_name (str): The name of the country for which to retrieve prices.
         type (str): The type of price array to generate ("FIXED" or "MARKET").
         fixed_value (float, optional): The fixed price value if type is "FIXED". Defaults to 0.
+        resolution (str, optional): The ISO 8601 resolution (e.g. 'PT15M'). Defaults to 'PT60M'.
     
     Output:
-        list: A price array of length 24, or None if an error occurs.
+        tuple: The datetime64 (UTC) start of each slot (None for fixed prices, whose slots are
+               the hours of the local day) and a price array (EUR/kWh). Market days have 23 or
+               25 hours when the clocks change. None if an error occurs.
     """
     # validation
     if not isinstance(country_name, str):
@@ -299,44 +470,67 @@ def get_price_array(country_name, type, fixed_value = 0):
     if not isinstance(type, str):
         logging.error(f"'type' should be a string, got {type}")
         return None
-    """
-    try:
-        fixed_value = float(fixed_value)
-    except ValueError:
-        logging.error(f"'fixed_value' should be a float, got {fixed_value}")
+    minutes = resolution_minutes(resolution)
+    if minutes is None or 1440 % minutes:
+        logging.error(f"'resolution' should divide a day, got {resolution}")
         return None
-    """
     # operation
     if type == "FIXED":
         try:
             fixed_value = float(fixed_value)
-            size = 24
-            price_array = [fixed_value for _ in range(size)]
+            size = 1440 // minutes
+            return None, np.full(size, fixed_value).tolist()
         except ValueError:
             logging.error(f"'fixed_value' should be a float, got {fixed_value}")
             return None
         
     elif type == "MARKET":
-        prices_dict =  get_day_ahead_prices(country_name)
-        price_array = entsoe_to_array(prices_dict)
-        price_array = [round(value/1000, 5) for value in price_array]
+        try:
+            times, prices = get_price_series(country_name, resolution)
+        except ValueError as e:
+            logging.error(f"Market prices not available: {e}")
+            return None
+        if not len(prices) or np.isnan(prices).all():
+            logging.error(f"No market prices for {country_name}")
+            return None
+        # Gaps repeat the previous price, as ENTSO-E curve compression does
+        prices = forward_fill(prices)
+        prices[np.isnan(prices)] = prices[~np.isnan(prices)][0]
+        return times, np.round(prices / 1000, 5).tolist()
     else:
         logging.error("Not valid fee type")
         return None
-    return price_array
+
+def get_price_array(country_name, type, fixed_value = 0, resolution = 'PT60M'):
+    """
+    Generates a price array based on the specified type (fixed or market prices).
+    
+    Input:
+        country_name (str): The name of the country for which to retrieve prices.
+        type (str): The type of price array to generate ("FIXED" or "MARKET").
+        fixed_value (float, optional): The fixed price value if type is "FIXED". Defaults to 0.
+        resolution (str, optional): The ISO 8601 resolution (e.g. 'PT15M'). Defaults to 'PT60M'.
+    
+    Output:
+        list: A price array (EUR/kWh) with a value per slot of the day (see get_price_slots),
+              or None if an error occurs.
+    """
+    slots = get_price_slots(country_name, type, fixed_value, resolution)
+    return None if slots is None else slots[1]
 
 def sell_by_hours(price_array, gen_array):
     """
     Calculates the revenue from selling electricity by multiplying price and generation arrays.
+    Works with any slot length, as long as both arrays use the same one.
     
     Input:
-        price_array (list): A list of prices for each hour.
-        gen_array (list): A list of generation values for each hour.
+        price_array (list): A list of prices for each slot.
+        gen_array (list): A list of generation values for each slot.
     
     Output:
-        list: A list of revenue values for each hour, or None if the arrays have different lengths.
+        list: A list of revenue values for each slot, or None if the arrays have different lengths.
     """
     if len(price_array)!= len(gen_array):
         logging.error("Both arrays must have the same length")
         return None 
-    return [a*b for a,b in zip(price_array, gen_array)]
+    return np.multiply(price_array, gen_array).tolist()
@@ -0,0 +1,303 @@
+import logging
+import os
+import threading
+import numpy as np
+from app.config import Config
+from app.models.ENTSOE_models import fetch_market_document, load_entsoe_gentype_names
+from app.models.entsoe_parser import resolution_minutes, period_to_grid
+
+# Datasets kept in the archive
+ARCHIVE_DATASETS = ("prices", "generation")
+
+# Resolutions served by the archive queries (minutes per value, None for the archive slots)
+ARCHIVE_RESOLUTIONS = {"slot": None, "hour": 60, "day": 1440}
+
+def month_start(month):
+    return np.datetime64(month, 'M').astype('datetime64[m]')
+
+def entsoe_time(time):
+    # ENTSO-E query times are yyyymmddhhmm (UTC)
+    return str(time.astype('datetime64[m]')).replace('-', '').replace('T', '').replace(':', '')
+
+class EntsoeArchive:
+    """
+    Append-only archive of ENTSO-E prices and generation by type. Every zone and month
+    (UTC) is one .npy file of slots x columns float32 values on a regular grid, with NaN
+    where nothing was archived yet. Files are memory-mapped, so reading a range is a
+    view of the files and not a parse.
+    """
+    def __init__(self, root=None, slot_minutes=None):
+        self.root = root or Config.ARCHIVE_DIR
+        self.slot_minutes = slot_minutes or Config.ARCHIVE_SLOT_MINUTES
+        self.slot = np.timedelta64(self.slot_minutes, 'm')
+        # Read-only maps stay open: files never change size and writes reach them through the page cache
+        self.maps = {}
+        self.lock = threading.Lock()
+
+    def columns(self, dataset):
+        """
+        Returns the columns of a dataset.
+
+        Input:
+            dataset (str): "prices" or "generation".
+
+        Output:
+            list: The price column, or the ENTSO-E generation type keys.
+        """
+        if dataset == "prices":
+            return ["price"]
+        if dataset == "generation":
+            return sorted(load_entsoe_gentype_names())
+        raise ValueError(f"Not a valid dataset: {dataset}")
+
+    def partition_path(self, dataset, zone_key, month):
+        return os.path.join(self.root, dataset, zone_key, f"{month}.npy")
+
+    def month_slots(self, month):
+        start = month_start(month)
+        return int((month_start(np.datetime64(month, 'M') + 1) - start) // self.slot)
+
+    def open_partition(self, dataset, zone_key, month, writable=False):
+        """
+        Maps the file of a zone and month.
+
+        Input:
+            dataset (str): "prices" or "generation".
+            zone_key (str): The ENTSO-E key of the bidding zone.
+            month (str): The month ("YYYY-MM").
+            writable (bool, optional): Create the file if needed and map it for writing.
+
+        Output:
+            np.memmap: The slots x columns values, or None if it does not exist and is not writable.
+        """
+        path = self.partition_path(dataset, zone_key, month)
+        if not writable:
+            with self.lock:
+                partition = self.maps.get(path)
+            if partition is not None:
+                return partition
+        if not os.path.exists(path):
+            if not writable:
+                return None
+            # Created aside and moved, so readers never see a partial file
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temporary = f"{path}.{os.getpid()}.tmp"
+            empty = np.lib.format.open_memmap(temporary, mode='w+', dtype='<f4',
+                                              shape=(self.month_slots(month), len(self.columns(dataset))))
+            empty[:] = np.nan
+            empty.flush()
+            del empty
+            os.replace(temporary, path)
+        if writable:
+            return np.load(path, mmap_mode='r+')
+        partition = np.load(path, mmap_mode='r')
+        with self.lock:
+            self.maps[path] = partition
+        return partition
+
+    def append(self, dataset, zone_key, start, values):
+        """
+        Archives values of a zone. Slots already archived are kept (published data is final).
+
+        Input:
+            dataset (str): "prices" or "generation".
+            zone_key (str): The ENTSO-E key of the bidding zone.
+            start (np.datetime64): The time of the first slot (UTC, on the slot grid).
+            values (np.ndarray): The slots x columns values (NaN where unknown).
+
+        Output:
+            int: The number of values added.
+        """
+        start = np.datetime64(start, 'm')
+        if (start - np.datetime64(0, 'm')) % self.slot:
+            raise ValueError(f"{start} is not on the {self.slot_minutes} minute grid")
+        end = start + len(values) * self.slot
+        added = 0
+        month = start.astype('datetime64[M]')
+        while month_start(month) < end:
+            first = max(start, month_start(month))
+            last = min(end, month_start(month + 1))
+            block = values[(first - start) // self.slot:(last - start) // self.slot]
+            if not np.isnan(block).all():
+                partition = self.open_partition(dataset, zone_key, str(month), writable=True)
+                target = partition[(first - month_start(month)) // self.slot:][:len(block)]
+                new = np.isnan(target) & ~np.isnan(block)
+                target[new] = block[new]
+                partition.flush()
+                added += int(new.sum())
+            month += 1
+        return added
+
+    def read(self, dataset, zone_key, start, end):
+        """
+        Reads the archived values of a zone in a time range. A range inside one month is
+        a view of the mapped file, longer ranges are joined month by month.
+
+        Input:
+            dataset (str): "prices" or "generation".
+            zone_key (str): The ENTSO-E key of the bidding zone.
+            start (np.datetime64): The start of the range (UTC, included).
+            end (np.datetime64): The end of the range (UTC, excluded).
+
+        Output:
+            tuple: The datetime64 time of each slot and the slots x columns values.
+        """
+        # Start on the slot grid
+        start = np.datetime64(start, 'm')
+        start -= (start - np.datetime64(0, 'm')) % self.slot
+        end = np.datetime64(end, 'm')
+        if end <= start:
+            raise ValueError("The end of the range must be after its start")
+        slots = int(-(-(end - start) // self.slot))
+        if slots * self.slot_minutes > Config.MAX_RANGE_DAYS * 1440:
+            raise ValueError(f"Ranges are limited to {Config.MAX_RANGE_DAYS} days")
+        end = start + slots * self.slot
+        columns = len(self.columns(dataset))
+
+        blocks = []
+        month = start.astype('datetime64[M]')
+        while month_start(month) < end:
+            first = max(start, month_start(month))
+            last = min(end, month_start(month + 1))
+            partition = self.open_partition(dataset, zone_key, str(month))
+            if partition is None:
+                blocks.append(np.full(((last - first) // self.slot, columns), np.nan, dtype='<f4'))
+            else:
+                blocks.append(partition[(first - month_start(month)) // self.slot:(last - month_start(month)) // self.slot])
+            month += 1
+
+        values = blocks[0] if len(blocks) == 1 else np.concatenate(blocks)
+        return start + np.arange(slots) * self.slot, values
+
+    def read_zones(self, dataset, zone_keys, start, end):
+        """
+        Reads the archived values of several zones in a time range.
+
+        Input:
+            dataset (str): "prices" or "generation".
+            zone_keys (list): The ENTSO-E keys of the bidding zones.
+            start (np.datetime64): The start of the range (UTC, included).
+            end (np.datetime64): The end of the range (UTC, excluded).
+
+        Output:
+            tuple: The datetime64 time of each slot and the zones x slots x columns values.
+        """
+        times = None
+        matrix = []
+        for zone_key in zone_keys:
+            times, values = self.read(dataset, zone_key, start, end)
+            matrix.append(values)
+        return times, np.stack(matrix)
+
+    def aggregate(self, times, values, resolution):
+        """
+        Averages the archive slots to a coarser resolution.
+
+        Input:
+            times (np.ndarray): The datetime64 time of each slot.
+            values (np.ndarray): The slots x columns values.
+            resolution (str): "slot", "hour" or "day".
+
+        Output:
+            tuple: The times and values at that resolution (averages ignore missing slots).
+        """
+        if resolution not in ARCHIVE_RESOLUTIONS:
+            raise ValueError(f"Not a valid resolution: {resolution}")
+        minutes = ARCHIVE_RESOLUTIONS[resolution]
+        if minutes is None or minutes == self.slot_minutes:
+            return times, values
+        # Groups start on the resolution grid, the first and last ones may be partial
+        groups = (times - np.datetime64(0, 'm')) // np.timedelta64(minutes, 'm')
+        _, first = np.unique(groups, return_index=True)
+        counts = np.add.reduceat(~np.isnan(values), first, axis=0)
+        sums = np.add.reduceat(np.nan_to_num(values), first, axis=0)
+        means = np.divide(sums, counts, out=np.full(sums.shape, np.nan), where=counts > 0)
+        group_times = np.datetime64(0, 'm') + groups[first] * np.timedelta64(minutes, 'm')
+        return group_times, means
+
+    def fetch_month(self, dataset, zone_key, month):
+        """
+        Downloads a month of a zone from ENTSO-E onto the archive grid.
+
+        Input:
+            dataset (str): "prices" or "generation".
+            zone_key (str): The ENTSO-E key of the bidding zone.
+            month (str): The month ("YYYY-MM").
+
+        Output:
+            np.ndarray: The slots x columns values of the month (NaN where nothing was published).
+        """
+        start = month_start(month)
+        end = month_start(np.datetime64(month, 'M') + 1)
+        if dataset == "prices":
+            params = {'documentType': 'A44', 'in_Domain': zone_key, 'out_Domain': zone_key}
+        else:
+            params = {'documentType': 'A75', 'processType': 'A16', 'in_Domain': zone_key}
+        params.update({'periodStart': entsoe_time(start), 'periodEnd': entsoe_time(end)})
+        document = fetch_market_document(params)
+        if document["reason"] and not document["timeseries"]:
+            logging.info(f"[Archive] {dataset} {zone_key} {month}: {document['reason']}")
+
+        columns = {column: index for index, column in enumerate(self.columns(dataset))}
+        values = np.full((self.month_slots(month), len(columns)), np.nan, dtype='<f4')
+        # Finest resolution first: it is the one kept where several are published
+        periods = sorted(document["timeseries"], key=lambda period: resolution_minutes(period["resolution"]) or 0)
+        for period in periods:
+            if dataset == "prices":
+                column = 0
+            elif period.get("in_domain") is not None and period.get("psr_type") in columns:
+                column = columns[period["psr_type"]]
+            else:
+                # Consumption of the generation units (out of the bidding zone)
+                continue
+            grid = period_to_grid(period, self.slot_minutes)
+            offset = int((period["start"] - start) // self.slot)
+            first, last = max(offset, 0), min(offset + len(grid), len(values))
+            if first >= last:
+                continue
+            target = values[first:last, column]
+            source = grid[first - offset:last - offset]
+            new = np.isnan(target)
+            target[new] = source[new]
+        return values
+
+    def backfill(self, dataset, zone_keys, start_month, end_month, progress=None):
+        """
+        Downloads a range of months for several zones, one request per zone and month.
+        Months already complete in the archive are skipped.
+
+        Input:
+            dataset (str): "prices" or "generation".
+            zone_keys (list): The ENTSO-E keys of the bidding zones.
+            start_month (str): The first month ("YYYY-MM").
+            end_month (str): The last month ("YYYY-MM", included).
+            progress (callable, optional): Receives (zone_key, month, values added or error).
+
+        Output:
+            dict: The months fetched, skipped and failed, and the values added.
+        """
+        self.columns(dataset)
+        try:
+            months = np.arange(np.datetime64(start_month, 'M'), np.datetime64(end_month, 'M') + 1)
+        except ValueError:
+            raise ValueError(f"Not a valid month range: {start_month} to {end_month}")
+        summary = {"fetched": 0, "skipped": 0, "failed": 0, "values": 0}
+        for zone_key in zone_keys:
+            for month in map(str, months):
+                partition = self.open_partition(dataset, zone_key, month)
+                if partition is not None and not np.isnan(partition).any():
+                    summary["skipped"] += 1
+                    continue
+                try:
+                    values = self.fetch_month(dataset, zone_key, month)
+                except ValueError as e:
+                    summary["failed"] += 1
+                    if progress:
+                        progress(zone_key, month, str(e))
+                    continue
+                added = self.append(dataset, zone_key, month_start(month), values)
+                summary["fetched"] += 1
+                summary["values"] += added
+                if progress:
+                    progress(zone_key, month, added)
+        return summary
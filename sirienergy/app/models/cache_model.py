@@ -0,0 +1,183 @@
+import json
+import logging
+import threading
+import time
+import redis
+from collections import OrderedDict
+from app.config import Config
+from app.metrics import instrument_redis
+
+_redis_client = None
+
+def get_redis_client():
+    """
+    Returns the Redis connection shared by every cache of the process.
+
+    Input: None
+    Output:
+        redis.StrictRedis: The connection (created on first use).
+    """
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = instrument_redis(redis.StrictRedis(
+            host=Config.REDIS_HOST,
+            port=Config.REDIS_PORT,
+            decode_responses=True
+        ))
+    return _redis_client
+
+class SharedCache:
+    """
+    Two-tier cache: a bounded in-process LRU in front of Redis, which is shared by every
+    worker. Entries have a fresh period and then a stale period during which they are
+    still served while one worker refreshes them in the background.
+    If Redis is not reachable the cache keeps working with the in-process tier only.
+    """
+    def __init__(self, namespace, local_size=None, stale_seconds=None):
+        self.namespace = namespace
+        self.local_size = local_size if local_size is not None else Config.CACHE_LOCAL_SIZE
+        self.stale_seconds = stale_seconds if stale_seconds is not None else Config.CACHE_STALE_SECONDS
+        self.local = OrderedDict()
+        self.lock = threading.Lock()
+        self.refreshing = set()
+
+    def redis_key(self, key):
+        return f"cache:{self.namespace}:{key}"
+
+    def get_local(self, key):
+        with self.lock:
+            entry = self.local.get(key)
+            if entry is not None:
+                self.local.move_to_end(key)
+            return entry
+
+    def put_local(self, key, entry):
+        with self.lock:
+            self.local[key] = entry
+            self.local.move_to_end(key)
+            while len(self.local) > self.local_size:
+                self.local.popitem(last=False)
+
+    def get_shared(self, key):
+        try:
+            raw = get_redis_client().get(self.redis_key(key))
+        except redis.RedisError as e:
+            logging.warning(f"[Cache] {self.namespace}: Redis not available ({e})")
+            return None
+        return json.loads(raw) if raw else None
+
+    def put_shared(self, key, entry):
+        expire = int(entry['fresh_until'] + self.stale_seconds - time.time())
+        if expire <= 0:
+            return
+        try:
+            get_redis_client().set(self.redis_key(key), json.dumps(entry), ex=expire)
+        except redis.RedisError as e:
+            logging.warning(f"[Cache] {self.namespace}: Redis not available ({e})")
+
+    def acquire(self, key, seconds=30):
+        # Only one worker computes a key at a time, everyone computes if Redis is down
+        try:
+            return bool(get_redis_client().set(self.redis_key(key) + ":lock", 1, nx=True, ex=seconds))
+        except redis.RedisError:
+            return True
+
+    def release(self, key):
+        try:
+            get_redis_client().delete(self.redis_key(key) + ":lock")
+        except redis.RedisError:
+            pass
+
+    def get(self, key, compute, fresh_until, cacheable=lambda value: True):
+        """
+        Returns the cached value of a key, computing it on a miss.
+
+        Input:
+            key (str): The cache key inside the namespace.
+            compute (callable): Computes the value (no arguments).
+            fresh_until (callable): Receives the value and returns until when (epoch seconds) it is fresh.
+            cacheable (callable, optional): Receives the value and tells if it can be stored (e.g. not an error).
+
+        Output:
+            The cached or computed value.
+        """
+        now = time.time()
+        entry = self.get_local(key)
+        if entry is None or entry['fresh_until'] <= now:
+            shared = self.get_shared(key)
+            if shared is not None:
+                entry = shared
+                self.put_local(key, entry)
+
+        if entry is not None:
+            if entry['fresh_until'] > now:
+                return entry['value']
+            if entry['fresh_until'] + self.stale_seconds > now:
+                self.refresh_async(key, compute, fresh_until, cacheable)
+                return entry['value']
+
+        # Miss: let one worker compute while the others wait for its result for a while
+        if not self.acquire(key):
+            deadline = time.time() + Config.CACHE_WAIT_SECONDS
+            while time.time() < deadline:
+                time.sleep(0.1)
+                shared = self.get_shared(key)
+                if shared is not None:
+                    self.put_local(key, shared)
+                    return shared['value']
+            return self.refresh(key, compute, fresh_until, cacheable)
+        try:
+            return self.refresh(key, compute, fresh_until, cacheable)
+        finally:
+            self.release(key)
+
+    def peek(self, key):
+        """
+        Returns the cached value of a key without computing or refreshing it.
+
+        Input:
+            key (str): The cache key inside the namespace.
+
+        Output:
+            The cached value (fresh or stale), or None if there is none.
+        """
+        now = time.time()
+        entry = self.get_local(key)
+        if entry is None or entry['fresh_until'] <= now:
+            shared = self.get_shared(key)
+            if shared is not None:
+                entry = shared
+                self.put_local(key, entry)
+        if entry is None or entry['fresh_until'] + self.stale_seconds <= now:
+            return None
+        return entry['value']
+
+    def refresh(self, key, compute, fresh_until, cacheable):
+        value = compute()
+        if cacheable(value):
+            entry = {"value": value, "fresh_until": fresh_until(value)}
+            self.put_local(key, entry)
+            self.put_shared(key, entry)
+        return value
+
+    def refresh_async(self, key, compute, fresh_until, cacheable):
+        # Stale-while-revalidate: a single background refresh per key and process
+        with self.lock:
+            if key in self.refreshing:
+                return
+            self.refreshing.add(key)
+
+        def run():
+            try:
+                if self.acquire(key):
+                    try:
+                        self.refresh(key, compute, fresh_until, cacheable)
+                    finally:
+                        self.release(key)
+            except Exception:
+                logging.exception(f"[Cache] {self.namespace}: refresh of {key} failed")
+            finally:
+                with self.lock:
+                    self.refreshing.discard(key)
+
+        threading.Thread(target=run, daemon=True).start()
@@ -0,0 +1,258 @@
+# Same file in sirienergy/app/models and OPEN4CEC_Architecture_proposal/server/sirienergy/services:
+# each server is built from its own folder (Docker build context), so it is copied. Edit both
+# copies together, check_shared_files.py fails when they differ.
+import io
+import math
+import re
+import numpy as np
+import xml.etree.ElementTree as ET
+
+# TimeSeries fields kept by the parser (tag -> key)
+TIMESERIES_FIELDS = {
+    'psrType': 'psr_type',
+    'inBiddingZone_Domain.mRID': 'in_domain',
+    'outBiddingZone_Domain.mRID': 'out_domain',
+    'in_Domain.mRID': 'in_domain',
+    'out_Domain.mRID': 'out_domain',
+    'curveType': 'curve_type',
+    'currency_Unit.name': 'currency',
+    'price_Measure_Unit.name': 'unit',
+    'quantity_Measure_Unit.name': 'unit'
+}
+
+# Point values: prices in A44 documents, quantities in the rest
+VALUE_TAGS = ('price.amount', 'quantity')
+
+# ISO 8601 durations of the resolutions (PT15M, PT30M, PT60M, PT1H, P1D, ...)
+RESOLUTION_PATTERN = re.compile(r'^P(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?)?$')
+
+def parse_utc(value):
+    # ENTSO-E times look like "2024-09-20T22:00Z"
+    return np.datetime64(value.rstrip('Z'), 'm')
+
+def resolution_minutes(resolution):
+    """
+    Converts an ISO 8601 resolution to minutes.
+
+    Input:
+        resolution (str): The resolution (e.g. 'PT15M', 'PT60M', 'P1D').
+
+    Output:
+        int: The minutes of the resolution, or None if it is not valid.
+    """
+    match = RESOLUTION_PATTERN.match(resolution or '')
+    if not match or not any(match.groups()):
+        return None
+    days, hours, minutes = (int(part or 0) for part in match.groups())
+    return (days * 24 + hours) * 60 + minutes or None
+
+def parse_market_document(content):
+    """
+    Parses an ENTSO-E market document with a streaming parser, straight from the
+    response bytes to one NumPy array pair per TimeSeries period.
+
+    Input:
+        content (bytes): The XML document.
+
+    Output:
+        dict: 'type' (root tag, e.g. 'Publication_MarketDocument' or
+              'Acknowledgement_MarketDocument'), 'reason' (text of an acknowledgement, if any)
+              and 'timeseries', one dict per period with the TimeSeries fields found
+              ('psr_type', 'in_domain', 'out_domain', 'curve_type', ...), 'resolution',
+              'start', 'end' (datetime64), 'positions' (int array) and 'values' (float array).
+              Raises xml.etree.ElementTree.ParseError for malformed documents.
+    """
+    document = {"type": None, "reason": None, "timeseries": []}
+    current = {}
+    period = {}
+    positions = []
+    values = []
+
+    # Only end events: every field of a TimeSeries comes before its Periods
+    for _, element in ET.iterparse(io.BytesIO(content)):
+        tag = element.tag.rsplit('}', 1)[-1]
+        if tag == 'position':
+            positions.append(element.text)
+        elif tag in VALUE_TAGS:
+            values.append(element.text)
+        elif tag == 'Point':
+            element.clear()
+        elif tag == 'resolution':
+            period["resolution"] = element.text
+        elif tag in ('start', 'end'):
+            period[tag] = parse_utc(element.text)
+        elif tag == 'Period':
+            document["timeseries"].append(dict(
+                current,
+                resolution=period.get("resolution"),
+                start=period.get("start"),
+                end=period.get("end"),
+                positions=np.array(positions, dtype=np.int64),
+                values=np.array(values, dtype=np.float64)
+            ))
+            period = {}
+            positions = []
+            values = []
+        elif tag in TIMESERIES_FIELDS:
+            current[TIMESERIES_FIELDS[tag]] = element.text
+        elif tag == 'TimeSeries':
+            current = {}
+            element.clear()
+        elif tag == 'text':
+            document["reason"] = element.text
+        document["type"] = tag
+
+    return document
+
+def forward_fill(values):
+    """
+    Replaces every NaN with the last value before it (leading NaN are kept).
+
+    Input:
+        values (np.ndarray): The series.
+
+    Output:
+        np.ndarray: The filled series.
+    """
+    # Index of the last value given at or before each position
+    last = np.where(np.isnan(values), 0, np.arange(len(values)))
+    np.maximum.accumulate(last, out=last)
+    return values[last]
+
+def period_to_grid(period, slot_minutes):
+    """
+    Expands a period to a regular grid of slots. Positions left out by curve compression
+    (curveType A03) repeat the previous point, other missing positions are NaN. Coarser
+    resolutions are repeated on every slot they cover, finer ones are averaged.
+
+    Input:
+        period (dict): A period returned by parse_market_document.
+        slot_minutes (int): The minutes of each slot of the grid.
+
+    Output:
+        np.ndarray: The value of each slot from the period start to its end.
+    """
+    step = resolution_minutes(period.get("resolution"))
+    if step is None or (step % slot_minutes and slot_minutes % step):
+        raise ValueError(f"Resolution {period.get('resolution')} does not fit {slot_minutes} minute slots")
+    points = int((period["end"] - period["start"]) // np.timedelta64(step, 'm'))
+
+    series = np.full(points, np.nan)
+    inside = (period["positions"] >= 1) & (period["positions"] <= points)
+    series[period["positions"][inside] - 1] = period["values"][inside]
+    if period.get("curve_type") == 'A03':
+        series = forward_fill(series)
+
+    if step >= slot_minutes:
+        return np.repeat(series, step // slot_minutes)
+    return series.reshape(-1, slot_minutes // step).mean(axis=1)
+
+def resample(start, minutes, values, target_minutes):
+    """
+    Resamples a regular series: coarser targets average the slots they cover (ignoring
+    missing ones), finer targets repeat each value.
+
+    Input:
+        start (np.datetime64): The time of the first value.
+        minutes (int): The minutes of each value.
+        values (np.ndarray): The series (NaN where missing).
+        target_minutes (int): The minutes of each value of the result.
+
+    Output:
+        tuple: The datetime64 time and the value of each slot of the result.
+    """
+    if target_minutes == minutes:
+        resampled = values
+    elif target_minutes > minutes and target_minutes % minutes == 0:
+        factor = target_minutes // minutes
+        padded = np.concatenate([values, np.full(-len(values) % factor, np.nan)]).reshape(-1, factor)
+        counts = (~np.isnan(padded)).sum(axis=1)
+        sums = np.nansum(padded, axis=1)
+        resampled = np.divide(sums, counts, out=np.full(len(sums), np.nan), where=counts > 0)
+    elif minutes % target_minutes == 0:
+        resampled = np.repeat(values, minutes // target_minutes)
+    else:
+        raise ValueError(f"Cannot resample {minutes} minute values to {target_minutes} minutes")
+    times = start + np.arange(len(resampled)) * np.timedelta64(target_minutes, 'm')
+    return times, resampled
+
+def build_series(periods, resolution=None):
+    """
+    Builds one regular series from periods of any resolution (PT15M, PT30M, PT60M, ...).
+    Each slot takes the series published at the target resolution if there is one, or else
+    the finest one published, and compressed positions (curveType A03) are forward filled.
+
+    Input:
+        periods (list): Periods returned by parse_market_document.
+        resolution (str, optional): The resolution of the result. Defaults to the finest published.
+
+    Output:
+        tuple: The datetime64 time and the value of each slot (NaN where nothing was published).
+    """
+    periods = [period for period in periods
+               if resolution_minutes(period.get("resolution")) and len(period["values"])]
+    target = resolution_minutes(resolution) if resolution else None
+    if resolution and target is None:
+        raise ValueError(f"Not a valid resolution: {resolution}")
+    if not periods:
+        return np.array([], dtype='datetime64[m]'), np.array([])
+
+    steps = [resolution_minutes(period["resolution"]) for period in periods]
+    base = math.gcd(*steps)
+    start = min(period["start"] for period in periods)
+    end = max(period["end"] for period in periods)
+    series = np.full(int((end - start) // np.timedelta64(base, 'm')), np.nan)
+    for _, period in sorted(zip(steps, periods), key=lambda item: (item[0] != target, item[0])):
+        grid = period_to_grid(period, base)
+        offset = int((period["start"] - start) // np.timedelta64(base, 'm'))
+        target_slots = series[offset:offset + len(grid)]
+        empty = np.isnan(target_slots)
+        target_slots[empty] = grid[:len(target_slots)][empty]
+
+    # Back to the finest resolution published unless asked otherwise
+    return resample(start, base, series, target or min(steps))
+
+def price_points(document, resolution='PT60M'):
+    """
+    Extracts the price points of the first period with the given resolution.
+
+    Input:
+        document (dict): A document returned by parse_market_document.
+        resolution (str, optional): The ISO 8601 resolution. Defaults to 'PT60M'.
+
+    Output:
+        list: The points as dicts with 'position' and 'price.amount' (empty if there is none).
+    """
+    for period in document["timeseries"]:
+        if period["resolution"] == resolution:
+            return [{"position": str(position), "price.amount": str(value)}
+                    for position, value in zip(period["positions"].tolist(), period["values"].tolist())]
+    return []
+
+def latest_generation(document, gentype_names):
+    """
+    Extracts the generation of each type in the last interval published.
+    Consumption series (out of the bidding zone) never add generation.
+
+    Input:
+        document (dict): A document returned by parse_market_document.
+        gentype_names (dict): Maps ENTSO-E psrType keys to generation type names.
+
+    Output:
+        dict: The generation of each type with some production in the last interval.
+    """
+    periods = [period for period in document["timeseries"] if len(period["values"])]
+    if not periods:
+        return {}
+    last_end = max(period["end"] for period in periods)
+
+    gens = {}
+    for period in periods:
+        if period["end"] != last_end:
+            continue
+        name = gentype_names[period.get("psr_type")]
+        if period.get("in_domain") is not None:
+            gens[name] = int(period["values"][-1])
+        else:
+            gens.setdefault(name, 0)
+    return {key: value for key, value in gens.items() if value != 0}
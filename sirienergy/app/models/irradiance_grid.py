@@ -0,0 +1,205 @@
+import json
+import logging
+import os
+import threading
+import numpy as np
+import pandas as pd
+import pvlib
+from app.config import Config
+
+# Columns of the grid
+GRID_COMPONENTS = ("ghi", "dni", "dhi")
+
+# Calendar of the grid rows: every hour (UTC) of a leap year, so every month and day has a row
+GRID_YEAR = 2024
+GRID_HOURS = 366 * 24
+
+def grid_hours(times):
+    """
+    Returns the fractional grid row of UTC times. A time is matched to the same month,
+    day and hour of the grid year.
+
+    Input:
+        times (pd.DatetimeIndex): Times with a timezone.
+
+    Output:
+        np.ndarray: The row of each time (e.g. 10.5 is halfway between rows 10 and 11).
+    """
+    utc = times.tz_convert('UTC')
+    # Days after February of common years are one row further in the leap grid year
+    days = utc.dayofyear.to_numpy() - 1 + ((~utc.is_leap_year) & (utc.month > 2))
+    return days * 24 + utc.hour.to_numpy() + utc.minute.to_numpy() / 60
+
+def axis_weights(axis, value):
+    # The nodes around a value on an axis and their weights, or None outside the axis
+    if value < axis[0] or value > axis[-1]:
+        return None
+    if len(axis) == 1:
+        return slice(0, 1), np.ones(1)
+    index = min(int(np.searchsorted(axis, value, side='right')) - 1, len(axis) - 2)
+    weight = (value - axis[index]) / (axis[index + 1] - axis[index])
+    return slice(index, index + 2), np.array([1 - weight, weight])
+
+class IrradianceGrid:
+    """
+    Clear-sky irradiance precomputed on a latitude x longitude x altitude grid for every
+    hour of the year. Values between nodes are interpolated linearly in space and time.
+    """
+    def __init__(self, data, latitudes, longitudes, altitudes, max_error=None):
+        self.data = data
+        self.latitudes = np.asarray(latitudes, dtype=float)
+        self.longitudes = np.asarray(longitudes, dtype=float)
+        self.altitudes = np.asarray(altitudes, dtype=float)
+        self.max_error = max_error
+
+    def interpolate(self, latitude, longitude, altitude, times):
+        """
+        Interpolates the irradiance of a location at some times.
+
+        Input:
+            latitude (float): The latitude of the location.
+            longitude (float): The longitude of the location.
+            altitude (float): The altitude of the location in meters.
+            times (pd.DatetimeIndex): Times with a timezone.
+
+        Output:
+            np.ndarray: The times x (GHI, DNI, DHI) values in W/m2, or None outside the grid.
+        """
+        nodes = [axis_weights(self.latitudes, latitude), axis_weights(self.longitudes, longitude),
+                 axis_weights(self.altitudes, altitude)]
+        if any(node is None for node in nodes):
+            return None
+        (lat_nodes, lat_weights), (lon_nodes, lon_weights), (alt_nodes, alt_weights) = nodes
+
+        hours = grid_hours(times)
+        first = np.floor(hours).astype(int)
+        time_weight = (hours - first)[:, None]
+        # Only the rows of the surrounding nodes are read from the mapped file
+        block = self.data[lat_nodes, lon_nodes, alt_nodes]
+        rows = block[:, :, :, first] * (1 - time_weight) + block[:, :, :, (first + 1) % GRID_HOURS] * time_weight
+        return np.einsum('i,j,k,ijktc->tc', lat_weights, lon_weights, alt_weights, rows)
+
+def compute_node(latitude, longitude, altitude):
+    # Every hour of the grid year at one node with pvlib (Ineichen)
+    times = pd.date_range(start=f"{GRID_YEAR}-01-01", periods=GRID_HOURS, freq='1h', tz='UTC')
+    location = pvlib.location.Location(latitude, longitude, tz='UTC', altitude=altitude)
+    clearsky = location.get_clearsky(times, model='ineichen')
+    return clearsky[list(GRID_COMPONENTS)].to_numpy()
+
+def build_irradiance_grid(latitudes, longitudes, altitudes, path=None, progress=None):
+    """
+    Computes the clear-sky irradiance of every node of a grid and stores it as a .npy
+    file (with a .json file for the axes) to be memory-mapped by the workers. The
+    interpolation error is measured between the nodes against pvlib on another year.
+
+    Input:
+        latitudes (list): The latitude nodes (increasing).
+        longitudes (list): The longitude nodes (increasing).
+        altitudes (list): The altitude nodes in meters (increasing).
+        path (str, optional): The grid file. Defaults to PV_GRID_PATH.
+        progress (callable, optional): Receives the number of nodes done and the total.
+
+    Output:
+        float: The largest GHI interpolation error found, in W/m2.
+    """
+    path = path or Config.PV_GRID_PATH
+    axes = [np.asarray(axis, dtype=float) for axis in (latitudes, longitudes, altitudes)]
+    if any(len(axis) == 0 or np.any(np.diff(axis) <= 0) for axis in axes):
+        raise ValueError("Grid axes must be non-empty and increasing")
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    shape = tuple(len(axis) for axis in axes)
+    data = np.lib.format.open_memmap(temporary, mode='w+', dtype='<f4', shape=shape + (GRID_HOURS, len(GRID_COMPONENTS)))
+    for done, index in enumerate(np.ndindex(shape), start=1):
+        data[index] = compute_node(*(axis[i] for axis, i in zip(axes, index)))
+        if progress:
+            progress(done, data[..., 0, 0].size)
+    data.flush()
+
+    # Worst case is halfway between nodes, checked on a sample of days of a non-leap year
+    grid = IrradianceGrid(data, *axes)
+    middles = [(axis[:-1] + axis[1:]) / 2 if len(axis) > 1 else axis for axis in axes]
+    times = pd.date_range(start=f"{GRID_YEAR + 1}-01-01", periods=365 * 24, freq='1h', tz='UTC')[::24 * 7 + 1]
+    max_error = 0.0
+    for latitude in middles[0][::max(1, len(middles[0]) // 4)]:
+        for longitude in middles[1][::max(1, len(middles[1]) // 4)]:
+            for altitude in middles[2]:
+                location = pvlib.location.Location(latitude, longitude, tz='UTC', altitude=altitude)
+                reference = location.get_clearsky(times, model='ineichen')['ghi'].to_numpy()
+                interpolated = grid.interpolate(latitude, longitude, altitude, times)[:, 0]
+                max_error = max(max_error, float(np.abs(interpolated - reference).max()))
+    del grid, data
+
+    with open(f"{path}.json.tmp", 'w') as file:
+        json.dump({"latitudes": axes[0].tolist(), "longitudes": axes[1].tolist(),
+                   "altitudes": axes[2].tolist(), "max_error": max_error}, file)
+    os.replace(temporary, path)
+    os.replace(f"{path}.json.tmp", f"{path}.json")
+    return max_error
+
+# Modification times of the loaded grid files and the grid (False if not usable)
+_grid = (None, None)
+_grid_lock = threading.Lock()
+
+def grid_version(path):
+    # Changes whenever flask precompute-irradiance replaces the files, None if there are none
+    try:
+        return os.stat(path).st_mtime_ns, os.stat(f"{path}.json").st_mtime_ns
+    except OSError:
+        return None
+
+def get_irradiance_grid():
+    """
+    Maps the precomputed grid on first use (read-only, so every worker shares its pages),
+    and again whenever the grid files change, so a grid built while the app runs is used
+    without a restart.
+
+    Input: None
+    Output:
+        IrradianceGrid: The grid, or None if there is no grid file or it is not accurate
+                        enough for PV_GRID_TOLERANCE.
+    """
+    global _grid
+    version = grid_version(Config.PV_GRID_PATH)
+    if _grid[0] != version or _grid[1] is None:
+        with _grid_lock:
+            if _grid[0] != version or _grid[1] is None:
+                _grid = (version, load_irradiance_grid(Config.PV_GRID_PATH) if version else False)
+    return _grid[1] or None
+
+def load_irradiance_grid(path):
+    if not os.path.exists(path) or not os.path.exists(f"{path}.json"):
+        return False
+    with open(f"{path}.json") as file:
+        axes = json.load(file)
+    if axes["max_error"] > Config.PV_GRID_TOLERANCE:
+        logging.warning(f"[PV] Irradiance grid error {axes['max_error']:.1f} W/m2 is over the tolerance, not used")
+        return False
+    return IrradianceGrid(np.load(path, mmap_mode='r'), axes["latitudes"], axes["longitudes"],
+                          axes["altitudes"], axes["max_error"])
+
+def lookup_clear_sky_ghi(latitude, longitude, altitude, tz, date):
+    """
+    Interpolates the hourly clear-sky Global Horizontal Irradiance of a location and day
+    from the precomputed grid.
+
+    Input:
+        latitude (float): The latitude of the location.
+        longitude (float): The longitude of the location.
+        altitude (float): The altitude of the location in meters.
+        tz (str): The timezone of the location (e.g., 'Europe/Berlin').
+        date (datetime.date): The day.
+
+    Output:
+        list: The hourly GHI values in W/m2, or None if the location is not on the grid.
+    """
+    grid = get_irradiance_grid()
+    if grid is None:
+        return None
+    # Same hours as compute_clear_sky_ghi
+    start = pd.Timestamp(date.year, date.month, date.day)
+    times = pd.date_range(start=start, end=start.replace(hour=23, minute=59), freq='1h', tz=tz)
+    values = grid.interpolate(latitude, longitude, altitude, times)
+    return None if values is None else values[:, 0].tolist()
@@ -1,48 +1,400 @@
 import pvlib
+import numpy as np
 import pandas as pd
-from datetime import datetime
+import pytz
+import time
+from datetime import datetime, timedelta
+from functools import lru_cache
+from app.config import Config
+from app.models.cache_model import SharedCache
+from app.models.irradiance_grid import lookup_clear_sky_ghi
+from app.models.weather_model import get_radiation_forecast, round_coordinate
 
-def get_PV_gen(latitude, longitude, altitude, surface, efficiency, tz):
+# Clear-sky irradiance per m2 of each quantized location and day, shared by every worker
+clear_sky_cache = SharedCache("clear_sky", local_size=Config.CLEAR_SKY_CACHE_SIZE)
+
+@lru_cache(maxsize=1024)
+def is_valid_timezone(tz):
+    # pvlib locations take pytz names, an unknown one fails deep in the computation
+    try:
+        pytz.timezone(tz)
+        return True
+    except (pytz.UnknownTimeZoneError, AttributeError, ValueError):
+        return False
+
+def quantize(value, step):
+    # Rounded to the step, with a fixed number of decimals so keys are stable
+    return round(round(value / step) * step, 6)
+
+def get_clear_sky_ghi(latitude, longitude, altitude, tz, date):
     """
-    Calculates the photovoltaic (PV) power generation for a given location and system configuration.
-    
+    Retrieves the hourly clear-sky Global Horizontal Irradiance of a location and day.
+    Locations are quantized (PV_COORD_STEP degrees, PV_ALTITUDE_STEP meters) and every
+    quantized location and day is computed once and cached.
+
     Input:
         latitude (float): The latitude of the location.
         longitude (float): The longitude of the location.
         altitude (float): The altitude of the location in meters.
-        surface (float): The surface area of the PV panels in square meters.
-        efficiency (float): The efficiency of the PV panels as a percentage.
         tz (str): The timezone of the location (e.g., 'Europe/Berlin').
-    
+        date (datetime.date): The day.
+
     Output:
-        list: A list of hourly PV power generation values in watts.
+        list: The 24 hourly GHI values in W/m2.
+    """
+    latitude = quantize(latitude, Config.PV_COORD_STEP)
+    longitude = quantize(longitude, Config.PV_COORD_STEP)
+    altitude = quantize(altitude, Config.PV_ALTITUDE_STEP)
+    key = f"{latitude}:{longitude}:{altitude}:{tz}:{date.isoformat()}"
+    return clear_sky_cache.get(key,
+                               lambda: compute_clear_sky_ghi(latitude, longitude, altitude, tz, date),
+                               lambda ghi: time.time() + Config.CLEAR_SKY_TTL)
+
+def compute_clear_sky_ghi(latitude, longitude, altitude, tz, date):
+    """
+    Computes the hourly clear-sky Global Horizontal Irradiance of a location and day with pvlib.
+
+    Input:
+        latitude (float): The latitude of the location.
+        longitude (float): The longitude of the location.
+        altitude (float): The altitude of the location in meters.
+        tz (str): The timezone of the location (e.g., 'Europe/Berlin').
+        date (datetime.date): The day.
+
+    Output:
+        list: The 24 hourly GHI values in W/m2.
     """
     # Create a location object using pvlib
     location = pvlib.location.Location(latitude, longitude, tz=tz, altitude=altitude)
 
     # Define a time range: single day, with an hourly frequency
-    times = pd.date_range(start=datetime(2024, 9, 21, 0), end=datetime(2024, 9, 21, 23, 59), freq='1h', tz=tz)
+    start = datetime(date.year, date.month, date.day, 0)
+    times = pd.date_range(start=start, end=start.replace(hour=23, minute=59), freq='1h', tz=tz)
 
     # Calculate the clear sky solar radiation using the Ineichen clear sky model
     clearsky = location.get_clearsky(times, model='ineichen')  # DataFrame with GHI, DNI, DHI
 
     # Access the Global Horizontal Irradiance (GHI)
-    ghi = clearsky['ghi']
+    return clearsky['ghi'].tolist()
+
+@lru_cache(maxsize=4096)
+def monthly_linke_turbidity(cell_latitude, cell_longitude):
+    """
+    Looks up the monthly Linke turbidity of a cell of pvlib's 1/12 degree climatology.
+
+    Input:
+        cell_latitude (int): The cell row (floor of latitude * 12).
+        cell_longitude (int): The cell column (floor of longitude * 12).
 
-    # Convert GHI to a list (array)
-    ghi_array = ghi.tolist()
+    Output:
+        np.ndarray: The turbidity of each month, with December and January repeated at both
+                    ends for the interpolation between month middles.
+    """
+    months = pd.date_range('2015-01-01', periods=12, freq='MS', tz='UTC') + pd.Timedelta(days=14)
+    lts = pvlib.clearsky.lookup_linke_turbidity(months, (cell_latitude + 0.5) / 12, (cell_longitude + 0.5) / 12,
+                                                interp_turbidity=False).to_numpy()
+    return np.concatenate([[lts[-1]], lts, [lts[0]]])
+
+def month_middles(leap):
+    # Day of year of the middle of each month, with the previous December and next January
+    days = np.array([31, 29 if leap else 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+    return np.concatenate([[-31 / 2], np.cumsum(days) - days / 2, [days.sum() + 31 / 2]])
+
+def spa_apparent_zenith(unixtime, latitude, longitude, altitude, pressure):
+    """
+    Computes the apparent solar zenith with NREL SPA, as Location.get_solarposition does
+    (12 C, delta_t 67 s), for arrays of times and locations. The sun terms only depend on
+    the time, so they are computed once per distinct time and the location terms per element.
+
+    Input:
+        unixtime (np.ndarray): The UTC times in seconds.
+        latitude, longitude, altitude (np.ndarray): The location of each time (degrees, meters).
+        pressure (np.ndarray): The air pressure of each time in Pa.
+
+    Output:
+        np.ndarray: The apparent zenith in degrees.
+    """
+    times, time_index = np.unique(unixtime, return_inverse=True)
+    time_index = time_index.ravel()
+    R = pvlib.spa.solar_position_numpy(times, 0, 0, 0, 0, 0, 67.0, 0, 1, esd=True)[0]
+    v, alpha, delta = pvlib.spa.solar_position_numpy(times, 0, 0, 0, 0, 0, 67.0, 0, 1, sst=True)
+    R, v, alpha, delta = R[time_index], v[time_index], alpha[time_index], delta[time_index]
+
+    H = pvlib.spa.local_hour_angle(v, longitude, alpha)
+    xi = pvlib.spa.equatorial_horizontal_parallax(R)
+    u = pvlib.spa.uterm(latitude)
+    x = pvlib.spa.xterm(u, latitude, altitude)
+    y = pvlib.spa.yterm(u, latitude, altitude)
+    delta_alpha = pvlib.spa.parallax_sun_right_ascension(x, xi, H, delta)
+    delta_prime = pvlib.spa.topocentric_sun_declination(delta, x, y, xi, delta_alpha, H)
+    H_prime = pvlib.spa.topocentric_local_hour_angle(H, delta_alpha)
+    e0 = pvlib.spa.topocentric_elevation_angle_without_atmosphere(latitude, delta_prime, H_prime)
+    # SPA takes the pressure in millibars
+    delta_e = pvlib.spa.atmospheric_refraction_correction(pressure / 100, 12, e0, 0.5667)
+    return pvlib.spa.topocentric_zenith_angle(pvlib.spa.topocentric_elevation_angle(e0, delta_e))
+
+def compute_clear_sky_ghi_batch(latitudes, longitudes, altitudes, tzs, date):
+    """
+    Computes the hourly clear-sky Global Horizontal Irradiance of many locations and one day
+    in a single vectorized pass (NREL SPA solar position and Ineichen model, as Location.get_clearsky).
+
+    Input:
+        latitudes, longitudes, altitudes (np.ndarray): The locations (degrees, meters).
+        tzs (list): The timezone of each location.
+        date (datetime.date): The day.
+
+    Output:
+        tuple: The sites x hours GHI values in W/m2 and the number of hours of the local day
+               of each site. Days are the local hours from midnight as in get_clear_sky_ghi
+               (23 or 25 on daylight saving days), shorter rows repeat their last hour.
+    """
+    sites = len(latitudes)
+    # UTC time of every local hour of the day, computed once per timezone
+    start = datetime(date.year, date.month, date.day, 0)
+    local_days = {tz: pd.date_range(start=start, end=start.replace(hour=23, minute=59), freq='1h', tz=tz)
+                  for tz in set(tzs)}
+    hours = max(len(times) for times in local_days.values())
+    unixtime = np.empty((sites, hours))
+    lengths = np.empty(sites, dtype=int)
+    tz_array = np.asarray(tzs)
+    for tz, times in local_days.items():
+        seconds = times.tz_convert('UTC').as_unit('ns').asi8 / 1e9
+        unixtime[tz_array == tz] = np.concatenate([seconds, np.repeat(seconds[-1:], hours - len(seconds))])
+        lengths[tz_array == tz] = len(seconds)
+
+    latitude = np.repeat(latitudes, hours)
+    longitude = np.repeat(longitudes, hours)
+    altitude = np.repeat(altitudes, hours)
+    pressure = pvlib.atmosphere.alt2pres(altitude)
+    apparent_zenith = spa_apparent_zenith(unixtime.ravel(), latitude, longitude, altitude, pressure)
+    airmass_absolute = pvlib.atmosphere.get_absolute_airmass(
+        pvlib.atmosphere.get_relative_airmass(apparent_zenith), pressure)
+
+    # Linke turbidity of each site interpolated on the UTC day of year, as pvlib does
+    cells = np.stack([np.floor(np.asarray(latitudes) * 12), np.floor(np.asarray(longitudes) * 12)], axis=1).astype(int)
+    lts = np.array([monthly_linke_turbidity(int(row), int(column)) for row, column in cells])
+    utc = pd.to_datetime(unixtime.ravel(), unit='s')
+    dayofyear = utc.dayofyear.to_numpy()
+    middles = np.where(utc.is_leap_year[:, None], month_middles(True), month_middles(False))
+    upper = np.clip((dayofyear[:, None] >= middles).sum(axis=1), 1, 13)
+    site_index = np.repeat(np.arange(sites), hours)
+    weight = (dayofyear - middles[np.arange(len(upper)), upper - 1]) / \
+             (middles[np.arange(len(upper)), upper] - middles[np.arange(len(upper)), upper - 1])
+    linke_turbidity = lts[site_index, upper - 1] * (1 - weight) + lts[site_index, upper] * weight
+
+    dni_extra = pvlib.irradiance.get_extra_radiation(np.full(len(latitude), date.timetuple().tm_yday))
+    # Night hours have no airmass (NaN), Ineichen gives them 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        clearsky = pvlib.clearsky.ineichen(apparent_zenith, airmass_absolute, linke_turbidity,
+                                           altitude=altitude, dni_extra=dni_extra)
+    return np.asarray(clearsky['ghi']).reshape(sites, hours), lengths
+
+def get_PV_gen_batch(latitudes, longitudes, altitudes, surfaces, efficiencies, tzs, date=None):
+    """
+    Calculates the PV power generation of many sites at once. Locations are quantized as in
+    get_PV_gen and every distinct location is computed once.
+
+    Input:
+        latitudes, longitudes, altitudes (list): The location of each site (degrees, meters).
+        surfaces (list): The surface of the PV panels of each site in square meters.
+        efficiencies (list): The efficiency of the PV panels of each site as a percentage.
+        tzs (list): The timezone of each site.
+        date (datetime.date, optional): The day. Defaults to 2024-09-21.
+
+    Output:
+        list: The hourly PV power generation values in watts of each site, as get_PV_gen
+              (23 or 25 hours on daylight saving days).
+    """
+    date = date or datetime(2024, 9, 21).date()
+    latitudes = np.round(np.asarray(latitudes, dtype=float) / Config.PV_COORD_STEP) * Config.PV_COORD_STEP
+    longitudes = np.round(np.asarray(longitudes, dtype=float) / Config.PV_COORD_STEP) * Config.PV_COORD_STEP
+    altitudes = np.round(np.asarray(altitudes, dtype=float) / Config.PV_ALTITUDE_STEP) * Config.PV_ALTITUDE_STEP
+    tzs = [str(tz) for tz in tzs]
+
+    # Neighbouring rooftops share a quantized location: compute each one once
+    _, tz_codes = np.unique(tzs, return_inverse=True)
+    locations = np.stack([latitudes, longitudes, altitudes, tz_codes], axis=1)
+    unique, first, inverse = np.unique(locations, axis=0, return_index=True, return_inverse=True)
+    ghi, lengths = compute_clear_sky_ghi_batch(unique[:, 0], unique[:, 1], unique[:, 2],
+                                               [tzs[index] for index in first], date)
+
+    const = np.asarray(efficiencies, dtype=float) / 100 * np.asarray(surfaces, dtype=float)
+    power = (ghi[inverse.ravel()] * const[:, None]).tolist()
+    return [row[:length] for row, length in zip(power, lengths[inverse.ravel()])]
+
+def get_PV_gen(latitude, longitude, altitude, surface, efficiency, tz, date=None):
+    """
+    Calculates the photovoltaic (PV) power generation for a given location and system configuration.
+
+    Input:
+        latitude (float): The latitude of the location.
+        longitude (float): The longitude of the location.
+        altitude (float): The altitude of the location in meters.
+        surface (float): The surface area of the PV panels in square meters.
+        efficiency (float): The efficiency of the PV panels as a percentage.
+        tz (str): The timezone of the location (e.g., 'Europe/Berlin').
+        date (datetime.date, optional): The day. Defaults to 2024-09-21.
 
-    # Log the entire clearsky DataFrame
-    #logging.info(ghi_array)
-    #logging.info(f'Efficiency: {efficiency}')
-    #logging.info(f'Surface: {surface}')
+    Output:
+        list: A list of hourly PV power generation values in watts.
+    """
+    # The irradiance only depends on the place and day, the system is a scalar on top
+    date = date or datetime(2024, 9, 21).date()
+    # Interpolated from the precomputed grid when the location is on it, pvlib otherwise
+    ghi_array = lookup_clear_sky_ghi(latitude, longitude, altitude, tz, date)
+    if ghi_array is None:
+        ghi_array = get_clear_sky_ghi(latitude, longitude, altitude, tz, date)
 
     const = efficiency/100
     const = const * surface
 
-    #logging.info(f'Const: {const}')
-
     power_array = [x * const for x in ghi_array]
-    #logging.info(power_array)
 
-    return power_array
\ No newline at end of file
+    return power_array
+
+# PV models: clear sky (fixed day) or the weather forecast of today
+PV_MODES = ("clear_sky", "forecast")
+
+def get_PV_forecast_batch(latitudes, longitudes, surfaces, efficiencies, tzs):
+    """
+    Forecasts today's PV power generation of many sites from the Open-Meteo radiation and
+    temperature forecast. Sites are grouped by grid cell: one cached forecast per cell and
+    one vectorized pass over the sites of the cell.
+
+    Input:
+        latitudes, longitudes (list): The location of each site.
+        surfaces (list): The surface of the PV panels of each site in square meters.
+        efficiencies (list): The efficiency of the PV panels of each site as a percentage (at 25 C).
+        tzs (list): The timezone of each site.
+
+    Output:
+        np.ndarray: The sites x 24 hourly PV power generation values in watts.
+    """
+    const = np.asarray(efficiencies, dtype=float) / 100 * np.asarray(surfaces, dtype=float)
+    cells = {}
+    for index, cell in enumerate(zip(map(round_coordinate, latitudes), map(round_coordinate, longitudes), map(str, tzs))):
+        cells.setdefault(cell, []).append(index)
+
+    power = np.zeros((len(const), 24))
+    for (latitude, longitude, tz), sites in cells.items():
+        forecast = get_radiation_forecast(latitude, longitude, tz)
+        ghi = np.asarray(forecast['shortwave_radiation'], dtype=float)
+        # Hotter cells give less power (Faiman cell temperature, 1 m/s wind)
+        cell_temperature = pvlib.temperature.faiman(ghi, np.asarray(forecast['temperature_2m'], dtype=float))
+        derate = 1 + Config.PV_TEMPERATURE_COEFFICIENT * (cell_temperature - 25)
+        power[sites, :len(ghi)] = const[sites, None] * (ghi * derate)[None, :]
+    return power
+
+def get_PV_forecast(latitude, longitude, surface, efficiency, tz):
+    """
+    Forecasts today's PV power generation of a site (see get_PV_forecast_batch).
+
+    Input:
+        latitude (float): The latitude of the location.
+        longitude (float): The longitude of the location.
+        surface (float): The surface area of the PV panels in square meters.
+        efficiency (float): The efficiency of the PV panels as a percentage.
+        tz (str): The timezone of the location (e.g., 'Europe/Berlin').
+
+    Output:
+        list: A list of 24 hourly PV power generation values in watts.
+    """
+    return get_PV_forecast_batch([latitude], [longitude], [surface], [efficiency], [tz])[0].tolist()
+
+# Time steps of the range simulation (minutes)
+PV_RESOLUTIONS = {"PT60M": 60, "PT15M": 15}
+
+# Periods of the range summaries (pandas period frequency)
+PV_SUMMARY_PERIODS = {"day": "D", "month": "M"}
+
+def pv_range_days(start_date, end_date):
+    """
+    Validates a simulation date range.
+
+    Input:
+        start_date (str): The first date ("YYYY-MM-DD").
+        end_date (str): The last date ("YYYY-MM-DD", included).
+
+    Output:
+        tuple: The first date and the number of days, raises ValueError if the range is not valid.
+    """
+    try:
+        start = np.datetime64(start_date, 'D')
+        days = int((np.datetime64(end_date, 'D') - start).astype(int)) + 1
+    except ValueError:
+        raise ValueError(f"Not a valid date range: {start_date} - {end_date}")
+    if days < 1:
+        raise ValueError("'end_date' must not be before 'start_date'")
+    if days > Config.PV_MAX_RANGE_DAYS:
+        raise ValueError(f"PV simulations are limited to {Config.PV_MAX_RANGE_DAYS} days")
+    return start.astype(datetime), days
+
+def iter_PV_gen(latitude, longitude, altitude, surface, efficiency, tz, start_date, end_date,
+                resolution="PT60M", chunk_days=None):
+    """
+    Simulates the PV power generation of a site over a date range, a chunk of days at a
+    time, so memory does not grow with the length of the range.
+
+    Input:
+        latitude (float): The latitude of the location.
+        longitude (float): The longitude of the location.
+        altitude (float): The altitude of the location in meters.
+        surface (float): The surface area of the PV panels in square meters.
+        efficiency (float): The efficiency of the PV panels as a percentage.
+        tz (str): The timezone of the location (e.g., 'Europe/Berlin').
+        start_date (str): The first date ("YYYY-MM-DD").
+        end_date (str): The last date ("YYYY-MM-DD", included).
+        resolution (str, optional): "PT60M" or "PT15M".
+        chunk_days (int, optional): Days per chunk. Defaults to PV_CHUNK_DAYS.
+
+    Output:
+        generator: (times, power) per chunk, the local times (pd.DatetimeIndex) and an array
+                   of PV power generation values in watts.
+    """
+    if resolution not in PV_RESOLUTIONS:
+        raise ValueError(f"Not a valid resolution: {resolution}")
+    start, days = pv_range_days(start_date, end_date)
+    chunk_days = chunk_days or Config.PV_CHUNK_DAYS
+    # Validated before the first chunk, so errors are raised before anything is streamed
+    location = pvlib.location.Location(latitude, longitude, tz=tz, altitude=altitude)
+    const = efficiency / 100 * surface
+
+    def chunks():
+        for offset in range(0, days, chunk_days):
+            first = start + timedelta(days=offset)
+            last = start + timedelta(days=min(offset + chunk_days, days))
+            # Local days, with 23 or 25 hours on daylight saving changes
+            times = pd.date_range(start=first, end=last, freq=f"{PV_RESOLUTIONS[resolution]}min",
+                                  tz=tz, inclusive='left')
+            clearsky = location.get_clearsky(times, model='ineichen')
+            yield times, clearsky['ghi'].to_numpy() * const
+
+    return chunks()
+
+def summarize_PV_gen(chunks, period="month"):
+    """
+    Sums the energy of a PV simulation per day or month, reading it chunk by chunk.
+
+    Input:
+        chunks (iterable): The (times, power) chunks of iter_PV_gen.
+        period (str, optional): "day" or "month".
+
+    Output:
+        list: One dict per period with its label ("YYYY-MM-DD" or "YYYY-MM"), energy in kWh
+              and peak power in watts.
+    """
+    if period not in PV_SUMMARY_PERIODS:
+        raise ValueError(f"Not a valid summary period: {period}")
+    totals = {}
+    for times, power in chunks:
+        hours = pd.Timedelta(times.freq).total_seconds() / 3600
+        labels = times.tz_localize(None).to_period(PV_SUMMARY_PERIODS[period]).astype(str)
+        # A period can span two chunks, so partial sums are merged
+        sums = pd.DataFrame({"energy": power * hours / 1000, "peak": power}).groupby(labels, sort=False) \
+                 .agg({"energy": "sum", "peak": "max"})
+        for label, energy, peak in sums.itertuples():
+            total = totals.setdefault(label, {"period": label, "energy_kwh": 0.0, "peak_w": 0.0})
+            total["energy_kwh"] += float(energy)
+            total["peak_w"] = max(total["peak_w"], float(peak))
+    return [{**total, "energy_kwh": round(total["energy_kwh"], 3), "peak_w": round(total["peak_w"], 3)}
+            for total in totals.values()]
@@ -1,10 +1,178 @@
+import hashlib
+import io
+import os
 import openmeteo_requests
+import requests
 import requests_cache
+import numpy as np
 import pandas as pd
-from retry_requests import retry
-import requests
+import pvlib
+import redis
+import threading
+import time
 from datetime import datetime
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPResponse, Retry
 from app.config import Config
+from app.metrics import instrument_redis, record_upstream
+from app.models.cache_model import SharedCache
+
+class WeatherSession(requests_cache.CachedSession):
+    """
+    Cached session that counts the requests answered from the cache.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "hits": 0, "lock_wait_seconds": 0.0, "lock_wait_max_seconds": 0.0}
+
+    def send(self, request, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = super().send(request, **kwargs)
+        except requests.RequestException as e:
+            record_upstream("open_meteo", time.perf_counter() - start, type(e).__name__, 0)
+            raise
+        if getattr(response, 'from_cache', False):
+            record_upstream("open_meteo", None, "cached", 0)
+        else:
+            record_upstream("open_meteo", time.perf_counter() - start, response.status_code, len(response.content))
+        with self.stats_lock:
+            self.stats["requests"] += 1
+            self.stats["hits"] += int(getattr(response, 'from_cache', False))
+        return response
+
+    def record_wait(self, seconds):
+        with self.stats_lock:
+            self.stats["lock_wait_seconds"] += seconds
+            self.stats["lock_wait_max_seconds"] = max(self.stats["lock_wait_max_seconds"], seconds)
+
+def recording_name(path_url):
+    # Named after the path and query only, so recordings do not depend on the host serving them
+    return hashlib.sha1(path_url.encode()).hexdigest() + ".bin"
+
+class RecordedAdapter(HTTPAdapter):
+    """
+    Transport that replays recorded Open-Meteo responses from WEATHER_RECORDINGS_DIR, or
+    records them on the way in 'record' mode. Lets the weather and PV forecast code run
+    offline (tests, benchmarks) with the real client and parser.
+    """
+    def recording_path(self, request):
+        return os.path.join(Config.WEATHER_RECORDINGS_DIR, recording_name(request.path_url))
+
+    def send(self, request, **kwargs):
+        path = self.recording_path(request)
+        if Config.WEATHER_RECORDINGS_MODE == 'record':
+            response = super().send(request, **kwargs)
+            if response.status_code == 200:
+                os.makedirs(Config.WEATHER_RECORDINGS_DIR, exist_ok=True)
+                with open(path, 'wb') as file:
+                    file.write(response.content)
+            return response
+        if not os.path.exists(path):
+            raise requests.ConnectionError(f"No recorded response for {request.url}", request=request)
+        with open(path, 'rb') as file:
+            body = file.read()
+        raw = HTTPResponse(body=io.BytesIO(body), status=200, preload_content=False, request_url=request.url,
+                           headers={'Content-Type': 'application/octet-stream', 'Content-Length': str(len(body))})
+        return self.build_response(request, raw)
+
+def create_weather_cache():
+    """
+    Creates the HTTP cache backend selected by WEATHER_CACHE_BACKEND.
+
+    Input: None
+    Output:
+        The requests-cache backend (or its name).
+    """
+    if Config.WEATHER_CACHE_BACKEND == 'redis':
+        # Own connection: requests-cache stores pickled responses, not decoded strings
+        return requests_cache.RedisCache(namespace='weather', connection=instrument_redis(redis.StrictRedis(host=Config.REDIS_HOST, port=Config.REDIS_PORT)))
+    if Config.WEATHER_CACHE_BACKEND == 'sqlite':
+        # WAL lets the workers read while one of them writes
+        return requests_cache.SQLiteCache(Config.WEATHER_CACHE_PATH, wal=True)
+    if Config.WEATHER_CACHE_BACKEND == 'memory':
+        return 'memory'
+    raise ValueError(f"Not a valid weather cache backend: {Config.WEATHER_CACHE_BACKEND}")
+
+_weather_client = None
+_weather_session = None
+_weather_slots = threading.BoundedSemaphore(Config.WEATHER_POOL_SIZE)
+_weather_client_lock = threading.Lock()
+
+def get_weather_client():
+    """
+    Returns the Open-Meteo client shared by every request of the process, with a cached
+    session and a pool of kept-alive connections.
+
+    Input: None
+    Output:
+        openmeteo_requests.Client: The client (created on first use).
+    """
+    global _weather_client, _weather_session
+    if _weather_client is None:
+        with _weather_client_lock:
+            if _weather_client is None:
+                session = WeatherSession(backend=create_weather_cache(), expire_after=Config.WEATHER_CACHE_SECONDS)
+                # Same retries as retry_requests.retry, on an adapter sized for the concurrent requests
+                retries = Retry(total=Config.WEATHER_RETRIES, read=Config.WEATHER_RETRIES, connect=Config.WEATHER_RETRIES,
+                                backoff_factor=0.2, status_forcelist=(500, 502, 504), allowed_methods=None)
+                adapter_class = RecordedAdapter if Config.WEATHER_RECORDINGS_DIR else HTTPAdapter
+                adapter = adapter_class(pool_connections=1, pool_maxsize=Config.WEATHER_POOL_SIZE, max_retries=retries)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _weather_session = session
+                _weather_client = openmeteo_requests.Client(session=session)
+    return _weather_client
+
+def get_weather_stats():
+    """
+    Returns the counters of the weather client of this process.
+
+    Input: None
+    Output:
+        dict: The cache backend, requests, cache hits and hit ratio, and the time spent
+              waiting for a free connection (total and longest, in seconds).
+    """
+    get_weather_client()
+    with _weather_session.stats_lock:
+        stats = dict(_weather_session.stats)
+    stats["backend"] = Config.WEATHER_CACHE_BACKEND
+    stats["hit_ratio"] = round(stats["hits"] / stats["requests"], 4) if stats["requests"] else None
+    return stats
+
+def round_coordinate(value):
+    # Rounded to the step, with a fixed number of decimals so cache keys are stable
+    return round(round(value / Config.WEATHER_COORD_STEP) * Config.WEATHER_COORD_STEP, 6)
+
+def request_forecast(params):
+    """
+    Requests a forecast with the shared Open-Meteo client.
+
+    Input:
+        params (dict): The query parameters (coordinates already rounded).
+
+    Output:
+        tuple: The hourly local times (pd.DatetimeIndex, shifted by the UTC offset of the
+               location) and the hourly variables (openmeteo_sdk VariablesWithTime).
+    """
+    openmeteo = get_weather_client()
+    # One request per kept-alive connection, the others wait for a free one
+    start = time.perf_counter()
+    with _weather_slots:
+        _weather_session.record_wait(time.perf_counter() - start)
+        responses = openmeteo.weather_api(Config.OPEN_METEO_URL, params=params, timeout=Config.WEATHER_TIMEOUT)
+    response = responses[0]
+    hourly = response.Hourly()
+    dates = pd.date_range(
+        start=pd.to_datetime(hourly.Time(), unit="s", utc=True),
+        end=pd.to_datetime(hourly.TimeEnd(), unit="s", utc=True),
+        freq=pd.Timedelta(seconds=hourly.Interval()),
+        inclusive="left"
+    )
+    return dates + pd.to_timedelta(response.UtcOffsetSeconds(), unit='s'), hourly
 
 def get_weather(latitude, longitude, timezone):
     """
@@ -18,76 +186,145 @@ def get_weather(latitude, longitude, timezone):
     Output:
         pd.DataFrame: A DataFrame containing hourly weather codes for the next 24 hours.
     """
-    cache_session = requests_cache.CachedSession('.cache', expire_after=3600)
-    retry_session = retry(cache_session, retries=5, backoff_factor=0.2)
-    openmeteo = openmeteo_requests.Client(session=retry_session)
-    url = "https://api.open-meteo.com/v1/forecast"
     params = {
-        "latitude": latitude,
-        "longitude": longitude,
+        "latitude": round_coordinate(latitude),
+        "longitude": round_coordinate(longitude),
         "hourly": "weather_code",
         "timezone": timezone
     }
-    responses = openmeteo.weather_api(url, params=params)
-    response = responses[0]
-    hourly = response.Hourly()
-    hourly_weather_code = hourly.Variables(0).ValuesAsNumpy()
-    hourly_data = {
-        "date": pd.date_range(
-            start=pd.to_datetime(hourly.Time(), unit="s", utc=True),
-            end=pd.to_datetime(hourly.TimeEnd(), unit="s", utc=True),
-            freq=pd.Timedelta(seconds=hourly.Interval()),
-            inclusive="left"
-        )
-    }
-    hourly_data["date"] = hourly_data["date"] + pd.to_timedelta(response.UtcOffsetSeconds(), unit='s')
-    hourly_data["weather_code"] = hourly_weather_code
+    dates, hourly = request_forecast(params)
+    hourly_data = {"date": dates, "weather_code": hourly.Variables(0).ValuesAsNumpy()}
     hourly_dataframe = pd.DataFrame(data=hourly_data).head(24)
     hourly_dataframe['weather_code'] = hourly_dataframe['weather_code'].astype(int).astype(str)
     return hourly_dataframe
 
-def get_sunrise_sunset(latitude, longitude):
+# Hourly variables of the PV forecast (W/m2 averaged over the preceding hour, and C)
+RADIATION_VARIABLES = ("shortwave_radiation", "direct_radiation", "diffuse_radiation", "temperature_2m")
+
+# Radiation forecast of each grid cell and day, shared by every worker
+radiation_cache = SharedCache("radiation_forecast")
+
+def get_radiation_forecast(latitude, longitude, timezone):
+    """
+    Retrieves today's hourly radiation and temperature forecast of the grid cell of a location.
+    Locations are rounded to WEATHER_COORD_STEP, so every site of a cell shares one upstream
+    request per forecast refresh.
+
+    Input:
+        latitude (float): The latitude of the location.
+        longitude (float): The longitude of the location.
+        timezone (str): The timezone of the location (e.g., 'Europe/Berlin').
+
+    Output:
+        dict: The local times ("date") and one list of 24 hourly values per RADIATION_VARIABLES name.
+    """
+    latitude, longitude = round_coordinate(latitude), round_coordinate(longitude)
+    today = datetime.now(ZoneInfo(timezone)).date().isoformat()
+    return radiation_cache.get(f"{latitude}:{longitude}:{timezone}:{today}",
+                               lambda: fetch_radiation_forecast(latitude, longitude, timezone),
+                               lambda forecast: time.time() + Config.WEATHER_CACHE_SECONDS)
+
+def fetch_radiation_forecast(latitude, longitude, timezone):
+    params = {
+        "latitude": latitude,
+        "longitude": longitude,
+        "hourly": list(RADIATION_VARIABLES),
+        "timezone": timezone,
+        "forecast_days": 1
+    }
+    try:
+        dates, hourly = request_forecast(params)
+    except openmeteo_requests.OpenMeteoRequestsError as e:
+        raise ValueError(f"Radiation forecast not available: {e}")
+    forecast = {"date": dates.strftime('%Y-%m-%dT%H:%M').tolist()[:24]}
+    for index, name in enumerate(RADIATION_VARIABLES):
+        forecast[name] = np.round(hourly.Variables(index).ValuesAsNumpy()[:24].astype(float), 2).tolist()
+    return forecast
+
+# Sun elevation (degrees) at sunrise and sunset: upper limb on the horizon, with refraction
+SUNRISE_ELEVATION = -0.833
+
+@lru_cache(maxsize=4096)
+def get_sun_day(latitude, longitude, timezone, date):
+    """
+    Computes the sunrise, sunset and day/night hours of a location and day from the
+    solar position (NREL SPA), cached per location and day.
+
+    Input:
+        latitude (float): The latitude of the location.
+        longitude (float): The longitude of the location.
+        timezone (str): The timezone of the location (e.g., 'Europe/Berlin').
+        date (datetime.date): The day.
+
+    Output:
+        tuple: The sunrise and sunset local times (None if the sun does not rise or set
+               that day) and a tuple of 24 booleans, True if the sun is up at that hour.
     """
-    Retrieves the sunrise and sunset times for a given location using the WeatherAPI.
+    # Wall clock hours, the first occurrence on daylight saving changes
+    hours = pd.date_range(start=pd.Timestamp(date), periods=24, freq='1h').tz_localize(
+        timezone, ambiguous=np.ones(24, dtype=bool), nonexistent='shift_forward')
+    elevation = pvlib.solarposition.get_solarposition(hours, latitude, longitude)['elevation'].to_numpy()
+    day_hours = tuple(bool(flag) for flag in elevation > SUNRISE_ELEVATION)
+
+    noon = pd.DatetimeIndex([pd.Timestamp(date) + pd.Timedelta(hours=12)]).tz_localize(timezone)
+    sun = pvlib.solarposition.sun_rise_set_transit_spa(noon, latitude, longitude).iloc[0]
+    sunrise, sunset = (None if pd.isna(sun[event]) else sun[event].tz_convert(timezone).floor('s').to_pydatetime().replace(tzinfo=None)
+                       for event in ('sunrise', 'sunset'))
+    return sunrise, sunset, day_hours
+
+def get_sunrise_sunset(latitude, longitude, timezone, date=None):
+    """
+    Retrieves the sunrise and sunset times for a given location and day.
     
     Input:
         latitude (float): The latitude of the location.
         longitude (float): The longitude of the location.
+        timezone (str): The timezone of the location (e.g., 'Europe/Berlin').
+        date (datetime.date, optional): The day. Defaults to today in that timezone.
     
     Output:
-        tuple: A tuple containing the sunrise and sunset times as strings (e.g., '06:30 AM', '06:00 PM').
+        tuple: A tuple containing the sunrise and sunset times as strings (e.g., '06:30 AM', '06:00 PM'),
+               None when the sun does not rise or set that day.
     """
-    url = f"http://api.weatherapi.com/v1/astronomy.json?key={Config.WEATHER_API_API_KEY}&q={latitude},{longitude}&aqi=no"
-    response = requests.get(url)
-    if response.status_code == 200:
-        data = response.json()
-        return data['astronomy']['astro']['sunrise'], data['astronomy']['astro']['sunset']
-    else:
-        raise Exception(f"Failed to retrieve weather data. Status code: {response.status_code}")
+    date = date or pd.Timestamp.now(tz=timezone).date()
+    sunrise, sunset, _ = get_sun_day(round_coordinate(latitude), round_coordinate(longitude), timezone, date)
+    return tuple(None if time is None else time.strftime('%I:%M %p') for time in (sunrise, sunset))
 
-def image_array(codes, sunrise, sunset):
+def day_night_flags(latitude, longitude, timezone, dates):
+    """
+    Tells if the sun is up at each of some local times.
+
+    Input:
+        latitude (float): The latitude of the location.
+        longitude (float): The longitude of the location.
+        timezone (str): The timezone of the location (e.g., 'Europe/Berlin').
+        dates (pd.Series): Local times (without timezone), e.g. the 'date' column of get_weather.
+
+    Output:
+        np.ndarray: True where the sun is up at that hour.
+    """
+    dates = pd.to_datetime(dates)
+    days = dates.dt.date.to_numpy()
+    # One solar position computation per day of the forecast, cached
+    flags = {day: np.array(get_sun_day(round_coordinate(latitude), round_coordinate(longitude), timezone, day)[2])
+             for day in set(days)}
+    by_day = np.stack([flags[day] for day in days])
+    return by_day[np.arange(len(days)), dates.dt.hour.to_numpy()]
+
+def image_array(codes, day_flags):
     """
     Generates an array of image names based on weather codes and day/night conditions.
     
     Input:
         codes (pd.DataFrame): A DataFrame containing weather codes and timestamps.
-        sunrise (str): The sunrise time in the format 'HH:MM AM/PM'.
-        sunset (str): The sunset time in the format 'HH:MM AM/PM'.
+        day_flags (np.ndarray): True where the sun is up at each row of codes (see day_night_flags).
     
     Output:
         list: A list of image names indicating day/night and weather conditions (e.g., 'day-100', 'night-200').
     """
-    if codes is None or sunrise is None or sunset is None:
+    if codes is None or day_flags is None:
         raise ValueError("Invalid data for image generation.")
 
-    codes['date'] = pd.to_datetime(codes['date'])
-    sunrise_time = datetime.strptime(sunrise, '%I:%M %p').time()
-    sunset_time = datetime.strptime(sunset, '%I:%M %p').time()
-
-    def day_or_night(timestamp):
-        time = timestamp.time()
-        return 'day' if sunrise_time <= time <= sunset_time else 'night'
-
-    codes['day_night'] = codes['date'].apply(day_or_night)
-    images = codes.apply(lambda row: f"{row['day_night']}-{row['weather_code']}", axis=1)
-    return images.tolist()
\ No newline at end of file
+    # Labels built on the arrays, not row by row
+    day_night = np.where(np.asarray(day_flags), 'day-', 'night-')
+    return np.char.add(day_night, codes['weather_code'].to_numpy(dtype=str)).tolist()
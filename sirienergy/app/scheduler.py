@@ -0,0 +1,227 @@
+import atexit
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+import redis
+from app.config import Config
+from app.models.cache_model import get_redis_client
+from app.models.ENTSOE_models import (load_entsoe_country_keys, next_publication_time, price_cache,
+                                      refresh_day_ahead_prices, refresh_actual_generation_by_type)
+
+LEADER_KEY = "prefetch:leader"
+
+# Takes or extends the lease only if it is free or already ours
+RENEW_LEASE_LUA = """
+local owner = redis.call('GET', KEYS[1])
+if owner == false then
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+    return 1
+end
+if owner == ARGV[1] then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+return 0
+"""
+
+RELEASE_LEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+def jitter():
+    return random.uniform(0, Config.PREFETCH_JITTER_SECONDS)
+
+class PrefetchScheduler:
+    """
+    Background thread that keeps the ENTSO-E caches warm, so requests read precomputed results:
+    the day-ahead prices of every bidding zone right after the daily publication, and the
+    generation by type every refresh interval.
+    Every worker runs one, but only the worker holding the Redis lease fetches. If Redis
+    is not reachable every worker fetches for its own in-process cache.
+    """
+    def __init__(self):
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.leader = False
+        self.next_prices = time.time()
+        self.next_generation = time.time()
+        self.price_retries = 0
+        self.renew_script = None
+        self.release_script = None
+
+    def is_leader(self):
+        """
+        Takes or renews the leader lease.
+
+        Input: None
+        Output:
+            bool: True if this worker is the leader.
+        """
+        try:
+            if self.renew_script is None:
+                self.renew_script = get_redis_client().register_script(RENEW_LEASE_LUA)
+            leader = bool(self.renew_script(keys=[LEADER_KEY], args=[self.worker_id, Config.PREFETCH_LEASE_SECONDS]))
+        except redis.RedisError as e:
+            if not self.leader:
+                logging.warning(f"[Prefetch] Redis not available, fetching locally ({e})")
+            leader = True
+        if leader != self.leader:
+            logging.info(f"[Prefetch] {self.worker_id} {'is now' if leader else 'is no longer'} the leader")
+        self.leader = leader
+        return leader
+
+    def release(self):
+        if not self.leader:
+            return
+        try:
+            if self.release_script is None:
+                self.release_script = get_redis_client().register_script(RELEASE_LEASE_LUA)
+            self.release_script(keys=[LEADER_KEY], args=[self.worker_id])
+        except redis.RedisError:
+            pass
+        self.leader = False
+
+    def run_for_zones(self, refresh):
+        """
+        Runs a refresh for every bidding zone with a bounded number of concurrent requests.
+
+        Input:
+            refresh (callable): Receives the zone key and returns the fetched result.
+
+        Output:
+            dict: The result of each zone key (None if the refresh raised).
+        """
+        zone_keys = sorted(set(load_entsoe_country_keys().values()))
+
+        def run(zone_key):
+            try:
+                return refresh(zone_key)
+            except Exception as e:
+                logging.error(f"[Prefetch] Refresh of {zone_key} failed: {e}")
+                return None
+            finally:
+                # Slow upstream answers must not let the lease expire in the middle of a job
+                self.is_leader()
+
+        with ThreadPoolExecutor(max_workers=Config.PREFETCH_WORKERS) as executor:
+            return dict(zip(zone_keys, executor.map(run, zone_keys)))
+
+    def prefetch_prices(self):
+        """
+        Fetches the prices of today and, once published, tomorrow for every zone still missing them.
+
+        Input: None
+        Output:
+            bool: True if every zone has prices for those days.
+        """
+        now = datetime.now()
+        delivery_days = [now.strftime('%Y%m%d')]
+        # Tomorrow's prices are out once the next publication is not today anymore
+        publication_tz = ZoneInfo(Config.DAY_AHEAD_PUBLICATION_TZ)
+        if datetime.fromtimestamp(next_publication_time(), publication_tz).date() > datetime.now(publication_tz).date():
+            delivery_days.append((now + timedelta(days=1)).strftime('%Y%m%d'))
+
+        complete = True
+        for delivery_day in delivery_days:
+            def refresh(zone_key):
+                series = price_cache.peek(f"{zone_key}:{delivery_day}")
+                return series if series and series['values'] else refresh_day_ahead_prices(zone_key, delivery_day)
+            results = self.run_for_zones(refresh)
+            missing = [zone_key for zone_key, series in results.items() if not series or not series.get('values')]
+            if missing:
+                complete = False
+                logging.info(f"[Prefetch] No prices for {delivery_day} yet: {', '.join(missing)}")
+        return complete
+
+    def prefetch_generation(self):
+        results = self.run_for_zones(refresh_actual_generation_by_type)
+        failed = [zone_key for zone_key, gens in results.items() if gens is None or 'error' in gens]
+        if failed:
+            logging.info(f"[Prefetch] Generation by type failed for: {', '.join(failed)}")
+
+    def run_pending(self):
+        """
+        Runs the jobs that are due and schedules their next run.
+
+        Input: None
+        Output: None
+        """
+        now = time.time()
+        if now >= self.next_prices:
+            if self.prefetch_prices() or self.price_retries >= Config.PREFETCH_MAX_RETRIES:
+                self.price_retries = 0
+                self.next_prices = next_publication_time() + Config.PREFETCH_PUBLICATION_DELAY + jitter()
+            else:
+                # Not published yet for some zones, try again soon
+                self.price_retries += 1
+                self.next_prices = time.time() + Config.DAY_AHEAD_EMPTY_TTL + jitter()
+        if now >= self.next_generation:
+            self.prefetch_generation()
+            self.next_generation = time.time() + Config.GENERATION_REFRESH_SECONDS + jitter()
+
+    def loop(self):
+        # Start with some jitter so the workers of a deployment do not all wake up at once
+        self.stop_event.wait(jitter() / 10)
+        while not self.stop_event.is_set():
+            try:
+                if self.is_leader():
+                    self.run_pending()
+            except Exception:
+                logging.exception("[Prefetch] Scheduler iteration failed")
+            self.stop_event.wait(Config.PREFETCH_LEASE_SECONDS / 3)
+        self.release()
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self.loop, name="prefetch-scheduler", daemon=True)
+        self.thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        self.stop_event.set()
+        self.release()
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def start_scheduler():
+    """
+    Starts the prefetch scheduler of this process (once).
+
+    Input: None
+    Output:
+        PrefetchScheduler: The running scheduler.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = PrefetchScheduler()
+            _scheduler.start()
+    return _scheduler
+
+def start_scheduler_when_serving(app):
+    """
+    Starts the prefetch scheduler with the first request the app serves, so processes that
+    only build the app (flask CLI commands, the reloader's watcher process) never run it.
+
+    Input:
+        app (Flask): The application.
+    Output: None
+    """
+    def start_on_request():
+        if _scheduler is None:
+            start_scheduler()
+
+    app.before_request(start_on_request)
@@ -62,14 +62,8 @@ async function getWeather() {
         return;
     }
 
-    // Fetch weather data from the server
-    fetch('/weather', {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({ latitude, longitude, timezone }),
-    })
+    // Fetch weather data from the server (GET, so the browser revalidates it with its ETag)
+    fetch('/weather?' + new URLSearchParams({ latitude, longitude, timezone }))
         .then(response => {
             if (response.ok) {
                 return response.text();
@@ -0,0 +1,257 @@
+"""
+Measures the throughput and latency (p50/p95/p99) of the HTTP endpoints of the app
+built by create_app(), with the upstream APIs replaced by benchmarks.upstream_stub so
+runs do not depend on the network or on API quotas. Results are written as JSON to
+compare runs.
+
+Redis is fakeredis (in process, with RedisJSON and Lua) unless a Redis Stack is given:
+    docker run -d -p 6379:6379 redis/redis-stack-server
+Run from the sirienergy folder (pip install -r benchmarks/requirements.txt):
+    python -m benchmarks.endpoint_benchmark --requests 200 --concurrency 8 --output results.json
+    python -m benchmarks.endpoint_benchmark --redis redis://localhost:6379 --endpoints sell PVgen
+
+With a real Redis the cached upstream data of earlier runs is reused, so the first
+request of /sell, /day_ahead_prices and /actual_gen_type is only cold on a new Redis.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+import numpy as np
+import requests
+
+RUN_ID = int(time.time())
+COMMUNITY = f"benchmark-{RUN_ID}"
+USERS = [f"benchmark{index}-{RUN_ID}@sirienergy.local" for index in range(4)]
+TODAY = datetime.now().strftime("%Y-%m-%d")
+MONTH = TODAY[:7]
+MONTH_START = f"{MONTH}-01"
+
+# Site of the PV and weather requests (one of the Open-Meteo fixture locations)
+SITE = {"latitude": 41.61, "longitude": 0.62, "altitude": 200, "timezone": "Europe/Madrid",
+        "surface": 20, "efficiency": 0.2}
+
+# Benchmarked endpoints: name, method, path and the body (or query) of the i-th request
+ENDPOINTS = [
+    ("sell", "POST", "/sell", lambda i: {**SITE, "country": "Spain", "fee": "MARKET", "fixed_price": 0}),
+    ("PVgen", "POST", "/PVgen", lambda i: SITE),
+    ("PVgen_forecast", "POST", "/PVgen", lambda i: {**SITE, "mode": "forecast"}),
+    ("weather", "GET", "/weather", lambda i: {key: SITE[key] for key in ("latitude", "longitude", "timezone")}),
+    ("day_ahead_prices", "POST", "/day_ahead_prices", lambda i: {"country": "Spain"}),
+    ("actual_gen_type", "POST", "/actual_gen_type", lambda i: {"country": "Spain"}),
+    ("create_user", "POST", "/create_user", lambda i: {
+        "user_email": f"created{i}-{RUN_ID}@sirienergy.local", "user_name": "Benchmark",
+        "user_password": "benchmark", "community": COMMUNITY}),
+    ("add_consumption", "POST", "/add_consumption", lambda i: {
+        "user_email": USERS[i % len(USERS)], "date": TODAY, "hour": f"{i % 24:02d}:00", "value": 0.5}),
+    ("add_production", "POST", "/add_production", lambda i: {
+        "user_email": USERS[i % len(USERS)], "date": TODAY, "hour": f"{i % 24:02d}:00", "value": 0.8}),
+    ("add_readings_batch", "POST", "/add_readings_batch", lambda i: {"readings": [
+        {"user_email": user, "date": TODAY, "hour": f"{hour:02d}:00", "kind": "consumption", "value": 0.1}
+        for user in USERS for hour in range(24)]}),
+    ("get_production_day", "POST", "/get_production_day", lambda i: {"email": USERS[i % len(USERS)]}),
+    ("get_consumption_day", "POST", "/get_consumption_day", lambda i: {"email": USERS[i % len(USERS)]}),
+    ("get_surplus_day", "POST", "/get_surplus_day", lambda i: {"email": USERS[i % len(USERS)]}),
+    ("get_production_range", "POST", "/get_production_range", lambda i: {
+        "email": USERS[i % len(USERS)], "start_date": MONTH_START, "end_date": TODAY, "resolution": "day"}),
+    ("get_consumption_range", "POST", "/get_consumption_range", lambda i: {
+        "email": USERS[i % len(USERS)], "start_date": MONTH_START, "end_date": TODAY, "resolution": "day"}),
+    ("get_surplus_range", "POST", "/get_surplus_range", lambda i: {
+        "email": USERS[i % len(USERS)], "start_date": MONTH_START, "end_date": TODAY, "resolution": "day"}),
+    ("create_community", "POST", "/create_community", lambda i: {"community": f"{COMMUNITY}-{i}"}),
+    ("set_user_community", "POST", "/set_user_community", lambda i: {"email": USERS[i % len(USERS)], "community": COMMUNITY}),
+    ("get_community_day", "POST", "/get_community_day", lambda i: {"community": COMMUNITY, "date": TODAY}),
+    ("get_community_range", "POST", "/get_community_range", lambda i: {
+        "community": COMMUNITY, "start_date": MONTH_START, "end_date": TODAY, "resolution": "day"}),
+    ("set_sharing_coefficients", "POST", "/set_sharing_coefficients", lambda i: {
+        "community": COMMUNITY, "coefficients": {user: round(1 / len(USERS), 4) for user in USERS}}),
+    ("compute_sharing", "POST", "/compute_sharing", lambda i: {"community": COMMUNITY, "month": MONTH}),
+    ("get_sharing", "POST", "/get_sharing", lambda i: {"community": COMMUNITY, "month": MONTH, "email": USERS[i % len(USERS)]}),
+]
+
+def use_fakeredis():
+    # Every connection the app opens (CEC, shared cache, weather cache) shares one in-process server
+    import fakeredis
+    import redis
+    server = fakeredis.FakeServer()
+
+    class BenchmarkRedis(fakeredis.FakeStrictRedis):
+        def __init__(self, *args, **kwargs):
+            kwargs.pop('host', None)
+            kwargs.pop('port', None)
+            super().__init__(*args, server=server, **kwargs)
+
+    redis.StrictRedis = redis.Redis = BenchmarkRedis
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def configure(args, stub_url):
+    # Config is read from the environment on import, so this runs before anything imports the app
+    os.environ['ENTSOE_API_URL'] = f"{stub_url}/api"
+    os.environ['OPEN_METEO_URL'] = f"{stub_url}/v1/forecast"
+    os.environ.setdefault('ENTSO_E_API_KEY', 'benchmark')
+    os.environ['PREFETCH_ENABLED'] = '0'
+    os.environ['WEATHER_CACHE_BACKEND'] = 'memory'
+    os.environ['WEATHER_RECORDINGS_DIR'] = ''
+    if args.redis == 'fakeredis':
+        use_fakeredis()
+    else:
+        url = urlsplit(args.redis)
+        os.environ['REDIS_HOST'] = url.hostname or 'localhost'
+        os.environ['REDIS_PORT'] = str(url.port or 6379)
+
+def start_app():
+    """
+    Serves the app of create_app() with the threaded Werkzeug server.
+
+    Input: None
+    Output:
+        str: The base URL of the app.
+    """
+    from werkzeug.serving import make_server
+    from app import create_app
+    # The access log of every request would flood the results
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, create_app(), threaded=True)
+    threading.Thread(target=server.serve_forever, name="benchmark-app", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+_sessions = threading.local()
+
+def send(base_url, method, path, payload):
+    # One keep-alive session per client thread
+    session = getattr(_sessions, 'session', None)
+    if session is None:
+        session = _sessions.session = requests.Session()
+    start = time.perf_counter()
+    if method == 'GET':
+        response = session.get(base_url + path, params=payload)
+    else:
+        response = session.post(base_url + path, json=payload)
+    return time.perf_counter() - start, response.status_code
+
+def seed(base_url):
+    """
+    Creates the benchmark community and users with a month of readings, so the read
+    endpoints have data to aggregate.
+
+    Input:
+        base_url (str): The base URL of the app.
+
+    Output: None
+    """
+    send(base_url, 'POST', '/create_community', {"community": COMMUNITY})
+    for user in USERS:
+        send(base_url, 'POST', '/create_user', {"user_email": user, "user_name": "Benchmark",
+                                                "user_password": "benchmark", "community": COMMUNITY})
+    day, readings = datetime.strptime(MONTH_START, "%Y-%m-%d"), []
+    while day.strftime("%Y-%m-%d") <= TODAY:
+        for user in USERS:
+            for hour in range(24):
+                readings.append({"user_email": user, "date": day.strftime("%Y-%m-%d"), "hour": f"{hour:02d}:00",
+                                 "kind": "consumption", "value": 0.4})
+                readings.append({"user_email": user, "date": day.strftime("%Y-%m-%d"), "hour": f"{hour:02d}:00",
+                                 "kind": "production", "value": max(0.0, 1 - abs(hour - 13) / 6)})
+        day += timedelta(days=1)
+    send(base_url, 'POST', '/add_readings_batch', {"readings": readings})
+
+def benchmark_endpoint(base_url, method, path, body, requests_count, concurrency, warmup):
+    """
+    Measures one endpoint: the first (cold) request alone, then warm-up requests and
+    the measured requests from concurrent clients.
+
+    Input:
+        base_url (str): The base URL of the app.
+        method (str): 'GET' or 'POST'.
+        path (str): The endpoint path.
+        body (callable): The body (or query) of the i-th request.
+        requests_count (int): The number of measured requests.
+        concurrency (int): The number of concurrent clients.
+        warmup (int): The number of requests before measuring.
+
+    Output:
+        dict: The throughput, latency percentiles (milliseconds) and status codes.
+    """
+    cold, _ = send(base_url, method, path, body(0))
+    for i in range(1, warmup + 1):
+        send(base_url, method, path, body(i))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(lambda i: send(base_url, method, path, body(i)),
+                                    range(warmup + 1, warmup + 1 + requests_count)))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array([latency for latency, _ in results]) * 1000
+    statuses = [status for _, status in results]
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        "requests": requests_count,
+        "errors": sum(status >= 400 for status in statuses),
+        "status": {str(status): statuses.count(status) for status in sorted(set(statuses))},
+        "throughput_rps": round(requests_count / elapsed, 1),
+        "cold_ms": round(cold * 1000, 2),
+        "mean_ms": round(float(latencies.mean()), 2),
+        "p50_ms": round(float(p50), 2),
+        "p95_ms": round(float(p95), 2),
+        "p99_ms": round(float(p99), 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--redis', default='fakeredis', help="'fakeredis' or a Redis Stack URL (redis://host:port)")
+    parser.add_argument('--requests', type=int, default=200, help="Measured requests per endpoint")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--upstream-latency-ms', type=float, default=0, help="Time added to every stub response")
+    parser.add_argument('--endpoints', nargs='*', help="Names of the endpoints to run (all by default)")
+    parser.add_argument('--output', default='benchmark_results.json')
+    args = parser.parse_args()
+
+    port = free_port()
+    configure(args, f"http://127.0.0.1:{port}")
+    from benchmarks.upstream_stub import start_stub
+    start_stub(port, args.upstream_latency_ms)
+    base_url = start_app()
+    seed(base_url)
+
+    results = {}
+    for name, method, path, body in ENDPOINTS:
+        if args.endpoints and name not in args.endpoints:
+            continue
+        results[name] = benchmark_endpoint(base_url, method, path, body, args.requests, args.concurrency, args.warmup)
+        result = results[name]
+        print(f"{name:26} {result['throughput_rps']:8.1f} req/s  p50 {result['p50_ms']:8.2f} ms  "
+              f"p95 {result['p95_ms']:8.2f} ms  p99 {result['p99_ms']:8.2f} ms  cold {result['cold_ms']:8.2f} ms"
+              + (f"  errors {result['errors']}" if result['errors'] else ""))
+
+    report = {
+        "run": {
+            "timestamp": datetime.now().isoformat(timespec='seconds'),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "redis": args.redis,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "warmup": args.warmup,
+            "upstream_latency_ms": args.upstream_latency_ms,
+        },
+        "endpoints": results,
+    }
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Compares the old ENTSO-E response handling (xmltodict, a JSON round trip and walking
+the nested dicts) with the streaming parser on the XML fixtures of benchmarks/fixtures,
+and checks that both give the same result.
+
+Run from the sirienergy folder (pip install -r benchmarks/requirements.txt):
+    python -m benchmarks.entsoe_parser_benchmark --repeat 200
+"""
+import argparse
+import json
+import os
+import time
+from datetime import datetime
+import xmltodict
+from app.models.ENTSOE_models import load_entsoe_gentype_names
+from app.models.entsoe_parser import parse_market_document, price_points, latest_generation
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+def legacy_price_points(content):
+    """
+    Day-ahead price handling as done before the streaming parser.
+
+    Input:
+        content (bytes): An A44 document.
+
+    Output:
+        list: The PT60M price points.
+    """
+    data_json = json.loads(json.dumps(xmltodict.parse(content)))
+    time_series_list = data_json['Publication_MarketDocument'].get('TimeSeries', [])
+    if isinstance(time_series_list, list):
+        for time_series in time_series_list:
+            if time_series['Period']['resolution'] == 'PT60M':
+                return time_series['Period']['Point']
+        return []
+    if time_series_list['Period']['resolution'] == 'PT60M':
+        return time_series_list['Period']['Point']
+    return []
+
+def legacy_generation(content, gentype_names):
+    """
+    Generation by type handling as done before the streaming parser.
+
+    Input:
+        content (bytes): An A75 document.
+        gentype_names (dict): Maps psrType keys to generation type names.
+
+    Output:
+        dict: The generation of each type in the last interval.
+    """
+    data_json = json.loads(json.dumps(xmltodict.parse(content)))
+    time_series_list = data_json['GL_MarketDocument'].get('TimeSeries', [])
+    date_format = "%Y-%m-%dT%H:%MZ"
+    last_up_time = max(datetime.strptime(time_series['Period']['timeInterval']['end'], date_format)
+                       for time_series in time_series_list)
+    last_up_time_str = last_up_time.strftime(date_format)
+    gens = {}
+    for time_series in time_series_list:
+        if last_up_time_str == time_series['Period']['timeInterval']['end']:
+            name = gentype_names[time_series['MktPSRType']['psrType']]
+            if 'inBiddingZone_Domain.mRID' in time_series:
+                gens[name] = int(time_series['Period']['Point'][-1]['quantity'])
+            else:
+                gens.setdefault(name, 0)
+    return {key: value for key, value in gens.items() if value != 0}
+
+def measure(function, repeat):
+    """
+    Runs a function several times and returns the mean time per call.
+
+    Input:
+        function (callable): The function to time (no arguments).
+        repeat (int): The number of calls.
+
+    Output:
+        float: The mean time per call in milliseconds.
+    """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    gentype_names = load_entsoe_gentype_names()
+    with open(os.path.join(FIXTURES_DIR, 'A44_day_ahead_prices.xml'), 'rb') as file:
+        prices_xml = file.read()
+    with open(os.path.join(FIXTURES_DIR, 'A75_generation_by_type.xml'), 'rb') as file:
+        generation_xml = file.read()
+
+    cases = [
+        ("A44 day-ahead prices",
+         lambda: legacy_price_points(prices_xml),
+         lambda: price_points(parse_market_document(prices_xml))),
+        ("A75 generation by type",
+         lambda: legacy_generation(generation_xml, gentype_names),
+         lambda: latest_generation(parse_market_document(generation_xml), gentype_names)),
+    ]
+    for label, legacy, streaming in cases:
+        legacy_result, streaming_result = legacy(), streaming()
+        if label.startswith("A44"):
+            # Same points, the parser writes the numbers back from floats
+            same = [(int(p['position']), float(p['price.amount'])) for p in legacy_result] == \
+                   [(int(p['position']), float(p['price.amount'])) for p in streaming_result]
+        else:
+            same = legacy_result == streaming_result
+        legacy_ms = measure(legacy, args.repeat)
+        streaming_ms = measure(streaming, args.repeat)
+        print(f"{label}: xmltodict {legacy_ms:.3f} ms, streaming {streaming_ms:.3f} ms, "
+              f"speedup x{legacy_ms / streaming_ms:.1f}, same result: {same}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+Writes synthetic Open-Meteo responses (FlatBuffers, as the API sends them) for the
+weather and PV forecast requests of a few locations, in the layout replayed by
+WEATHER_RECORDINGS_DIR. The radiation follows the clear sky with some clouds.
+
+Run from the sirienergy folder:
+    python -m benchmarks.openmeteo_fixtures
+    WEATHER_RECORDINGS_DIR=benchmarks/fixtures/openmeteo flask --app run run
+
+Real responses can be recorded instead with WEATHER_RECORDINGS_MODE=record.
+"""
+import argparse
+import os
+import flatbuffers
+import numpy as np
+import pandas as pd
+import pvlib
+import requests
+from openmeteo_sdk.Unit import Unit
+from openmeteo_sdk.Variable import Variable
+from app.config import Config
+from app.models.weather_model import RADIATION_VARIABLES, recording_name, round_coordinate
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures', 'openmeteo')
+
+# Locations of the fixtures (latitude, longitude, timezone)
+LOCATIONS = [
+    (41.61, 0.62, 'Europe/Madrid'),
+    (41.39, 2.17, 'Europe/Madrid'),
+    (52.52, 13.40, 'Europe/Berlin'),
+]
+
+# Open-Meteo variable and unit of each requested name
+VARIABLES = {
+    "weather_code": (Variable.weather_code, Unit.wmo_code),
+    "shortwave_radiation": (Variable.shortwave_radiation, Unit.watt_per_square_metre),
+    "direct_radiation": (Variable.direct_radiation, Unit.watt_per_square_metre),
+    "diffuse_radiation": (Variable.diffuse_radiation, Unit.watt_per_square_metre),
+    "temperature_2m": (Variable.temperature, Unit.celsius),
+}
+
+def encode_response(latitude, longitude, utc_offset, start, hours, values):
+    """
+    Encodes a size-prefixed WeatherApiResponse with hourly variables.
+
+    Input:
+        latitude, longitude (float): The location.
+        utc_offset (int): The UTC offset of the location in seconds.
+        start (int): The first hour (UTC epoch seconds).
+        hours (int): The number of hours.
+        values (dict): The values of each name of VARIABLES.
+
+    Output:
+        bytes: The response body.
+    """
+    builder = flatbuffers.Builder(1024)
+    variables = []
+    for name, array in values.items():
+        variable, unit = VARIABLES[name]
+        builder.StartVector(4, len(array), 4)
+        for value in reversed(np.asarray(array, dtype=np.float32)):
+            builder.PrependFloat32(float(value))
+        vector = builder.EndVector()
+        # VariableWithValues: variable, unit, value, values
+        builder.StartObject(4)
+        builder.PrependUint8Slot(0, variable, 0)
+        builder.PrependUint8Slot(1, unit, 0)
+        builder.PrependUOffsetTRelativeSlot(3, vector, 0)
+        variables.append(builder.EndObject())
+
+    builder.StartVector(4, len(variables), 4)
+    for variable in reversed(variables):
+        builder.PrependUOffsetTRelative(variable)
+    vector = builder.EndVector()
+    # VariablesWithTime: time, time_end, interval, variables
+    builder.StartObject(4)
+    builder.PrependInt64Slot(0, start, 0)
+    builder.PrependInt64Slot(1, start + hours * 3600, 0)
+    builder.PrependInt32Slot(2, 3600, 0)
+    builder.PrependUOffsetTRelativeSlot(3, vector, 0)
+    hourly = builder.EndObject()
+
+    # WeatherApiResponse: latitude, longitude, ..., utc_offset_seconds (6), ..., hourly (11)
+    builder.StartObject(15)
+    builder.PrependFloat32Slot(0, latitude, 0)
+    builder.PrependFloat32Slot(1, longitude, 0)
+    builder.PrependInt32Slot(6, utc_offset, 0)
+    builder.PrependUOffsetTRelativeSlot(11, hourly, 0)
+    builder.FinishSizePrefixed(builder.EndObject())
+    return bytes(builder.Output())
+
+def fixture_name(params):
+    # Same name as RecordedAdapter gives the request the client sends
+    request = requests.Request('GET', Config.OPEN_METEO_URL, params={**params, "format": "flatbuffers"}).prepare()
+    return recording_name(request.path_url)
+
+def synthetic_weather(latitude, longitude, timezone, day, days):
+    """
+    Computes hourly weather for some days from local midnight: clear-sky radiation
+    with a cloud pattern, a daily temperature cycle and matching weather codes.
+
+    Input:
+        latitude, longitude (float): The location.
+        timezone (str): The timezone of the location.
+        day (str): The first day ("YYYY-MM-DD").
+        days (int): The number of days.
+
+    Output:
+        tuple: The first hour (UTC epoch seconds), the UTC offset in seconds and the values of each name.
+    """
+    times = pd.date_range(start=day, periods=24 * days, freq='1h', tz=timezone)
+    clearsky = pvlib.location.Location(latitude, longitude, tz=timezone).get_clearsky(times, model='ineichen')
+    hour = np.arange(len(times))
+    clouds = 0.5 + 0.5 * np.abs(np.sin(hour / 7 + latitude))
+    values = {
+        "shortwave_radiation": clearsky['ghi'].to_numpy() * clouds,
+        "direct_radiation": clearsky['ghi'].to_numpy() * clouds * 0.8,
+        "diffuse_radiation": clearsky['ghi'].to_numpy() * clouds * 0.2,
+        "temperature_2m": 18 + 7 * np.sin((hour % 24 - 9) / 24 * 2 * np.pi),
+        "weather_code": np.select([clouds > 0.9, clouds > 0.7], [0, 2], 3),
+    }
+    utc_offset = int(times[0].utcoffset().total_seconds())
+    return int(times[0].timestamp()), utc_offset, values
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--day', default='2024-06-21')
+    parser.add_argument('--output', default=FIXTURES_DIR)
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    for latitude, longitude, timezone in LOCATIONS:
+        latitude, longitude = round_coordinate(latitude), round_coordinate(longitude)
+        requests_params = [
+            # get_weather (7 days of weather codes)
+            ({"latitude": latitude, "longitude": longitude, "hourly": "weather_code", "timezone": timezone}, 7, ["weather_code"]),
+            # fetch_radiation_forecast (today)
+            ({"latitude": latitude, "longitude": longitude, "hourly": list(RADIATION_VARIABLES), "timezone": timezone,
+              "forecast_days": 1}, 1, list(RADIATION_VARIABLES)),
+        ]
+        for params, days, names in requests_params:
+            start, utc_offset, values = synthetic_weather(latitude, longitude, timezone, args.day, days)
+            body = encode_response(latitude, longitude, utc_offset, start, 24 * days, {name: values[name] for name in names})
+            with open(os.path.join(args.output, fixture_name(params)), 'wb') as file:
+                file.write(body)
+        print(f"{latitude}, {longitude} ({timezone}): weather and radiation written")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Compares the ops/sec of the old client-side consumption upsert (JSON.GET checks,
+JSON.SET and JSON.NUMINCRBY from Python) with the server-side upsert script.
+
+Needs a local Redis Stack (RedisJSON), e.g.:
+    docker run -d -p 6379:6379 redis/redis-stack-server
+Run from the sirienergy folder:
+    python -m benchmarks.upsert_benchmark --operations 5000 --workers 4
+"""
+import argparse
+import threading
+import time
+from app.models.CEC_model import RedisModel
+
+BENCH_EMAIL = "benchmark@sirienergy.local"
+
+def legacy_add_consumption(client, user_email, date, hour, value):
+    """
+    Client-side upsert as done before the upsert script (3 to 6 round trips).
+    
+    Input:
+        client (redis.Redis): The Redis connection.
+        user_email (str): The email of the user.
+        date (str): The date of the record.
+        hour (str): The hour of the record.
+        value (float): The value to be added.
+    
+    Output:
+        None
+    """
+    key = f"user:{user_email}"
+    base_path = "$.user_consumption"
+    existing_data = client.execute_command('JSON.GET', key, base_path)
+    if existing_data is None or existing_data == "[]":
+        client.execute_command('JSON.SET', key, base_path, "{}")
+    date_path = f"{base_path}.{date}"
+    existing_date = client.execute_command('JSON.GET', key, date_path)
+    if existing_date is None or existing_date == "[]":
+        client.execute_command('JSON.SET', key, date_path, "{}")
+    hour_path = f"{date_path}.{hour}"
+    increment = client.execute_command('JSON.NUMINCRBY', key, hour_path, value)
+    if increment is None or increment == "[]":
+        client.execute_command('JSON.SET', key, hour_path, value)
+
+def run(label, operation, operations, workers):
+    """
+    Runs an operation from several threads and prints the reached ops/sec.
+    
+    Input:
+        label (str): The name printed with the result.
+        operation (callable): Receives the operation index.
+        operations (int): Total number of operations.
+        workers (int): Number of concurrent threads.
+    
+    Output:
+        float: The measured ops/sec.
+    """
+    per_worker = operations // workers
+
+    def worker(worker_id):
+        for i in range(per_worker):
+            operation(worker_id * per_worker + i)
+
+    threads = [threading.Thread(target=worker, args=(w,)) for w in range(workers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    ops = per_worker * workers / elapsed
+    print(f"{label:<12} {per_worker * workers} ops in {elapsed:.3f} s -> {ops:,.0f} ops/sec")
+    return ops
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--operations', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    model = RedisModel()
+    model.create_user("benchmark", BENCH_EMAIL, "benchmark")
+
+    # Spread writes over a week so the date/hour creation paths are exercised too
+    def legacy(i):
+        legacy_add_consumption(model.client, BENCH_EMAIL, f"2024-01-{i % 7 + 1:02d}", f"{i % 24:02d}:00", 1)
+
+    def script(i):
+        model.add_consumption(BENCH_EMAIL, f"2024-02-{i % 7 + 1:02d}", f"{i % 24:02d}:00", 1)
+
+    try:
+        before = run("legacy", legacy, args.operations, args.workers)
+        after = run("script", script, args.operations, args.workers)
+        print(f"speedup      x{after / before:.2f}")
+    finally:
+        model.client.delete(f"user:{BENCH_EMAIL}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Local stand-in for the upstream APIs, serving the recorded fixtures of benchmarks/fixtures:
+ENTSO-E XML documents (by documentType) and Open-Meteo FlatBuffers responses (by request,
+see benchmarks.openmeteo_fixtures). Point the app at it with ENTSOE_API_URL and OPEN_METEO_URL.
+
+Run from the sirienergy folder:
+    python -m benchmarks.upstream_stub --port 8081 --latency-ms 50
+    ENTSOE_API_URL=http://127.0.0.1:8081/api OPEN_METEO_URL=http://127.0.0.1:8081/v1/forecast flask --app run run
+"""
+import argparse
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from app.models.weather_model import recording_name
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+# ENTSO-E fixture of each document type
+ENTSOE_FIXTURES = {
+    "A44": "A44_day_ahead_prices.xml",
+    "A75": "A75_generation_by_type.xml",
+}
+
+ACKNOWLEDGEMENT = b"""<?xml version="1.0" encoding="utf-8"?>
+<Acknowledgement_MarketDocument xmlns="urn:iec62325.351:tc57wg16:451-1:acknowledgementdocument:7:0">
+    <Reason><code>999</code><text>No matching data found (benchmark stub)</text></Reason>
+</Acknowledgement_MarketDocument>"""
+
+class UpstreamStubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    latency = 0.0
+
+    def send_body(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        # Simulated network and server time of the real API
+        if self.latency:
+            time.sleep(self.latency)
+        url = urlsplit(self.path)
+        if url.path.endswith('/api'):
+            document_type = parse_qs(url.query).get('documentType', [None])[0]
+            if document_type not in ENTSOE_FIXTURES:
+                return self.send_body(200, 'text/xml', ACKNOWLEDGEMENT)
+            with open(os.path.join(FIXTURES_DIR, ENTSOE_FIXTURES[document_type]), 'rb') as file:
+                return self.send_body(200, 'text/xml', file.read())
+        if url.path.endswith('/forecast'):
+            path = os.path.join(FIXTURES_DIR, 'openmeteo', recording_name(self.path))
+            if not os.path.exists(path):
+                return self.send_body(404, 'application/json', b'{"error": true, "reason": "No recorded response"}')
+            with open(path, 'rb') as file:
+                return self.send_body(200, 'application/octet-stream', file.read())
+        self.send_body(404, 'text/plain', b'Not found')
+
+    def log_message(self, format, *args):
+        pass
+
+def start_stub(port=0, latency_ms=0):
+    """
+    Starts the stub server in a background thread.
+
+    Input:
+        port (int, optional): The port (0 for any free port).
+        latency_ms (float, optional): Time added to every response in milliseconds.
+
+    Output:
+        ThreadingHTTPServer: The running server (server.server_port is its port).
+    """
+    handler = type('Handler', (UpstreamStubHandler,), {'latency': latency_ms / 1000})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="upstream-stub", daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    args = parser.parse_args()
+    server = start_stub(args.port, args.latency_ms)
+    print(f"Upstream stub on http://127.0.0.1:{server.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()